@@ -1,10 +1,33 @@
 import frappe
 from werkzeug.wrappers import Response
+import hashlib
 import json
 
 SETTINGS_DOCTYPE="Frappe Notifier Settings"
+CONFIG_CACHE_KEY="fn_get_config"
+# Browsers and CDNs may reuse the config for this long before revalidating with the ETag
+CONFIG_MAX_AGE=300
+
 @frappe.whitelist(methods=["GET"],allow_guest=True)
 def get_config():
+    payload=get_config_payload()
+
+    response = Response(payload["body"], content_type='application/json')
+    response.set_etag(payload["etag"])
+    response.cache_control.public = True
+    response.cache_control.max_age = CONFIG_MAX_AGE
+    # Answers If-None-Match with a 304 when the config is unchanged
+    return response.make_conditional(frappe.request)
+
+def get_config_payload():
+    """
+    Returns the serialized config and its ETag.
+    Built once and cached until Frappe Notifier Settings is saved.
+    """
+    payload=frappe.cache.get_value(CONFIG_CACHE_KEY)
+    if payload:
+        return payload
+
     vapid_key=frappe.db.get_single_value(SETTINGS_DOCTYPE,"vapid_public_key");
     firebase_config_json=frappe.db.get_single_value(SETTINGS_DOCTYPE,"firebase_config");
 
@@ -14,6 +37,13 @@ def get_config():
         "vapid_public_key":vapid_key,
         "config":firebase_config
     }
-    response = Response(json.dumps(data), content_type='application/json')
-    response.status_code = 200
-    return response
\ No newline at end of file
+    body=json.dumps(data)
+    payload={
+        "body":body,
+        "etag":hashlib.sha256(body.encode()).hexdigest()[:32]
+    }
+    frappe.cache.set_value(CONFIG_CACHE_KEY,payload)
+    return payload
+
+def clear_config_cache():
+    frappe.cache.delete_value(CONFIG_CACHE_KEY)
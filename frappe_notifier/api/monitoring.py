@@ -0,0 +1,21 @@
+import frappe
+from frappe_notifier.utils.rate_limiter import get_bucket_levels
+from frappe_notifier.utils.token_cache import get_cache_stats
+
+MONITORING_ROLES = ("System Manager", "FN Notification Manager")
+
+@frappe.whitelist()
+def token_cache_stats():
+    """
+    Returns token cache hit/miss counters for this worker and across all workers.
+    """
+    frappe.only_for(MONITORING_ROLES)
+    return get_cache_stats()
+
+@frappe.whitelist()
+def rate_limit_buckets():
+    """
+    Returns the fill level of every active rate limit bucket, emptiest first.
+    """
+    frappe.only_for(MONITORING_ROLES)
+    return get_bucket_levels()
@@ -1,18 +1,56 @@
 import frappe
 import json
-from typing import List, Dict, Any, Optional
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from typing import List, Dict, Any, Callable, Optional
+from zoneinfo import ZoneInfo
 from firebase_admin import messaging, exceptions, _apps, initialize_app
+from frappe.utils import add_to_date, cint, get_datetime, get_system_timezone, now_datetime
 from frappe_notifier.utils.normalize_to_https import normalize_url_to_https
 from frappe_notifier.utils.normalize_topic_name import normalize_topic_name
-from frappe_notifier.utils.firebase import initialize_firebase_app, get_user_tokens
+from frappe_notifier.utils.firebase import initialize_firebase_app, get_user_tokens, load_active_user_tokens
+from frappe_notifier.utils.settings import get_send_queue, get_settings
+from frappe_notifier.utils.log_writer import insert_delivery_results, insert_logs, update_log_status
+from frappe_notifier.utils.fcm_sender import get_fcm_sender
+from frappe_notifier.utils.fcm_async import AsyncFCMSender
+from frappe_notifier.utils.decorators import idempotent_send
+from frappe_notifier.utils.idempotency import remember_log_name
+from frappe_notifier.utils.coalescer import add_to_digest, get_coalesce_window, get_collapse_key, get_digest_group, pop_digest
+from frappe_notifier.utils.delayed_jobs import enqueue_due_jobs, schedule_job
+from frappe_notifier.utils.token_health import INVALID_TOKEN_ERRORS, RETRYABLE_ERRORS, is_token_failure, record_token_failures
+from frappe_notifier.utils.rate_limiter import acquire, check_rate_limit, get_rate_limit
 from frappe_notifier.frappe_notifier.doctype.fn_notification_topic.fn_notification_topic import get_channel_tokens_exclue_sender
-from frappe_notifier.frappe_notifier.doctype.fn_user_device_token.fn_user_device_token import deactivate_device_token
+from frappe_notifier.frappe_notifier.doctype.fn_user_device_token.fn_user_device_token import deactivate_device_tokens
+from frappe_notifier.frappe_notifier.doctype.fn_scheduled_notification.fn_scheduled_notification import schedule_notification, spread_send_at
 
 
 SETTINGS_DOCTYPE = "Frappe Notifier Settings"
 USER_TOKEN_DOCTYPE = "FN User Device Token"
 NOTIFICATION_LOG_DOCTYPE = "FN Notification Log"
 
+# FCM rejects multicast messages with more than 500 tokens
+FCM_MULTICAST_LIMIT = 500
+DEFAULT_BATCH_WORKERS = 4
+# Error codes stored per token in FN Notification Delivery
+FCM_ERROR_CODES = {
+    messaging.UnregisteredError: "UNREGISTERED",
+    messaging.SenderIdMismatchError: "SENDER_ID_MISMATCH",
+    messaging.QuotaExceededError: "QUOTA_EXCEEDED",
+    messaging.ThirdPartyAuthError: "THIRD_PARTY_AUTH_ERROR",
+}
+CANONICAL_ERROR_CODES = ("INVALID_ARGUMENT", "UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED")
+BULK_MAX_ITEMS = 1000
+# Also the webpush Urgency header values they map to
+PRIORITIES = ("high", "normal", "low")
+# FCM keeps undelivered messages for at most four weeks
+MAX_TTL = 28 * 24 * 60 * 60
+DEFAULT_RETRY_BASE_DELAY = 10
+DEFAULT_RETRY_MAX_DELAY = 60 * 60
+
 class NotificationError(Exception):
     """Base exception for notification related errors"""
     pass
@@ -31,20 +69,21 @@ def create_notification_log(
     body: str,
     notification_data: Dict[str, Any],
     status: str = "Pending",
-    error_message: str = None
+    error_message: str = None,
+    sync: bool = False
 ) -> str:
-    """Create a notification log entry"""
-    log = frappe.get_doc({
-        "doctype": NOTIFICATION_LOG_DOCTYPE,
+    """
+    Create a notification log entry.
+    The row may be buffered; pass sync=True when it has to exist in the database right away.
+    """
+    return insert_logs([{
         "status": status,
         "notification_type": notification_type,
         "title": title,
         "body": body,
-        "notification_data": json.dumps(notification_data),
+        "notification_data": notification_data,
         "error_message": error_message
-    })
-    log.insert()
-    return log.name
+    }], sync=sync)[0]
 
 def update_notification_log(
     log_name: str,
@@ -52,11 +91,7 @@ def update_notification_log(
     error_message: str = None
 ) -> None:
     """Update a notification log entry"""
-    log = frappe.get_doc(NOTIFICATION_LOG_DOCTYPE, log_name)
-    log.status = status
-    if error_message:
-        log.error_message = error_message
-    log.save()
+    update_log_status(log_name, status, error_message)
 
 def validate_notification_data(data: Dict[str, Any]) -> None:
     """Validate notification data"""
@@ -67,38 +102,21 @@ def validate_notification_data(data: Dict[str, Any]) -> None:
     #     raise InvalidInputError(f"Missing required fields in notification data: {', '.join(missing_fields)}")
     pass
 
-def send_notification(
-    tokens: List[str],
+def build_webpush_config(
     title: str,
     body: str | None,
     notification_icon: str = "",
     click_action: Optional[str] = None,
     base_url: Optional[str] = None,
-    deactivate_invalid_tokens: bool = False
-) -> Dict[str, Any]:
+    tag: Optional[str] = None,
+    priority: Optional[str] = None,
+    expires_at: Optional[float] = None
+) -> messaging.WebpushConfig:
     """
-    Send multicast notification and handle errors.
-    
-    Args:
-        tokens: List of device tokens to send notification to
-        title: Notification title
-        body: Notification body (optional)
-        notification_icon: Icon URL for notification
-        click_action: Optional click action URL
-        base_url: Optional base URL
-        deactivate_invalid_tokens: Whether to deactivate invalid tokens (for user notifications)
-    
-    Returns:
-        Dictionary with success status, counts, and response details
+    Build the webpush config shared by every message of a send.
+    A tag collapses the push with earlier ones carrying the same tag, on the device and at the push service.
+    priority becomes the Urgency header, and expires_at the TTL header with the time left until then.
     """
-    if not tokens:
-        return {
-            "success": False,
-            "success_count": 0,
-            "failure_count": 0,
-            "responses": []
-        }
-    
     # Build notification data
     notification_data = {}
     if base_url:
@@ -122,86 +140,737 @@ def send_notification(
     webpush_config = messaging.WebpushConfig(
         notification=webpush_notification,
     )
+
+    headers = {}
+    if tag:
+        webpush_notification.tag = tag
+        webpush_notification.renotify = True
+        headers["Topic"] = tag
+    if priority:
+        headers["Urgency"] = priority
+    if expires_at is not None:
+        headers["TTL"] = str(max(int(expires_at - time.time()), 0))
+    if headers:
+        webpush_config.headers = headers
     
     # Add FCM options if click_action is provided
     if click_action:
         webpush_config.fcm_options = messaging.WebpushFCMOptions(
             link=click_action
         )
+    return webpush_config
+
+def chunk_list(items: List[Any], size: int = FCM_MULTICAST_LIMIT) -> List[List[Any]]:
+    """Split tokens or messages into batches FCM accepts in a single call"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def run_batches(
+    batches: List[List[Any]],
+    send_batch: Callable[[List[Any]], messaging.BatchResponse]
+) -> List[messaging.SendResponse]:
+    """
+    Send batches concurrently on a bounded thread pool.
+    The returned responses are in the same order as the batched items.
+    """
+    if len(batches) == 1:
+        return send_batch(batches[0]).responses
+
+    max_workers = min(len(batches), cint(get_settings().fcm_batch_workers) or DEFAULT_BATCH_WORKERS)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batch_responses = list(executor.map(send_batch, batches))
+    return [result for batch_response in batch_responses for result in batch_response.responses]
+
+def send_multicast_batches(
+    tokens: List[str],
+    webpush_config: messaging.WebpushConfig
+) -> List[messaging.SendResponse]:
+    """Send a multicast in concurrent batches of at most 500 tokens"""
+    sender = get_fcm_sender()
+    if isinstance(sender, AsyncFCMSender):
+        return send_message_batches([messaging.Message(webpush=webpush_config, token=token) for token in tokens])
+
+    def send_batch(batch_tokens: List[str]) -> messaging.BatchResponse:
+        return sender.send_each_for_multicast(
+            messaging.MulticastMessage(webpush=webpush_config, tokens=batch_tokens)
+        )
+
+    return run_batches(chunk_list(tokens), send_batch)
+
+def send_message_batches(messages: List[messaging.Message]) -> List[messaging.SendResponse]:
+    """Send individual messages in concurrent batches of at most 500 messages"""
+    sender = get_fcm_sender()
+    if isinstance(sender, AsyncFCMSender):
+        # One pass on the event loop; the engine's semaphore bounds the requests in flight
+        return sender.send_each(messages).responses
+    return run_batches(chunk_list(messages), sender.send_each)
+
+def handle_failed_tokens(
+    tokens: List[str],
+    responses: List[messaging.SendResponse],
+    shared_payload: bool = False
+) -> None:
+    """
+    Deactivate tokens FCM reports as invalid with one bulk update.
+    When every token was sent the same payload and some of them got it, INVALID_ARGUMENT
+    failures are about the token and count towards Max Token Failures.
+    Every failure is also kept per token in FN Notification Delivery.
+    """
+    invalid_tokens = [
+        token for token, result in zip(tokens, responses)
+        if isinstance(result.exception, INVALID_TOKEN_ERRORS)
+    ]
+    for batch in chunk_list(invalid_tokens):
+        deactivate_device_tokens(batch)
+
+    if shared_payload and any(result.success for result in responses):
+        record_token_failures([
+            token for token, result in zip(tokens, responses)
+            if is_token_failure(result.exception)
+        ])
+
+def get_error_code(error: Exception | None) -> str:
+    """The FN Notification Delivery error code of a send result, empty for a successful send"""
+    if error is None:
+        return ""
+    for error_type, code in FCM_ERROR_CODES.items():
+        if isinstance(error, error_type):
+            return code
+    code = getattr(error, "code", None)
+    return code if code in CANONICAL_ERROR_CODES else "UNKNOWN"
+
+def get_retryable_failures(
+    tokens: List[str],
+    responses: List[messaging.SendResponse]
+) -> tuple[List[str], float]:
+    """Tokens whose send failed with a transient error, and the longest Retry-After FCM asked for"""
+    retry_tokens = []
+    retry_after = 0.0
+    for token, result in zip(tokens, responses):
+        if isinstance(result.exception, RETRYABLE_ERRORS):
+            retry_tokens.append(token)
+            retry_after = max(retry_after, get_retry_after(result.exception))
+    return retry_tokens, retry_after
+
+def get_retry_after(error: exceptions.FirebaseError) -> float:
+    """Seconds FCM asked to wait in the Retry-After header of a failed response, if any"""
+    response = getattr(error, "http_response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return 0.0
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def get_retry_delay(attempt: int, retry_after: float = 0) -> float:
+    """
+    Exponential backoff for the given retry attempt with equal jitter, so a wave of
+    failures is spread over the upper half of the backoff window instead of coming back at once.
+    Never shorter than the Retry-After FCM asked for.
+    """
+    settings = get_settings()
+    base_delay = cint(settings.retry_base_delay) or DEFAULT_RETRY_BASE_DELAY
+    max_delay = cint(settings.retry_max_delay) or DEFAULT_RETRY_MAX_DELAY
+    delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+    return max(delay / 2 + random.uniform(0, delay / 2), retry_after)
+
+def send_notification(
+    tokens: List[str],
+    title: str,
+    body: str | None,
+    notification_icon: str = "",
+    click_action: Optional[str] = None,
+    base_url: Optional[str] = None,
+    deactivate_invalid_tokens: bool = False,
+    tag: Optional[str] = None,
+    priority: Optional[str] = None,
+    expires_at: Optional[float] = None
+) -> Dict[str, Any]:
+    """
+    Send multicast notification and handle errors.
+    Token lists larger than the FCM multicast limit are sent in concurrent batches.
     
-    message = messaging.MulticastMessage(
-        webpush=webpush_config,
-        tokens=tokens
+    Args:
+        tokens: List of device tokens to send notification to
+        title: Notification title
+        body: Notification body (optional)
+        notification_icon: Icon URL for notification
+        click_action: Optional click action URL
+        base_url: Optional base URL
+        deactivate_invalid_tokens: Whether to deactivate invalid tokens (for user notifications)
+        tag: Optional collapse tag shared with earlier pushes it replaces
+        priority: Optional webpush urgency (high, normal or low)
+        expires_at: Optional Unix time after which the push service drops the message
+    
+    Returns:
+        Dictionary with success status, counts, and response details
+    """
+    if not tokens:
+        return {
+            "success": False,
+            "success_count": 0,
+            "failure_count": 0,
+            "responses": []
+        }
+    
+    webpush_config = build_webpush_config(
+        title=title,
+        body=body,
+        notification_icon=notification_icon,
+        click_action=click_action,
+        base_url=base_url,
+        tag=tag,
+        priority=priority,
+        expires_at=expires_at
     )
     
     try:
-        response = messaging.send_each_for_multicast(message)
-        success_count = sum(1 for result in response.responses if result.success)
+        responses = send_multicast_batches(tokens, webpush_config)
+        success_count = sum(1 for result in responses if result.success)
         failure_count = len(tokens) - success_count
         
         # Handle invalid tokens if enabled
         if deactivate_invalid_tokens and failure_count > 0:
-            for token, result in zip(tokens, response.responses):
-                error = str(result.exception) if result.exception else None
-                if not result.success and error:
-                    if (
-                        "NotRegistered" in error or
-                        "Requested entity was not found" in error
-                    ):
-                        deactivate_device_token(token)
-                    else:
-                        frappe.log_error(
-                            title="FCM Multicast Error",
-                            message=json.dumps({
-                                "token": token,
-                                "error": error
-                            }, indent=2)
-                        )
-        
-        # Log detailed debug info for failures (user notifications)
-        if deactivate_invalid_tokens and failure_count > 0:
-            frappe.log_error(
-                title="FCM Multicast Debug",
-                message=json.dumps({
-                    "success_count": response.success_count,
-                    "failure_count": response.failure_count,
-                    "results": [
-                        {
-                            "success": r.success,
-                            "error": str(r.exception) if r.exception else None,
-                            "message_id": r.message_id
-                        }
-                        for r in response.responses
-                    ]
-                }, indent=2)
-            )
-        
+            handle_failed_tokens(tokens, responses, shared_payload=True)
+
+        retry_tokens, retry_after = get_retryable_failures(tokens, responses)
         return {
             "success": failure_count == 0,
             "success_count": success_count,
             "failure_count": failure_count,
+            "retry_tokens": retry_tokens,
+            "retry_after": retry_after,
             "responses": [
                 {
                     "token": token,
                     "success": result.success,
-                    "error": str(result.exception) if result.exception else None
+                    "error": str(result.exception) if result.exception else None,
+                    "error_code": get_error_code(result.exception)
                 }
-                for token, result in zip(tokens, response.responses)
+                for token, result in zip(tokens, responses)
             ]
         }
     except exceptions.FirebaseError as e:
         error_msg = f"Failed to send notification: {str(e)}"
         raise NotificationError(error_msg)
 
+def send_topic_message(
+    topic_name: str,
+    title: str,
+    body: str | None,
+    notification_icon: str = "",
+    tag: Optional[str] = None,
+    priority: Optional[str] = None,
+    expires_at: Optional[float] = None
+) -> str:
+    """
+    Publish a single message to an FCM topic.
+    FCM fans it out to every subscribed device, so the cost does not grow with the channel size.
+    """
+    message = messaging.Message(
+        topic=topic_name,
+        webpush=build_webpush_config(
+            title=title,
+            body=body,
+            notification_icon=notification_icon,
+            tag=tag,
+            priority=priority,
+            expires_at=expires_at
+        )
+    )
+    try:
+        return get_fcm_sender().send(message)
+    except exceptions.FirebaseError as e:
+        error_msg = f"Failed to send notification: {str(e)}"
+        raise NotificationError(error_msg) from e
+
+def publish_topic_notification(
+    log_name: str,
+    topic_name: str,
+    content: Dict[str, Any],
+    attempt: int = 0
+) -> Dict[str, Any]:
+    """
+    Publish a notification to its FCM topic and update its log. A publish that fails with a
+    transient FCM error is scheduled to be published again with the same backoff as token sends.
+    """
+    try:
+        message_id = send_topic_message(topic_name=topic_name, **content)
+    except NotificationError as e:
+        error = e.__cause__
+        if isinstance(error, RETRYABLE_ERRORS) and schedule_retry(
+            log_name, [], attempt + 1, get_retry_after(error), {**content, "topic_name": topic_name}, error_message=str(e)
+        ):
+            return {"success": True, "queued": True, "log_name": log_name}
+        raise
+
+    update_log_status(log_name, "Sent", retry_count=attempt or None)
+    return {"success": True, "log_name": log_name, "message_id": message_id}
+
+def parse_notification_data(log_name: str, data: str) -> Dict[str, Any]:
+    """Parse, validate and normalize the JSON data passed to the send endpoints"""
+    try:
+        data_dict = json.loads(data)
+    except json.JSONDecodeError as e:
+        error_msg = f"Invalid JSON data: {str(e)}"
+        update_notification_log(log_name, "Failed", error_msg)
+        raise InvalidInputError(error_msg)
+
+    validate_notification_data(data_dict)
+
+    # Normalize URLs
+    if data_dict.get("base_url"):
+        data_dict["base_url"] = normalize_url_to_https(data_dict["base_url"])
+    if data_dict.get("click_action"):
+        data_dict["click_action"] = normalize_url_to_https(data_dict["click_action"])
+
+    return data_dict
+
+def is_background_send_enabled() -> bool:
+    """Whether sends should be handed over to a background worker"""
+    return bool(get_settings().enable_background_send)
+
+def validate_sender(project_name: str | None, site_name: str | None) -> None:
+    """
+    While rate limiting is enabled every send has to name its project and site.
+    An unattributed send would land in a bucket of its own, which the default limit leaves unlimited.
+    """
+    if get_settings().enable_rate_limiting and not (project_name and site_name):
+        raise InvalidInputError("project_name and site_name are required while rate limiting is enabled")
+
+def apply_rate_limit(
+    project_name: str | None,
+    site_name: str | None,
+    count_messages: Callable[[], int]
+) -> Dict[str, Any] | None:
+    """
+    Charge a send against the rate limit of its project/site.
+    Returns the throttle the worker has to wait on when the send is over the limit and
+    queued, or None when it may go out now. Messages are only counted for limited senders.
+    """
+    if not get_rate_limit(project_name, site_name):
+        return None
+    cost = max(count_messages(), 1)
+    if check_rate_limit(project_name, site_name, cost):
+        return {"project_name": project_name, "site_name": site_name, "cost": cost}
+    return None
+
+def get_throttle(
+    project_name: str | None,
+    site_name: str | None,
+    count_messages: Callable[[], int]
+) -> Dict[str, Any] | None:
+    """The throttle a deferred send is charged against by its worker, or None when its project/site is not limited"""
+    if not get_rate_limit(project_name, site_name):
+        return None
+    return {"project_name": project_name, "site_name": site_name, "cost": max(count_messages(), 1)}
+
+def count_topic_messages(topic_name: str, from_user: str | None) -> int:
+    """How many FCM messages a topic notification turns into"""
+    if not from_user and get_settings().use_fcm_topic_messaging:
+        return 1
+    return len(get_channel_tokens_exclue_sender(topic_name, from_user))
+
+def parse_delivery_options(
+    priority: str | None,
+    ttl: int | str | None,
+    delay: float = 0
+) -> tuple[str, float | None]:
+    """
+    Validate the priority and ttl (seconds) of a send, returning the priority and the Unix time it expires at.
+    The ttl of a scheduled send starts delay seconds from now, when it is due.
+    """
+    priority = (priority or "normal").lower()
+    if priority not in PRIORITIES:
+        raise InvalidInputError(f"priority must be one of {', '.join(PRIORITIES)}")
+    if ttl in (None, ""):
+        return priority, None
+    ttl = cint(ttl)
+    if not 0 <= ttl <= MAX_TTL:
+        raise InvalidInputError(f"ttl must be between 0 and {MAX_TTL} seconds")
+    return priority, time.time() + delay + ttl
+
+def parse_send_at(send_at: str | None) -> datetime | None:
+    """
+    The system time a notification is scheduled for, or None when it is to be sent now.
+    Times without an offset are taken to be in the system timezone; times in the past send right away.
+    The Scheduled Send Spread is already applied, so the ttl is counted from the time it is sent.
+    """
+    if not send_at:
+        return None
+    try:
+        send_at = get_datetime(send_at)
+    except (ValueError, TypeError, OverflowError):
+        raise InvalidInputError("send_at must be a datetime, e.g. 2025-06-01 09:00:00 or an ISO 8601 timestamp")
+    if send_at.tzinfo:
+        send_at = send_at.astimezone(ZoneInfo(get_system_timezone())).replace(tzinfo=None)
+    return spread_send_at(send_at) if send_at > now_datetime() else None
+
+def get_send_delay(send_at: datetime | None) -> float:
+    return (send_at - now_datetime()).total_seconds() if send_at else 0
+
+def schedule_send(
+    notification_type: str,
+    log_name: str,
+    send_at: datetime,
+    priority: str,
+    sender: tuple[str | None, str | None],
+    count_messages: Callable[[], int],
+    **kwargs
+) -> Dict[str, Any]:
+    """
+    Store a notification to be enqueued at send_at. The rate limit of the sending
+    project/site is charged when it is sent rather than now, so the worker waits on the
+    messages counted here.
+    """
+    throttle = get_throttle(*sender, count_messages)
+    send_at = schedule_notification(
+        notification_type,
+        log_name,
+        send_at,
+        get_send_queue(priority),
+        priority=priority,
+        throttle=throttle,
+        **kwargs
+    )
+    return {"success": True, "queued": True, "scheduled": True, "send_at": str(send_at), "log_name": log_name}
+
+def is_expired(expires_at: float | None) -> bool:
+    return expires_at is not None and time.time() >= expires_at
+
+def enqueue_notification(notification_type: str, log_name: str, priority: str | None = None, **kwargs) -> None:
+    """
+    Enqueue a logged notification on the send queue of its priority.
+    The job is only enqueued once the log row is committed, so the worker can always find it.
+    """
+    frappe.enqueue(
+        "frappe_notifier.api.send_notification.process_queued_notification",
+        queue=get_send_queue(priority),
+        enqueue_after_commit=True,
+        notification_type=notification_type,
+        log_name=log_name,
+        priority=priority,
+        **kwargs
+    )
+
+def process_queued_notification(
+    notification_type: str,
+    log_name: str,
+    throttle: Dict[str, Any] | None = None,
+    expires_at: float | None = None,
+    **kwargs
+) -> Dict[str, Any]:
+    """
+    Background job: resolve tokens and send a notification queued by the API endpoints.
+    Sends queued for being over their rate limit are scheduled again for when their bucket
+    has refilled, rather than holding a shared worker while they wait.
+    Notifications whose ttl ran out while they waited are dropped instead of sent stale.
+    """
+    senders = {
+        "topic": send_topic_notification,
+        "user": send_user_notification,
+    }
+    try:
+        if is_expired(expires_at):
+            update_notification_log(log_name, "Expired", "The ttl ran out before the notification was sent")
+            return {"success": False, "expired": True, "log_name": log_name}
+        if throttle and (wait := acquire(**throttle)):
+            schedule_job(
+                "frappe_notifier.api.send_notification.process_queued_notification",
+                wait,
+                queue=get_send_queue(kwargs.get("priority")),
+                notification_type=notification_type,
+                log_name=log_name,
+                throttle=throttle,
+                expires_at=expires_at,
+                **kwargs
+            )
+            return {"success": True, "queued": True, "log_name": log_name}
+        kwargs["expires_at"] = expires_at
+        initialize_firebase_app()
+        return senders[notification_type](log_name=log_name, **kwargs)
+    except Exception as e:
+        update_notification_log(log_name, "Failed", str(e))
+        raise
+    finally:
+        # Release retries that came due while the workers were busy
+        enqueue_due_jobs()
+
+def send_digest(notification_type: str, target: Dict[str, Any]) -> Dict[str, Any] | None:
+    """
+    Delayed job: send the notifications held for a user or topic during its coalescing
+    window as one push. A single notification goes out as it is; several are merged into
+    "N new messages" with the newest body, and the logs of the older ones are marked Coalesced.
+    The digest is charged against the rate limit of its sender like any other queued send.
+    """
+    entries = pop_digest(notification_type, target)
+    if not entries:
+        return None
+
+    latest = entries[-1]
+    for entry in entries[:-1]:
+        update_notification_log(entry["log_name"], "Coalesced", f"Merged into {latest['log_name']}")
+
+    if notification_type == "topic":
+        project_name, site_name = latest.get("sender") or (None, None)
+
+        def count_messages():
+            return count_topic_messages(target["topic_name"], latest["data_dict"].get("from_user"))
+    else:
+        project_name, site_name = target["project_name"], target["site_name"]
+
+        def count_messages():
+            return len(get_user_tokens(**target))
+
+    return process_queued_notification(
+        notification_type,
+        latest["log_name"],
+        title=latest["title"] if len(entries) == 1 else f"{len(entries)} new messages",
+        body=latest["body"],
+        data_dict=latest["data_dict"],
+        tag=get_collapse_key(get_digest_group(notification_type, target)),
+        priority=latest.get("priority"),
+        throttle=get_throttle(project_name, site_name, count_messages),
+        expires_at=latest.get("expires_at"),
+        **target
+    )
+
+def send_topic_notification(
+    log_name: str,
+    topic_name: str,
+    title: str,
+    body: str | None,
+    data_dict: Dict[str, Any],
+    tag: str | None = None,
+    priority: str | None = None,
+    expires_at: float | None = None
+) -> Dict[str, Any]:
+    """
+    Send the notification to a channel and update its log.
+    Uses FCM topic messaging unless the sender has to be excluded, in which
+    case the channel is expanded to its members' device tokens.
+    """
+    notification_icon = data_dict.get("notification_icon", "")
+    if not data_dict.get("from_user") and get_settings().use_fcm_topic_messaging:
+        return publish_topic_notification(log_name, topic_name, {
+            "title": title,
+            "body": body,
+            "notification_icon": notification_icon,
+            "tag": tag,
+            "priority": priority,
+            "expires_at": expires_at
+        })
+
+    channel_tokens = get_channel_tokens_exclue_sender(topic_name,data_dict.get("from_user"))
+    if not channel_tokens:
+        error_msg = f"No device tokens found for channel {topic_name}"
+        update_notification_log(log_name, "Failed", error_msg)
+        return {"success": False, "message": error_msg, "log_name": log_name}
+
+    content = {
+        "title": title,
+        "body": body,
+        "notification_icon": notification_icon,
+        "click_action": None,
+        "base_url": None,
+        "tag": tag,
+        "priority": priority,
+        "expires_at": expires_at
+    }
+    response = send_notification(tokens=channel_tokens, deactivate_invalid_tokens=True, **content)
+    finish_notification_log(log_name, response, content)
+
+    return {
+        "success": True,
+        "log_name": log_name
+    }
+
+def send_user_notification(
+    log_name: str,
+    project_name: str,
+    site_name: str,
+    user_id: str,
+    title: str,
+    body: str,
+    data_dict: Dict[str, Any],
+    tag: str | None = None,
+    priority: str | None = None,
+    expires_at: float | None = None
+) -> Dict[str, Any]:
+    """Resolve the user's tokens, send the notification and update its log"""
+    tokens = get_user_tokens(project_name=project_name, site_name=site_name, user_id=user_id)
+    if not tokens:
+        error_msg = f"No device tokens found for user {user_id}"
+        update_notification_log(log_name, "Failed", error_msg)
+        return {"success": False, "message": error_msg, "log_name": log_name}
+
+    content = {
+        "title": title,
+        "body": body,
+        "notification_icon": data_dict.get("notification_icon", ""),
+        "click_action": data_dict.get("click_action"),
+        "base_url": data_dict.get("base_url"),
+        "tag": tag,
+        "priority": priority,
+        "expires_at": expires_at
+    }
+    response = send_notification(tokens=tokens, deactivate_invalid_tokens=True, **content)
+    finish_notification_log(log_name, response, content)
+
+    return {
+        "success": True,
+        "success_count": response["success_count"],
+        "failure_count": response["failure_count"],
+        "log_name": log_name,
+        "responses": response["responses"]
+    }
+
+def finish_notification_log(
+    log_name: str,
+    response: Dict[str, Any],
+    content: Dict[str, Any],
+    attempt: int = 0,
+    previous_failures: int = 0
+) -> None:
+    """
+    Update the log after a send. Tokens that failed with a transient error are scheduled
+    to be sent again, and the log only becomes Sent or Failed once no retry is pending.
+    previous_failures counts the permanent failures of earlier attempts.
+    """
+    insert_delivery_results([
+        (log_name, result["token"], result["error_code"], attempt) for result in response["responses"]
+    ])
+
+    error_msg = None
+    if response["failure_count"] > 0:
+        error_msg = f"Some notifications failed. Success: {response['success_count']}, Failures: {response['failure_count']}"
+
+    retry_tokens = response.get("retry_tokens") or []
+    permanent_failures = previous_failures + response["failure_count"] - len(retry_tokens)
+    if retry_tokens and schedule_retry(
+        log_name, retry_tokens, attempt + 1, response.get("retry_after") or 0, content, permanent_failures, error_msg
+    ):
+        return
+
+    retry_count = attempt or None
+    if response["failure_count"] > 0:
+        update_log_status(log_name, "Failed", error_msg, retry_count=retry_count)
+    elif previous_failures:
+        update_log_status(
+            log_name, "Failed", f"Some notifications failed. Failures: {previous_failures}", retry_count=retry_count
+        )
+    else:
+        update_log_status(log_name, "Sent", retry_count=retry_count)
+
+def schedule_retry(
+    log_name: str,
+    tokens: List[str],
+    attempt: int,
+    retry_after: float,
+    content: Dict[str, Any],
+    previous_failures: int = 0,
+    error_message: str | None = None
+) -> bool:
+    """
+    Schedule the given tokens to be sent again after an exponential backoff.
+    Returns False once the notification has used up its retries.
+    """
+    settings = get_settings()
+    if attempt > cint(settings.max_retries):
+        return False
+
+    delay = get_retry_delay(attempt, retry_after)
+    expires_at = content.get("expires_at")
+    if expires_at is not None and time.time() + delay >= expires_at:
+        # The push service would drop it anyway
+        return False
+    schedule_job(
+        "frappe_notifier.api.send_notification.retry_notification",
+        delay,
+        queue=get_send_queue(content.get("priority")),
+        log_name=log_name,
+        tokens=tokens,
+        attempt=attempt,
+        content=content,
+        previous_failures=previous_failures
+    )
+    update_log_status(
+        log_name,
+        "Retrying",
+        error_message,
+        retry_count=attempt,
+        next_retry_at=add_to_date(now_datetime(), seconds=delay, as_string=True, as_datetime=True)
+    )
+    return True
+
+def retry_notification(
+    log_name: str,
+    tokens: List[str],
+    attempt: int,
+    content: Dict[str, Any],
+    previous_failures: int = 0
+) -> None:
+    """
+    Delayed job: send a notification again to the tokens that failed with a transient error,
+    or publish it to its FCM topic again when content names one
+    """
+    try:
+        if is_expired(content.get("expires_at")):
+            update_notification_log(log_name, "Expired", "The ttl ran out before the notification could be sent again")
+            return
+        initialize_firebase_app()
+        if content.get("topic_name"):
+            content = dict(content)
+            publish_topic_notification(log_name, content.pop("topic_name"), content, attempt)
+            return
+        response = send_notification(tokens=tokens, deactivate_invalid_tokens=True, **content)
+        finish_notification_log(log_name, response, content, attempt, previous_failures)
+    except Exception as e:
+        update_notification_log(log_name, "Failed", str(e))
+        raise
+    finally:
+        enqueue_due_jobs()
+
 @frappe.whitelist()
-def topic(topic_name: str, title: str, body: str | None, data: str) -> Dict[str, Any]:
-    """Send notification to a topic"""
+@idempotent_send("topic_name", "title", "body", "data", "project_name", "site_name")
+def topic(
+    topic_name: str,
+    title: str,
+    body: str | None,
+    data: str,
+    project_name: str | None = None,
+    site_name: str | None = None,
+    idempotency_key: str | None = None,
+    coalesce: bool = False,
+    priority: str | None = None,
+    ttl: int | None = None,
+    send_at: str | None = None
+) -> Dict[str, Any]:
+    """
+    Send notification to a topic.
+    project_name and site_name identify the sender for rate limiting and are required
+    while it is enabled. A repeated
+    idempotency_key returns the result of the first request instead of sending again.
+    With coalesce, notifications to the topic within the coalescing window go out as one push.
+    priority (high, normal or low) picks the send queue and webpush urgency; a notification
+    still unsent ttl seconds after it is due is dropped.
+    With a future send_at the notification is stored and sent at that time instead of now.
+    """
     log_name = None
     try:
         if not all([topic_name, title]):
             raise InvalidInputError("topic_name and title are required parameters")
+        validate_sender(project_name, site_name)
+        send_at = parse_send_at(send_at)
+        priority, expires_at = parse_delivery_options(priority, ttl, get_send_delay(send_at))
 
         topic_name=normalize_topic_name(topic_name)
+        background = is_background_send_enabled()
+        coalesced = bool(cint(coalesce)) and get_coalesce_window() > 0
         # Create initial log entry
         log_name = create_notification_log(
             notification_type="topic",
@@ -210,53 +879,68 @@ def topic(topic_name: str, title: str, body: str | None, data: str) -> Dict[str,
             notification_data={
                 "topic_name": topic_name,
                 "data": data
-            }
+            },
+            status="Scheduled" if send_at else ("Queued" if background or coalesced else "Pending"),
+            # The FN Scheduled Notification row links to the log, so it cannot wait in the buffer
+            sync=bool(send_at)
         )
+        remember_log_name(log_name)
+
+        data_dict = parse_notification_data(log_name, data)
+
+        if send_at:
+            return schedule_send(
+                "topic",
+                log_name,
+                send_at,
+                priority,
+                (project_name, site_name),
+                lambda: count_topic_messages(topic_name, data_dict.get("from_user")),
+                expires_at=expires_at,
+                topic_name=topic_name,
+                title=title,
+                body=body,
+                data_dict=data_dict
+            )
+
+        if coalesced:
+            add_to_digest(
+                "topic", {"topic_name": topic_name}, log_name, title, body, data_dict,
+                priority=priority, expires_at=expires_at, sender=(project_name, site_name)
+            )
+            return {"success": True, "queued": True, "coalesced": True, "log_name": log_name}
+
+        rate_limit_throttle = apply_rate_limit(
+            project_name,
+            site_name,
+            lambda: count_topic_messages(topic_name, data_dict.get("from_user"))
+        )
+        if background or rate_limit_throttle:
+            if not background:
+                update_notification_log(log_name, "Queued")
+            enqueue_notification(
+                "topic",
+                log_name,
+                priority=priority,
+                throttle=rate_limit_throttle,
+                expires_at=expires_at,
+                topic_name=topic_name,
+                title=title,
+                body=body,
+                data_dict=data_dict
+            )
+            return {"success": True, "queued": True, "log_name": log_name}
 
         initialize_firebase_app()
-        
-        try:
-            data_dict = json.loads(data)
-        except json.JSONDecodeError as e:
-            error_msg = f"Invalid JSON data: {str(e)}"
-            update_notification_log(log_name, "Failed", error_msg)
-            raise InvalidInputError(error_msg)
-
-        validate_notification_data(data_dict)
-        
-        # Normalize URLs
-        if data_dict.get("base_url"):
-            data_dict["base_url"] = normalize_url_to_https(data_dict["base_url"])
-        if data_dict.get("click_action"):
-            data_dict["click_action"] = normalize_url_to_https(data_dict["click_action"])
-
-        notification_icon = data_dict.get("notification_icon", "")
-        channel_tokens = get_channel_tokens_exclue_sender(topic_name,data_dict.get("from_user"))
-        if not channel_tokens:
-            error_msg = f"No device tokens found for channel {topic_name}"
-            update_notification_log(log_name, "Failed", error_msg)
-            return {"success": False, "message": error_msg, "log_name": log_name}
-
-        response = send_notification(
-            tokens=channel_tokens,
+        return send_topic_notification(
+            log_name=log_name,
+            topic_name=topic_name,
             title=title,
             body=body,
-            notification_icon=notification_icon,
-            click_action=None,
-            base_url=None,
-            deactivate_invalid_tokens=True
+            data_dict=data_dict,
+            priority=priority,
+            expires_at=expires_at
         )
-        
-        if response["failure_count"] > 0:
-            error_msg = f"Some notifications failed. Success: {response['success_count']}, Failures: {response['failure_count']}"
-            update_notification_log(log_name, "Failed", error_msg)
-        else:
-            update_notification_log(log_name, "Sent")
-        
-        return {
-            "success": True,
-            "log_name": log_name
-        }
 
     except Exception as e:
         if log_name:
@@ -264,13 +948,37 @@ def topic(topic_name: str, title: str, body: str | None, data: str) -> Dict[str,
         raise
 
 @frappe.whitelist()
-def user(project_name: str, site_name: str, user_id: str, title: str, body: str, data: str) -> Dict[str, Any]:
-    """Send notification to a user"""
+@idempotent_send("project_name", "site_name", "user_id", "title", "body", "data")
+def user(
+    project_name: str,
+    site_name: str,
+    user_id: str,
+    title: str,
+    body: str,
+    data: str,
+    idempotency_key: str | None = None,
+    coalesce: bool = False,
+    priority: str | None = None,
+    ttl: int | None = None,
+    send_at: str | None = None
+) -> Dict[str, Any]:
+    """
+    Send notification to a user.
+    A repeated idempotency_key returns the result of the first request instead of sending again.
+    With coalesce, notifications to the user within the coalescing window go out as one push.
+    priority (high, normal or low) picks the send queue and webpush urgency; a notification
+    still unsent ttl seconds after it is due is dropped.
+    With a future send_at the notification is stored and sent at that time instead of now.
+    """
     log_name = None
     try:
         if not all([project_name, site_name, user_id, title, body]):
             raise InvalidInputError("project_name, site_name, user_id, title, and body are required parameters")
+        send_at = parse_send_at(send_at)
+        priority, expires_at = parse_delivery_options(priority, ttl, get_send_delay(send_at))
 
+        background = is_background_send_enabled()
+        coalesced = bool(cint(coalesce)) and get_coalesce_window() > 0
         # Create initial log entry
         log_name = create_notification_log(
             notification_type="user",
@@ -281,59 +989,319 @@ def user(project_name: str, site_name: str, user_id: str, title: str, body: str,
                 "site_name": site_name,
                 "user_id": user_id,
                 "data": data
-            }
+            },
+            status="Scheduled" if send_at else ("Queued" if background or coalesced else "Pending"),
+            # The FN Scheduled Notification row links to the log, so it cannot wait in the buffer
+            sync=bool(send_at)
         )
+        remember_log_name(log_name)
 
-        initialize_firebase_app()
-        
-        try:
-            data_dict = json.loads(data)
-        except json.JSONDecodeError as e:
-            error_msg = f"Invalid JSON data: {str(e)}"
-            update_notification_log(log_name, "Failed", error_msg)
-            raise InvalidInputError(error_msg)
-
-        validate_notification_data(data_dict)
-        
-        # Normalize URLs
-        if data_dict.get("base_url"):
-            data_dict["base_url"] = normalize_url_to_https(data_dict["base_url"])
-        if data_dict.get("click_action"):
-            data_dict["click_action"] = normalize_url_to_https(data_dict["click_action"])
+        data_dict = parse_notification_data(log_name, data)
 
-        tokens = get_user_tokens(project_name=project_name, site_name=site_name, user_id=user_id)
-        if not tokens:
-            error_msg = f"No device tokens found for user {user_id}"
-            update_notification_log(log_name, "Failed", error_msg)
-            return {"success": False, "message": error_msg, "log_name": log_name}
+        if send_at:
+            return schedule_send(
+                "user",
+                log_name,
+                send_at,
+                priority,
+                (project_name, site_name),
+                lambda: len(get_user_tokens(project_name=project_name, site_name=site_name, user_id=user_id)),
+                expires_at=expires_at,
+                project_name=project_name,
+                site_name=site_name,
+                user_id=user_id,
+                title=title,
+                body=body,
+                data_dict=data_dict
+            )
 
-        notification_icon = data_dict.get("notification_icon", "")
+        if coalesced:
+            add_to_digest(
+                "user",
+                {"project_name": project_name, "site_name": site_name, "user_id": user_id},
+                log_name,
+                title,
+                body,
+                data_dict,
+                priority=priority,
+                expires_at=expires_at
+            )
+            return {"success": True, "queued": True, "coalesced": True, "log_name": log_name}
 
-        response = send_notification(
-            tokens=tokens,
+        rate_limit_throttle = apply_rate_limit(
+            project_name,
+            site_name,
+            lambda: len(get_user_tokens(project_name=project_name, site_name=site_name, user_id=user_id))
+        )
+        if background or rate_limit_throttle:
+            if not background:
+                update_notification_log(log_name, "Queued")
+            enqueue_notification(
+                "user",
+                log_name,
+                priority=priority,
+                throttle=rate_limit_throttle,
+                expires_at=expires_at,
+                project_name=project_name,
+                site_name=site_name,
+                user_id=user_id,
+                title=title,
+                body=body,
+                data_dict=data_dict
+            )
+            return {"success": True, "queued": True, "log_name": log_name}
+
+        initialize_firebase_app()
+        return send_user_notification(
+            log_name=log_name,
+            project_name=project_name,
+            site_name=site_name,
+            user_id=user_id,
             title=title,
             body=body,
-            notification_icon=notification_icon,
-            click_action=data_dict.get("click_action"),
-            base_url=data_dict.get("base_url"),
-            deactivate_invalid_tokens=True
+            data_dict=data_dict,
+            priority=priority,
+            expires_at=expires_at
         )
-        
-        if response["failure_count"] > 0:
-            error_msg = f"Some notifications failed. Success: {response['success_count']}, Failures: {response['failure_count']}"
-            update_notification_log(log_name, "Failed", error_msg)
-        else:
-            update_notification_log(log_name, "Sent")
-        
-        return {
-            "success": True,
-            "success_count": response["success_count"],
-            "failure_count": response["failure_count"],
-            "log_name": log_name,
-            "responses": response["responses"]
-        }
 
     except Exception as e:
         if log_name:
             update_notification_log(log_name, "Failed", str(e))
-        raise
\ No newline at end of file
+        raise
+
+@frappe.whitelist()
+@idempotent_send("items")
+def bulk(items: str | List[Dict[str, Any]], idempotency_key: str | None = None) -> Dict[str, Any]:
+    """
+    Send notifications to many users in one call.
+    Each item needs user_id, project_name, site_name, title, body and optionally data, priority and ttl.
+    Tokens for all items are resolved in one query, messages are sent in
+    batches of 500 and all log rows are written with a single insert.
+    A repeated idempotency_key returns the results of the first call instead of sending again.
+    """
+    items = frappe.parse_json(items) if isinstance(items, str) else items
+    if not isinstance(items, list) or not items:
+        raise InvalidInputError("items must be a non-empty list")
+    if len(items) > BULK_MAX_ITEMS:
+        raise InvalidInputError(f"At most {BULK_MAX_ITEMS} items can be sent in one call")
+
+    results = [prepare_bulk_item(item) for item in items]
+    valid_results = [result for result in results if "error" not in result]
+
+    if valid_results:
+        initialize_firebase_app()
+        send_bulk_items(valid_results)
+
+    log_names = insert_bulk_logs(results)
+    insert_delivery_results([
+        (log_name, response["token"], response["error_code"], 0)
+        for result, log_name in zip(results, log_names)
+        for response in result["responses"]
+    ])
+    enqueue_throttled_bulk_items(results, log_names)
+    schedule_bulk_retries(results, log_names)
+    return {
+        "success": all(result["success"] for result in results),
+        "results": [
+            {
+                "user_id": result["item"].get("user_id"),
+                "success": result["success"],
+                "queued": bool(result.get("throttle")),
+                "success_count": result["success_count"],
+                "failure_count": result["failure_count"],
+                "log_name": log_name,
+                "message": result.get("error"),
+                "responses": result["responses"]
+            }
+            for result, log_name in zip(results, log_names)
+        ]
+    }
+
+def prepare_bulk_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate a bulk item and build its webpush config"""
+    result = {
+        "item": item if isinstance(item, dict) else {},
+        "success": False,
+        "success_count": 0,
+        "failure_count": 0,
+        "responses": []
+    }
+    item = result["item"]
+    if not all(item.get(field) for field in ("project_name", "site_name", "user_id", "title", "body")):
+        result["error"] = "project_name, site_name, user_id, title, and body are required parameters"
+        return result
+
+    data = item.get("data") or "{}"
+    try:
+        data_dict = json.loads(data) if isinstance(data, str) else dict(data)
+    except (json.JSONDecodeError, TypeError, ValueError) as e:
+        result["error"] = f"Invalid JSON data: {str(e)}"
+        return result
+
+    try:
+        priority, expires_at = parse_delivery_options(item.get("priority"), item.get("ttl"))
+    except InvalidInputError as e:
+        result["error"] = str(e)
+        return result
+
+    validate_notification_data(data_dict)
+    if data_dict.get("base_url"):
+        data_dict["base_url"] = normalize_url_to_https(data_dict["base_url"])
+    if data_dict.get("click_action"):
+        data_dict["click_action"] = normalize_url_to_https(data_dict["click_action"])
+
+    result["data_dict"] = data_dict
+    result["content"] = {
+        "title": item["title"],
+        "body": item["body"],
+        "notification_icon": data_dict.get("notification_icon", ""),
+        "click_action": data_dict.get("click_action"),
+        "base_url": data_dict.get("base_url"),
+        "priority": priority,
+        "expires_at": expires_at
+    }
+    result["webpush_config"] = build_webpush_config(**result["content"])
+    return result
+
+def send_bulk_items(results: List[Dict[str, Any]]) -> None:
+    """Resolve tokens for all bulk items at once and send one message per token"""
+    tokens_by_recipient = defaultdict(list)
+    for user_id, project_name, site_name, fcm_token in load_active_user_tokens(
+        list({result["item"]["user_id"] for result in results})
+    ):
+        tokens_by_recipient[(user_id, project_name, site_name)].append(fcm_token)
+
+    results = apply_bulk_rate_limits(results, tokens_by_recipient)
+
+    messages = []
+    message_tokens = []
+    message_results = []
+    for result in results:
+        item = result["item"]
+        tokens = tokens_by_recipient.get((item["user_id"], item["project_name"], item["site_name"]))
+        if not tokens:
+            result["error"] = f"No device tokens found for user {item['user_id']}"
+            continue
+        for token in tokens:
+            messages.append(messaging.Message(token=token, webpush=result["webpush_config"]))
+            message_tokens.append(token)
+            message_results.append(result)
+
+    if not messages:
+        return
+
+    try:
+        responses = send_message_batches(messages)
+    except exceptions.FirebaseError as e:
+        for result in {id(result): result for result in message_results}.values():
+            result["error"] = f"Failed to send notification: {str(e)}"
+        return
+
+    for token, response, result in zip(message_tokens, responses, message_results):
+        result["responses"].append({
+            "token": token,
+            "success": response.success,
+            "error": str(response.exception) if response.exception else None,
+            "error_code": get_error_code(response.exception)
+        })
+        if response.success:
+            result["success_count"] += 1
+        else:
+            result["failure_count"] += 1
+            if isinstance(response.exception, RETRYABLE_ERRORS):
+                result.setdefault("retry_tokens", []).append(token)
+                result["retry_after"] = max(result.get("retry_after", 0), get_retry_after(response.exception))
+
+    for result in results:
+        if result["responses"]:
+            result["success"] = True
+            if result["failure_count"]:
+                result["error"] = f"Some notifications failed. Success: {result['success_count']}, Failures: {result['failure_count']}"
+
+    handle_failed_tokens(message_tokens, responses)
+
+def apply_bulk_rate_limits(
+    results: List[Dict[str, Any]],
+    tokens_by_recipient: Dict[tuple, List[str]]
+) -> List[Dict[str, Any]]:
+    """
+    Charge the messages of each project/site in a bulk call against its rate limit at once.
+    Items of a project/site over its limit are rejected or marked to be queued.
+    Returns the items that may be sent now.
+    """
+    groups = defaultdict(list)
+    for result in results:
+        item = result["item"]
+        groups[(item["project_name"], item["site_name"])].append(result)
+
+    allowed = []
+    for (project_name, site_name), group in groups.items():
+        counts = [
+            len(tokens_by_recipient.get((result["item"]["user_id"], project_name, site_name), []))
+            for result in group
+        ]
+        if not sum(counts) or not acquire(project_name, site_name, sum(counts)):
+            allowed.extend(group)
+        elif get_settings().rate_limit_action == "Queue":
+            for result, count in zip(group, counts):
+                result["success"] = True
+                result["throttle"] = {"project_name": project_name, "site_name": site_name, "cost": max(count, 1)}
+        else:
+            for result in group:
+                result["error"] = f"Rate limit exceeded for {project_name}/{site_name}"
+    return allowed
+
+def enqueue_throttled_bulk_items(results: List[Dict[str, Any]], log_names: List[str]) -> None:
+    """Hand bulk items that were over their rate limit to the send queue"""
+    for result, log_name in zip(results, log_names):
+        if not result.get("throttle"):
+            continue
+        item = result["item"]
+        enqueue_notification(
+            "user",
+            log_name,
+            priority=result["content"]["priority"],
+            throttle=result["throttle"],
+            expires_at=result["content"]["expires_at"],
+            project_name=item["project_name"],
+            site_name=item["site_name"],
+            user_id=item["user_id"],
+            title=item["title"],
+            body=item["body"],
+            data_dict=result["data_dict"]
+        )
+
+def schedule_bulk_retries(results: List[Dict[str, Any]], log_names: List[str]) -> None:
+    """Schedule the tokens of bulk items that failed with a transient error to be sent again"""
+    for result, log_name in zip(results, log_names):
+        if result.get("retry_tokens"):
+            schedule_retry(
+                log_name,
+                result["retry_tokens"],
+                1,
+                result["retry_after"],
+                result["content"],
+                previous_failures=result["failure_count"] - len(result["retry_tokens"]),
+                error_message=result.get("error")
+            )
+
+def insert_bulk_logs(results: List[Dict[str, Any]]) -> List[str]:
+    """Write the final log row of every bulk item in one go"""
+    return insert_logs([
+        {
+            "status": "Queued" if result.get("throttle") else (
+                "Sent" if result["success"] and not result["failure_count"] else "Failed"
+            ),
+            "notification_type": "user",
+            "title": result["item"].get("title"),
+            "body": result["item"].get("body"),
+            "notification_data": {
+                "project_name": result["item"].get("project_name"),
+                "site_name": result["item"].get("site_name"),
+                "user_id": result["item"].get("user_id"),
+                "data": result["item"].get("data")
+            },
+            "error_message": result.get("error")
+        }
+        for result in results
+    ])
@@ -0,0 +1,229 @@
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from unittest.mock import patch
+
+import frappe
+from firebase_admin import exceptions
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_notifier.api import send_notification
+from frappe_notifier.api.send_notification import (
+    InvalidInputError,
+    NotificationError,
+    apply_bulk_rate_limits,
+    chunk_list,
+    get_retry_after,
+    get_retry_delay,
+    prepare_bulk_item,
+    publish_topic_notification,
+    run_batches,
+    schedule_retry,
+    send_bulk_items,
+    send_digest,
+    validate_sender,
+)
+
+
+class TestSendNotification(FrappeTestCase):
+    def test_retry_delay_doubles_with_equal_jitter(self):
+        settings = frappe._dict(retry_base_delay=10, retry_max_delay=300)
+        with patch.object(send_notification, "get_settings", return_value=settings):
+            for attempt, delay in ((1, 10), (2, 20), (3, 40), (6, 300), (20, 300)):
+                for _ in range(20):
+                    self.assertTrue(delay / 2 <= get_retry_delay(attempt) <= delay)
+
+    def test_retry_delay_respects_retry_after(self):
+        settings = frappe._dict(retry_base_delay=10, retry_max_delay=300)
+        with patch.object(send_notification, "get_settings", return_value=settings):
+            self.assertEqual(get_retry_delay(1, retry_after=120), 120)
+
+    def test_retry_after_header(self):
+        def error(value):
+            return frappe._dict(http_response=frappe._dict(headers={"Retry-After": value} if value else {}))
+
+        self.assertEqual(get_retry_after(error("30")), 30)
+        self.assertEqual(get_retry_after(error("-5")), 0)
+        self.assertEqual(get_retry_after(error("soon")), 0)
+        self.assertEqual(get_retry_after(error(None)), 0)
+        self.assertEqual(get_retry_after(frappe._dict()), 0)
+        http_date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=90), usegmt=True)
+        self.assertAlmostEqual(get_retry_after(error(http_date)), 90, delta=2)
+
+    def test_retries_stop_after_max_retries_or_ttl(self):
+        settings = frappe._dict(retry_base_delay=10, retry_max_delay=300, max_retries=2)
+        with (
+            patch.object(send_notification, "get_settings", return_value=settings),
+            patch.object(send_notification, "schedule_job") as schedule_job,
+            patch.object(send_notification, "update_log_status"),
+        ):
+            self.assertFalse(schedule_retry("log", ["token"], 3, 0, {}))
+            self.assertFalse(schedule_retry("log", ["token"], 1, 0, {"expires_at": time.time() + 1}))
+            schedule_job.assert_not_called()
+
+            self.assertTrue(schedule_retry("log", ["token"], 2, 0, {}))
+            self.assertEqual(schedule_job.call_count, 1)
+            self.assertTrue(10 <= schedule_job.call_args.args[1] <= 20)
+
+    def test_unattributed_sends_are_refused_while_rate_limited(self):
+        with patch.object(send_notification, "get_settings", return_value=frappe._dict(enable_rate_limiting=1)):
+            self.assertRaises(InvalidInputError, validate_sender, None, None)
+            self.assertRaises(InvalidInputError, validate_sender, "project", "")
+            validate_sender("project", "site")
+            self.assertRaises(
+                InvalidInputError, send_notification.topic, topic_name="news", title="Title", body="Body", data="{}"
+            )
+
+        with patch.object(send_notification, "get_settings", return_value=frappe._dict(enable_rate_limiting=0)):
+            validate_sender(None, None)
+
+    def test_transient_topic_publish_failure_is_retried(self):
+        settings = frappe._dict(retry_base_delay=10, retry_max_delay=300, max_retries=2)
+        content = {"title": "Title", "body": "Body", "notification_icon": "", "tag": None, "priority": "normal", "expires_at": None}
+
+        def fail(error):
+            def send_topic_message(**kwargs):
+                raise NotificationError(str(error)) from error
+            return send_topic_message
+
+        with (
+            patch.object(send_notification, "get_settings", return_value=settings),
+            patch.object(send_notification, "schedule_job") as schedule_job,
+            patch.object(send_notification, "update_log_status"),
+        ):
+            with patch.object(send_notification, "send_topic_message", fail(exceptions.UnavailableError("down"))):
+                result = publish_topic_notification("log", "news", content)
+            self.assertTrue(result["queued"])
+            self.assertEqual(schedule_job.call_args.args[0], "frappe_notifier.api.send_notification.retry_notification")
+            self.assertEqual(schedule_job.call_args.kwargs["content"]["topic_name"], "news")
+            self.assertEqual(schedule_job.call_args.kwargs["attempt"], 1)
+
+            schedule_job.reset_mock()
+            with patch.object(send_notification, "send_topic_message", fail(exceptions.InvalidArgumentError("bad"))):
+                self.assertRaises(NotificationError, publish_topic_notification, "log", "news", content)
+            schedule_job.assert_not_called()
+
+    def test_digest_merges_held_notifications(self):
+        target = {"project_name": "project", "site_name": "site", "user_id": "user"}
+        entries = [
+            {"log_name": f"log-{i}", "title": f"Title {i}", "body": f"Body {i}", "data_dict": {}, "priority": "normal", "expires_at": None}
+            for i in range(3)
+        ]
+        with (
+            patch.object(send_notification, "pop_digest", return_value=entries),
+            patch.object(send_notification, "update_notification_log") as update_notification_log,
+            patch.object(send_notification, "process_queued_notification") as process_queued_notification,
+            patch.object(send_notification, "get_rate_limit", return_value=frappe._dict(rate=10, burst=10)),
+            patch.object(send_notification, "get_user_tokens", return_value=["token-a", "token-b"]),
+        ):
+            send_digest("user", target)
+
+        self.assertEqual(
+            [call.args for call in update_notification_log.call_args_list],
+            [("log-0", "Coalesced", "Merged into log-2"), ("log-1", "Coalesced", "Merged into log-2")],
+        )
+        args, kwargs = process_queued_notification.call_args
+        self.assertEqual(args, ("user", "log-2"))
+        self.assertEqual((kwargs["title"], kwargs["body"]), ("3 new messages", "Body 2"))
+        # The digest is charged for every token of the user
+        self.assertEqual(kwargs["throttle"], {"project_name": "project", "site_name": "site", "cost": 2})
+
+    def test_single_held_notification_is_sent_as_it_is(self):
+        entry = {"log_name": "log-0", "title": "Title", "body": "Body", "data_dict": {}}
+        with (
+            patch.object(send_notification, "pop_digest", return_value=[entry]),
+            patch.object(send_notification, "update_notification_log") as update_notification_log,
+            patch.object(send_notification, "process_queued_notification") as process_queued_notification,
+            patch.object(send_notification, "get_rate_limit", return_value=None),
+        ):
+            send_digest("topic", {"topic_name": "news"})
+
+        update_notification_log.assert_not_called()
+        self.assertEqual(process_queued_notification.call_args.kwargs["title"], "Title")
+        self.assertIsNone(process_queued_notification.call_args.kwargs["throttle"])
+
+    def test_batches_keep_token_order(self):
+        tokens = [f"token-{i}" for i in range(1201)]
+        batches = chunk_list(tokens)
+        self.assertEqual([len(batch) for batch in batches], [500, 500, 201])
+
+        def send_batch(batch):
+            # Later batches finish first
+            time.sleep(0.01 * (len(batches) - batches.index(batch)))
+            return frappe._dict(responses=[frappe._dict(token=token) for token in batch])
+
+        with patch.object(send_notification, "get_settings", return_value=frappe._dict(fcm_batch_workers=3)):
+            responses = run_batches(batches, send_batch)
+        self.assertEqual([response.token for response in responses], tokens)
+
+    def test_bulk_items_are_sent_to_the_tokens_of_their_site(self):
+        def item(user_id, site_name="site"):
+            return {"project_name": "project", "site_name": site_name, "user_id": user_id, "title": "Title", "body": user_id}
+
+        results = [prepare_bulk_item(item("user-a")), prepare_bulk_item(item("user-a", "other-site")), prepare_bulk_item(item("user-b"))]
+        rows = [
+            ("user-a", "project", "site", "token-a1"),
+            ("user-a", "project", "site", "token-a2"),
+            ("user-a", "project", "other-site", "token-a3"),
+        ]
+
+        def send_message_batches(messages):
+            # token-a2 fails with a transient error, every other token gets its message
+            unavailable = exceptions.UnavailableError("down")
+            return [
+                frappe._dict(success=message.token != "token-a2", exception=unavailable if message.token == "token-a2" else None)
+                for message in messages
+            ]
+
+        with (
+            patch.object(send_notification, "load_active_user_tokens", return_value=rows) as load_active_user_tokens,
+            patch.object(send_notification, "acquire", return_value=0),
+            patch.object(send_notification, "send_message_batches", side_effect=send_message_batches) as send_batches,
+            patch.object(send_notification, "handle_failed_tokens"),
+        ):
+            send_bulk_items(results)
+
+        # One token query for every item and one send for every message
+        self.assertEqual(sorted(load_active_user_tokens.call_args.args[0]), ["user-a", "user-b"])
+        send_batches.assert_called_once()
+        self.assertEqual([message.token for message in send_batches.call_args.args[0]], ["token-a1", "token-a2", "token-a3"])
+
+        first, second, third = results
+        self.assertEqual((first["success_count"], first["failure_count"], first["retry_tokens"]), (1, 1, ["token-a2"]))
+        self.assertEqual([response["token"] for response in second["responses"]], ["token-a3"])
+        self.assertTrue(second["success"])
+        self.assertFalse(third["success"])
+        self.assertEqual(third["error"], "No device tokens found for user user-b")
+
+    def test_bulk_rate_limits_are_charged_per_site(self):
+        results = [
+            {"item": {"project_name": "project", "site_name": site_name, "user_id": user_id}}
+            for site_name, user_id in (("site", "user-a"), ("site", "user-b"), ("other-site", "user-a"))
+        ]
+        tokens_by_recipient = {
+            ("user-a", "project", "site"): ["token-a1", "token-a2"],
+            ("user-b", "project", "site"): ["token-b1"],
+            ("user-a", "project", "other-site"): ["token-a3"],
+        }
+
+        def acquire(project_name, site_name, cost):
+            return 5 if site_name == "site" else 0
+
+        with (
+            patch.object(send_notification, "acquire", side_effect=acquire) as acquire_mock,
+            patch.object(send_notification, "get_settings", return_value=frappe._dict(rate_limit_action="Queue")),
+        ):
+            allowed = apply_bulk_rate_limits(results, tokens_by_recipient)
+
+        self.assertEqual(
+            sorted(call.args for call in acquire_mock.call_args_list),
+            [("project", "other-site", 1), ("project", "site", 3)],
+        )
+        self.assertEqual(allowed, [results[2]])
+        self.assertEqual(
+            [result["throttle"] for result in results[:2]],
+            [
+                {"project_name": "project", "site_name": "site", "cost": 2},
+                {"project_name": "project", "site_name": "site", "cost": 1},
+            ],
+        )
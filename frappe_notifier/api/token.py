@@ -1,48 +1,41 @@
 import frappe
+from frappe_notifier.frappe_notifier.doctype.fn_user_device_token.fn_user_device_token import hash_token, upsert_device_token
 from frappe_notifier.utils.decorators import firebase_api_endpoint
-from frappe_notifier.utils.firebase import subscribe_tokens_to_topic
+from frappe_notifier.utils.token_cache import get_user_topic_names, invalidate_user_tokens
+from frappe_notifier.utils.topic_sync import queue_token_unsubscriptions, queue_topic_subscriptions
 
 @frappe.whitelist()
 @firebase_api_endpoint
 def add(project_name, site_name, user_id, fcm_token):
-    if frappe.db.exists("FN User Device Token", {"user_id": user_id, "fcm_token": fcm_token}):
+    # One upsert on the token hash; concurrent registrations of the same token cannot duplicate it
+    status = upsert_device_token(project_name, site_name, user_id, fcm_token)
+    # Re-registering an unchanged active token changes no token list, so the user's and channels' caches stay warm
+    if status != "refreshed":
+        invalidate_user_tokens(user_id)
+    # New tokens are not subscribed to the user's topics yet and deactivation unsubscribed the inactive ones
+    if status in ("created", "reactivated"):
+        check_topic_and_subscribe(user_id, fcm_token)
+    if status != "created":
         return {"success": True, "message": "Token already exists."}
-
-    token_doc = frappe.new_doc("FN User Device Token")
-    token_doc.project_name = project_name
-    token_doc.site_name = site_name
-    token_doc.user_id = user_id
-    token_doc.fcm_token = fcm_token
-    token_doc.insert(ignore_permissions=True)
-    
-    check_topic_and_subscribe(user_id, fcm_token)
     return {"success": True, "message": "OK"}
 
 @frappe.whitelist()
 @firebase_api_endpoint
 def remove(project_name, site_name, user_id, fcm_token):
     frappe.db.delete("FN User Device Token", {
-        "fcm_token": fcm_token,
+        "token_hash": hash_token(fcm_token),
         "project_name": project_name,
         "site_name": site_name,
         "user_id": user_id
     })
+    invalidate_user_tokens(user_id)
+    # A logged out device must stop receiving the user's topic sends
+    queue_token_unsubscriptions([(user_id, fcm_token)])
     return {"success": True, "message": "Token removed."}
 
 def check_topic_and_subscribe(user_id: str, fcm_token: str):
     """
-    Checks if the user is already subscribed to topics and subscribes the new token to them.
+    Queues the new token to be subscribed to every topic the user is a member of.
+    The IID calls are made by a background job in per-topic batches, so registration does not wait on them.
     """
-    subscribed_topics = frappe.get_all("FN Notification Topic User", filters={
-        "user_id": user_id
-    }, fields=["parent"])
-
-    if not subscribed_topics:
-        return
-
-    topic_docs = frappe.get_all("FN Notification Topic", filters={
-        "name": ("in", [d.parent for d in subscribed_topics])
-    }, fields=["topic_name"])
-
-    for topic in topic_docs:
-        subscribe_tokens_to_topic([fcm_token], topic.topic_name)
\ No newline at end of file
+    queue_topic_subscriptions(fcm_token, get_user_topic_names([user_id]))
@@ -3,6 +3,21 @@ from firebase_admin import messaging
 from frappe_notifier.utils.decorators import firebase_api_endpoint
 from frappe_notifier.utils.firebase import get_user_tokens, subscribe_tokens_to_topic, unsubscribe_tokens_from_topic
 from frappe_notifier.utils.normalize_topic_name import normalize_topic_name
+from frappe_notifier.utils.token_cache import invalidate_topic_tokens
+from frappe_notifier.frappe_notifier.doctype.fn_topic_member.fn_topic_member import (
+    add_topic_members,
+    get_topic_members,
+    remove_topic_member,
+)
+from frappe_notifier.utils.topic_sync import (
+    enqueue_member_subscription,
+    enqueue_topic_removal,
+    get_removal_progress,
+    get_subscription_progress,
+)
+
+SUBSCRIBE_MANY_MAX_USERS = 10000
+SUBSCRIBE_MANY_MAX_TOPICS = 100
 
 @frappe.whitelist()
 def add(topic_name):
@@ -22,78 +37,106 @@ def add(topic_name):
 def remove(topic_name):
     """
     Removes a topic and unsubscribes all its users from Firebase.
+    A background job unsubscribes the member tokens page by page and deletes the topic at the end.
+    It records its progress, so calling remove again resumes an interrupted removal.
     """
     topic_name=normalize_topic_name(topic_name)
-    topic_doc_name = frappe.db.get_value("FN Notification Topic", {"topic_name": topic_name})
-
-    if not topic_doc_name:
+    if not frappe.db.exists("FN Notification Topic", {"topic_name": topic_name}):
         return {"success": True, "message": "Topic not found."}
 
-    # Get all subscribed user IDs for the topic
-    topic_users = frappe.get_all("FN Notification Topic User", filters={"parent": topic_doc_name}, fields=["user_id"])
-    user_ids = [user['user_id'] for user in topic_users]
-
-    if user_ids:
-        all_tokens = get_user_tokens(user_id=user_ids)
-        if all_tokens:
-            # Unsubscribe all tokens from the Firebase topic in batches of 1000
-            for i in range(0, len(all_tokens), 1000):
-                batch = all_tokens[i:i+1000]
-                unsubscribe_tokens_from_topic(batch, topic_name)
-    
-    frappe.delete_doc("FN Notification Topic", topic_doc_name, ignore_permissions=True)
-    return {"success": True, "message": f"Topic '{topic_name}' and all its subscribers have been removed."}
+    enqueue_topic_removal(topic_name)
+    return {
+        "success": True,
+        "queued": True,
+        "resumed_after": get_removal_progress(topic_name),
+        "message": f"Topic '{topic_name}' and all its subscribers are being removed."
+    }
 
 @frappe.whitelist()
 @firebase_api_endpoint
-def subscribe(user_id, topic_name):
+def subscribe(user_id, topic_name, project_name=None, site_name=None):
     """
-    Subscribes a user's devices to a topic.
+    Subscribes a user's devices to a topic, optionally only those of one project/site.
+    Membership is a single INSERT IGNORE, so repeated calls are no-ops.
     """
     topic_name=normalize_topic_name(topic_name)
-    add(topic_name) 
-
-    topic_doc_name = frappe.db.get_value("FN Notification Topic", {"topic_name": topic_name})
-    if frappe.db.exists("FN Notification Topic User", {"parent": topic_doc_name, "user_id": user_id}):
-        # frappe.log_error("------------user already exists")
+    # The topic must exist before it gets members
+    add(topic_name)
+    if not add_topic_members(topic_name, [user_id]):
         return {"success": True, "message": "User already subscribed to this topic."}
 
-    tokens = get_user_tokens(user_id)
+    tokens = get_user_tokens(user_id, project_name=project_name, site_name=site_name)
     if not tokens:
+        remove_topic_member(topic_name, user_id)
         return {"success": False, "message": f"No device tokens found for user {user_id}."}
 
     subscribe_tokens_to_topic(tokens, topic_name)
-    
-    add_user_to_topic(topic_doc_name, user_id)
+    invalidate_topic_tokens(topic_name)
     return {"success": True, "message": f"User {user_id} subscribed to topic {topic_name}."}
 
 @frappe.whitelist()
 @firebase_api_endpoint
-def unsubscribe(user_id, topic_name):
+def unsubscribe(user_id, topic_name, project_name=None, site_name=None):
     """
-    Unsubscribes a user's devices from a topic.
+    Unsubscribes a user's devices from a topic, optionally only those of one project/site.
+    Membership is removed with a single DELETE.
     """
     topic_name=normalize_topic_name(topic_name)
-    topic_doc_name = frappe.db.get_value("FN Notification Topic", {"topic_name": topic_name})
-    
-    if not topic_doc_name or not frappe.db.exists("FN Notification Topic User", {"parent": topic_doc_name, "user_id": user_id}):
+    if not remove_topic_member(topic_name, user_id):
         return {"success": True, "message": "User is not subscribed to this topic."}
 
-    tokens = get_user_tokens(user_id)
+    tokens = get_user_tokens(user_id, project_name=project_name, site_name=site_name)
     if tokens:
         unsubscribe_tokens_from_topic(tokens, topic_name)
 
-    topic_user_doc = frappe.get_doc("FN Notification Topic User", {"parent": topic_doc_name, "user_id": user_id})
-    frappe.delete_doc(topic_user_doc.doctype, topic_user_doc.name, ignore_permissions=True)
+    invalidate_topic_tokens(topic_name)
     return {"success": True, "message": f"User {user_id} unsubscribed from topic {topic_name}."}
 
-def add_user_to_topic(topic_doc_name: str, user_id: str):
-    """Helper function to add a user to a topic's child table."""
-    child_doc = frappe.new_doc("FN Notification Topic User")
-    child_doc.user_id = user_id
-    child_doc.parent = topic_doc_name
-    child_doc.parentfield = "user_ids"
-    child_doc.parenttype = "FN Notification Topic"
-    child_doc.insert(ignore_permissions=True)
+@frappe.whitelist()
+@firebase_api_endpoint
+def subscribe_many(user_ids, topic_names, project_name=None, site_name=None):
+    """
+    Subscribes many users to many topics in one call, optionally only the devices of one project/site.
+    Only users not yet in a topic are added. Their tokens are subscribed by a background job on the
+    long queue, a page of users at a time in concurrent 1000-token IID batches. The returned
+    subscription_id reports the job's progress through subscribe_many_progress.
+    """
+    user_ids = frappe.parse_json(user_ids) if isinstance(user_ids, str) else user_ids
+    topic_names = frappe.parse_json(topic_names) if isinstance(topic_names, str) else topic_names
+    if not isinstance(user_ids, list) or not user_ids or not isinstance(topic_names, list) or not topic_names:
+        frappe.throw("user_ids and topic_names must be non-empty lists")
+    if len(user_ids) > SUBSCRIBE_MANY_MAX_USERS or len(topic_names) > SUBSCRIBE_MANY_MAX_TOPICS:
+        frappe.throw(
+            f"At most {SUBSCRIBE_MANY_MAX_USERS} users and {SUBSCRIBE_MANY_MAX_TOPICS} topics can be subscribed in one call"
+        )
+
+    user_ids = list(dict.fromkeys(filter(None, user_ids)))
+    members_by_topic = {}
+    for topic_name in dict.fromkeys(normalize_topic_name(name) for name in topic_names):
+        add(topic_name)
+        existing = set(get_topic_members(topic_name, user_ids))
+        new_members = [user_id for user_id in user_ids if user_id not in existing]
+        add_topic_members(topic_name, new_members)
+        members_by_topic[topic_name] = set(new_members)
 
+    subscription_id = None
+    if any(members_by_topic.values()):
+        subscription_id = enqueue_member_subscription(members_by_topic, project_name=project_name, site_name=site_name)
+        invalidate_topic_tokens(list(members_by_topic))
+    return {
+        "success": True,
+        "queued": bool(subscription_id),
+        "subscription_id": subscription_id,
+        "subscribed": {topic_name: len(members) for topic_name, members in members_by_topic.items()}
+    }
 
+@frappe.whitelist()
+def subscribe_many_progress(subscription_id):
+    """
+    Progress of the background job started by subscribe_many: the users handled so far out of
+    all new members, the tokens handed to the topic sync job for a retry and whether it finished.
+    """
+    progress = get_subscription_progress(subscription_id)
+    if progress is None:
+        return {"success": False, "message": "Subscription not found."}
+    return {"success": True, **progress}
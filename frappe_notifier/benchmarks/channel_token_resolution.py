@@ -0,0 +1,115 @@
+"""
+Benchmark channel token resolution for large topics.
+
+Seeds a throwaway topic with the requested number of members (one active and
+one inactive device token each), times the legacy two-query resolution
+against the joined query and prints p50/p99 latencies. All seeded rows are
+removed afterwards.
+
+Usage:
+    bench --site <site> execute frappe_notifier.benchmarks.channel_token_resolution.run
+    bench --site <site> execute frappe_notifier.benchmarks.channel_token_resolution.run \
+        --kwargs "{'members': [10000], 'iterations': 20}"
+"""
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import frappe
+from frappe.utils import now as now_str
+from frappe_notifier.frappe_notifier.doctype.fn_notification_topic.fn_notification_topic import (
+    load_channel_tokens,
+)
+
+TOPIC_DOCTYPE = "FN Notification Topic"
+TOPIC_MEMBER_DOCTYPE = "FN Topic Member"
+USER_TOKEN_DOCTYPE = "FN User Device Token"
+INSERT_CHUNK_SIZE = 10000
+
+def run(members: List[int] | None = None, iterations: int = 50) -> Dict[int, Dict[str, Dict[str, float]]]:
+    results = {}
+    for member_count in members or [10000, 100000]:
+        topic_name = f"fn-benchmark-{frappe.generate_hash(length=8)}"
+        topic_doc_name = seed_channel(topic_name, member_count)
+        try:
+            results[member_count] = {
+                "legacy": measure(lambda: legacy_channel_tokens(topic_name, "bench-user-0"), iterations),
+                # Time the query itself; the cached resolver would only measure a cache hit
+                "joined": measure(lambda: load_channel_tokens(topic_name), iterations),
+            }
+        finally:
+            cleanup_channel(topic_doc_name)
+
+        for strategy, timings in results[member_count].items():
+            print(
+                f"{member_count:>7} members  {strategy:<7} "
+                f"p50={timings['p50']:.1f}ms  p99={timings['p99']:.1f}ms"
+            )
+    return results
+
+def measure(resolve: Callable[[], List[str]], iterations: int) -> Dict[str, float]:
+    """Run the resolver repeatedly and return p50/p99 in milliseconds"""
+    resolve()  # warm up the buffer pool
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        resolve()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+    return {"p50": percentiles[49], "p99": percentiles[98]}
+
+def legacy_channel_tokens(channel_name: str, sender_id: str) -> List[str]:
+    """The separate member and token round trips used before the joined query"""
+    channel_users = frappe.db.get_all(TOPIC_MEMBER_DOCTYPE,
+        filters={
+            "topic_name": channel_name,
+            "user_id": ["!=", sender_id]
+        },
+        pluck="user_id"
+    )
+    if not channel_users:
+        return []
+    return frappe.db.get_all(USER_TOKEN_DOCTYPE,
+        filters={"user_id": ["in", channel_users], "is_active": 1},
+        pluck="fcm_token"
+    )
+
+def seed_channel(topic_name: str, member_count: int) -> str:
+    """Create a topic with member_count users, each with an active and an inactive token"""
+    topic_doc_name = frappe.generate_hash(length=10)
+    now = now_str()
+    frappe.db.bulk_insert(
+        TOPIC_DOCTYPE,
+        fields=["name", "topic_name", "creation", "modified"],
+        values=[(topic_doc_name, topic_name, now, now)]
+    )
+
+    for start in range(0, member_count, INSERT_CHUNK_SIZE):
+        user_ids = [f"bench-user-{i}" for i in range(start, min(start + INSERT_CHUNK_SIZE, member_count))]
+        frappe.db.bulk_insert(
+            TOPIC_MEMBER_DOCTYPE,
+            fields=["name", "topic_name", "user_id", "creation", "modified"],
+            values=[
+                (frappe.generate_hash(length=10), topic_name, user_id, now, now)
+                for user_id in user_ids
+            ]
+        )
+        frappe.db.bulk_insert(
+            USER_TOKEN_DOCTYPE,
+            fields=["name", "project_name", "site_name", "user_id", "fcm_token", "is_active", "creation", "modified"],
+            values=[
+                (frappe.generate_hash(length=10), "bench", topic_name, user_id, f"{topic_name}-{user_id}-{active}", active, now, now)
+                for user_id in user_ids
+                for active in (1, 0)
+            ]
+        )
+    frappe.db.commit()
+    return topic_doc_name
+
+def cleanup_channel(topic_doc_name: str) -> None:
+    topic_name = frappe.db.get_value(TOPIC_DOCTYPE, topic_doc_name, "topic_name")
+    frappe.db.delete(USER_TOKEN_DOCTYPE, {"site_name": topic_name})
+    frappe.db.delete(TOPIC_MEMBER_DOCTYPE, {"topic_name": topic_name})
+    frappe.db.delete(TOPIC_DOCTYPE, {"name": topic_doc_name})
+    frappe.db.commit()
@@ -0,0 +1,193 @@
+"""
+Benchmark FCM send throughput of the default firebase_admin transport against
+the pooled FCMSender and the asyncio AsyncFCMSender, using a local stub of the FCM v1 messages:send endpoint.
+
+The stub answers every request after a fixed delay to stand in for the round
+trip to Google. It serves HTTP/1.1 over TLS with a throwaway self-signed
+certificate, so connections that are not reused pay for a TLS handshake as
+they would against the real endpoint.
+
+Usage:
+    bench --site <site> execute frappe_notifier.benchmarks.fcm_transport.run
+    bench --site <site> execute frappe_notifier.benchmarks.fcm_transport.run \
+        --kwargs "{'messages': 2000, 'latency_ms': 20}"
+"""
+import asyncio
+import datetime
+import ipaddress
+import json
+import os
+import ssl
+import tempfile
+import threading
+import time
+from typing import Dict
+
+import firebase_admin
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from firebase_admin import credentials, messaging
+from google.auth.credentials import AnonymousCredentials
+
+from frappe_notifier.utils.fcm_async import AsyncFCMSender
+from frappe_notifier.utils.fcm_sender import FCMSender
+
+PROJECT_ID = "fn-benchmark"
+
+class StubCredential(credentials.Base):
+    def get_credential(self):
+        return AnonymousCredentials()
+
+def run(
+    messages: int = 5000,
+    latency_ms: int = 10,
+    max_connections: int = 100,
+    max_concurrency: int = 200
+) -> Dict[str, float]:
+    certificate_dir = tempfile.TemporaryDirectory()
+    cert_path, key_path = create_certificate(certificate_dir.name)
+    server = StubFCMServer(latency_ms, cert_path, key_path)
+    # requests and httpx read the trusted certificates from these variables
+    previous_bundles = {name: os.environ.get(name) for name in ("REQUESTS_CA_BUNDLE", "SSL_CERT_FILE")}
+    os.environ.update(dict.fromkeys(previous_bundles, cert_path))
+    fcm_url = f"https://127.0.0.1:{server.port}/v1/projects/{PROJECT_ID}/messages:send"
+    app = firebase_admin.initialize_app(
+        StubCredential(), options={"projectId": PROJECT_ID}, name=f"{PROJECT_ID}-{time.monotonic_ns()}"
+    )
+    sender = FCMSender(fcm_url=fcm_url, credential=AnonymousCredentials(), max_connections=max_connections)
+    async_sender = AsyncFCMSender(fcm_url=fcm_url, credential=AnonymousCredentials(), max_concurrency=max_concurrency)
+    try:
+        # Point the default transport at the stub as well
+        messaging._get_messaging_service(app)._fcm_url = fcm_url
+        webpush = messaging.WebpushConfig(
+            notification=messaging.WebpushNotification(title="Benchmark", body="Hello")
+        )
+        tokens = [f"token-{i}" for i in range(messages)]
+
+        results = {
+            "firebase_admin": measure(
+                lambda batch: messaging.send_each_for_multicast(
+                    messaging.MulticastMessage(tokens=batch, webpush=webpush), app=app
+                ),
+                tokens
+            ),
+            "pooled": measure(
+                lambda batch: sender.send_each_for_multicast(
+                    messaging.MulticastMessage(tokens=batch, webpush=webpush)
+                ),
+                tokens
+            ),
+            "asyncio": measure(
+                lambda batch: async_sender.send_each_for_multicast(
+                    messaging.MulticastMessage(tokens=batch, webpush=webpush)
+                ),
+                tokens
+            ),
+        }
+    finally:
+        sender.close()
+        async_sender.close()
+        firebase_admin.delete_app(app)
+        server.shutdown()
+        for name, value in previous_bundles.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        certificate_dir.cleanup()
+
+    for transport, rate in results.items():
+        print(f"{transport:<15} {rate:>10.0f} messages/sec")
+    return results
+
+def measure(send_batch, tokens) -> float:
+    """Send all tokens in 500-token multicasts and return messages per second"""
+    send_batch(tokens[:10])  # warm up connections and credentials
+    start = time.perf_counter()
+    for i in range(0, len(tokens), 500):
+        response = send_batch(tokens[i:i + 500])
+        if response.failure_count:
+            failed = next(result for result in response.responses if not result.success)
+            raise RuntimeError(f"Stub send failed: {failed.exception}")
+    return len(tokens) / (time.perf_counter() - start)
+
+def create_certificate(directory: str) -> tuple:
+    """Write a self-signed certificate for 127.0.0.1 and its key, returning both paths"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "stub-fcm.crt")
+    key_path = os.path.join(directory, "stub-fcm.key")
+    with open(cert_path, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ))
+    return cert_path, key_path
+
+class StubFCMServer:
+    """
+    Minimal asyncio HTTP/1.1 keep-alive TLS server answering FCM messages:send calls.
+    Runs its own event loop in a background thread, so the stub is not the bottleneck.
+    """
+
+    def __init__(self, latency_ms: int, cert_path: str, key_path: str):
+        self.latency = latency_ms / 1000
+        self.ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.ssl_context.load_cert_chain(cert_path, key_path)
+        self.loop = asyncio.new_event_loop()
+        self.server = None
+        self.port = None
+        started = threading.Event()
+        threading.Thread(target=self._serve, args=(started,), daemon=True).start()
+        started.wait()
+
+    def _serve(self, started: threading.Event) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle, "127.0.0.1", 0, ssl=self.ssl_context, backlog=1024)
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        started.set()
+        self.loop.run_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                headers = await reader.readuntil(b"\r\n\r\n")
+                content_length = 0
+                for line in headers.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        content_length = int(line.split(b":", 1)[1])
+                await reader.readexactly(content_length)
+                await asyncio.sleep(self.latency)
+                body = json.dumps({"name": f"projects/{PROJECT_ID}/messages/{time.monotonic_ns()}"}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                    + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    def shutdown(self) -> None:
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,15 @@
+# Copyright (c) 2025, Shahzad Bin Shahjahan and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class FNNotificationDelivery(Document):
+	pass
+
+
+def on_doctype_update():
+	# Deliveries are read per notification and per token for token-health queries
+	frappe.db.add_index("FN Notification Delivery", ["notification_log"])
+	frappe.db.add_index("FN Notification Delivery", ["token_hash", "creation"])
@@ -0,0 +1,9 @@
+# Copyright (c) 2025, Shahzad Bin Shahjahan and Contributors
+# See license.txt
+
+# import frappe
+from frappe.tests.utils import FrappeTestCase
+
+
+class TestFNNotificationDelivery(FrappeTestCase):
+	pass
@@ -4,22 +4,77 @@
 import frappe
 from frappe.model.document import Document
 from frappe.query_builder import DocType
-from frappe.query_builder.functions import Now
-from frappe.utils import now_datetime, add_days
+from frappe.utils import now_datetime, add_days, cint, flt
+from frappe_notifier.utils.settings import get_settings
+import gzip
 import json
+import os
+import time
+
+DEFAULT_RETENTION_DAYS = 14
+DEFAULT_PURGE_BATCH_SIZE = 5000
+ARCHIVE_FOLDER = "fn_notification_log_archive"
 
 
 class FNNotificationLog(Document):
 	pass
 
 
+def on_doctype_update():
+	# Retention purges walk the table by age
+	if not frappe.db.has_index("tabFN Notification Log", "modified"):
+		frappe.db.add_index("FN Notification Log", ["modified"])
+
+
 def clear_old_logs():
+	"""
+	Deletes logs older than the retention window with their per-token deliveries and schedule rows
+	in bounded chunks, committing and pausing between chunks so concurrent
+	inserts are not blocked for long.
+	Optionally archives the rows to a gzipped JSONL file before deleting them.
+	"""
+	settings = get_settings()
+	cutoff = add_days(now_datetime(), -(cint(settings.log_retention_days) or DEFAULT_RETENTION_DAYS))
+	batch_size = cint(settings.log_purge_batch_size) or DEFAULT_PURGE_BATCH_SIZE
+	pause = flt(settings.log_purge_pause)
 	FN_LOG = DocType("FN Notification Log")
 
-	# 14 days ago
-	cutoff = add_days(now_datetime(), -14)
-	# Use QB + frappe.db.delete
-	frappe.db.delete(
-		"FN Notification Log",
-		filters={FN_LOG.modified: ("<", cutoff)}
-	)
\ No newline at end of file
+	while True:
+		# Walk the modified index, then delete by primary key in key order
+		names = sorted(
+			frappe.qb.from_(FN_LOG)
+			.select(FN_LOG.name)
+			.where(FN_LOG.modified < cutoff)
+			# Notifications scheduled further ahead than the retention window are still to be sent
+			.where(FN_LOG.status != "Scheduled")
+			.orderby(FN_LOG.modified)
+			.limit(batch_size)
+			.run(pluck=True)
+		)
+		if not names:
+			break
+
+		if settings.archive_logs_before_purge:
+			archive_logs(names)
+
+		frappe.db.delete("FN Notification Delivery", {"notification_log": ("in", names)})
+		frappe.db.delete("FN Scheduled Notification", {"notification_log": ("in", names)})
+		frappe.db.delete("FN Notification Log", {"name": ("in", names)})
+		frappe.db.commit()
+
+		if len(names) < batch_size:
+			break
+		if pause:
+			time.sleep(pause)
+
+
+def archive_logs(names):
+	"""Append the given log rows to today's gzipped JSONL archive in the site's private files"""
+	rows = frappe.db.get_all("FN Notification Log", filters={"name": ("in", names)}, fields=["*"])
+	folder = frappe.get_site_path("private", "files", ARCHIVE_FOLDER)
+	os.makedirs(folder, exist_ok=True)
+	path = os.path.join(folder, f"fn-notification-log-{now_datetime().date()}.jsonl.gz")
+	# gzip members can be concatenated, so every chunk is appended as its own member
+	with gzip.open(path, "at", encoding="utf-8") as archive:
+		for row in rows:
+			archive.write(json.dumps(row, default=str) + "\n")
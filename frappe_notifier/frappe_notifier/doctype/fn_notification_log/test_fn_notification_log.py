@@ -1,9 +1,157 @@
 # Copyright (c) 2025, Shahzad Bin Shahjahan and Contributors
 # See license.txt
 
-# import frappe
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now
+
+from frappe_notifier.utils import log_writer
+from frappe_notifier.utils.log_writer import (
+	FIRST_BUFFERED_AT_KEY,
+	INSERT_BUFFER_KEY,
+	UPDATE_BUFFER_KEY,
+	_apply_updates,
+	flush_log_buffer,
+	insert_logs,
+	update_log_status,
+)
+
+BUFFERED_SETTINGS = frappe._dict(
+	buffer_notification_logs=1, log_buffer_size=1000, log_flush_interval=3600, store_delivery_results=0
+)
 
 
 class TestFNNotificationLog(FrappeTestCase):
-	pass
+	def setUp(self):
+		self.clear_buffers()
+		self.log_names = []
+
+	def tearDown(self):
+		self.clear_buffers()
+		if self.log_names:
+			frappe.db.delete("FN Notification Log", {"name": ("in", self.log_names)})
+			frappe.db.commit()
+
+	def clear_buffers(self):
+		for key in (INSERT_BUFFER_KEY, UPDATE_BUFFER_KEY, FIRST_BUFFERED_AT_KEY):
+			frappe.cache.delete(frappe.cache.make_key(key))
+
+	def insert_log(self, sync=True, **entry):
+		name = insert_logs([{"notification_type": "user", "title": "Test", "body": "Body", **entry}], sync=sync)[0]
+		self.log_names.append(name)
+		return name
+
+	def test_case_parameters_follow_column_then_row_order(self):
+		first = ["log-a", "Sent", None, "2026-01-01 00:00:01", None, None]
+		second = ["log-b", "Retrying", "UNAVAILABLE", "2026-01-01 00:00:02", 2, "2026-01-01 00:01:00"]
+		with patch.object(log_writer.frappe.db, "sql") as sql:
+			_apply_updates([first, second])
+
+		query, values = sql.call_args.args
+		self.assertEqual(
+			values,
+			[
+				"log-a", "Sent", "log-b", "Retrying",
+				"log-a", None, "log-b", "UNAVAILABLE",
+				"log-a", "2026-01-01 00:00:01", "log-b", "2026-01-01 00:00:02",
+				"log-a", None, "log-b", 2,
+				"log-a", None, "log-b", "2026-01-01 00:01:00",
+				"log-a", "log-b",
+			],
+		)
+		self.assertEqual(query.count("%s"), len(values))
+		self.assertEqual(query.count("WHEN %s THEN"), 10)
+
+	def test_case_statements_are_chunked(self):
+		updates = [[f"log-{i}", "Sent", None, now(), None, None] for i in range(log_writer.UPDATE_CHUNK_SIZE + 1)]
+		with patch.object(log_writer.frappe.db, "sql") as sql:
+			_apply_updates(updates)
+
+		self.assertEqual(sql.call_count, 2)
+		self.assertEqual(sql.call_args_list[1].args[1][-1], f"log-{log_writer.UPDATE_CHUNK_SIZE}")
+
+	def test_old_buffered_rows_without_retry_columns(self):
+		with patch.object(log_writer.frappe.db, "sql") as sql:
+			_apply_updates([["log-a", "Sent", None, "2026-01-01 00:00:01"]])
+
+		# The missing retry_count and next_retry_at are read as not given
+		self.assertEqual(sql.call_args.args[1][6:], ["log-a", None, "log-a", None, "log-a"])
+
+	def test_last_update_of_a_row_wins(self):
+		name = self.insert_log()
+		next_retry_at = add_to_date(now(), minutes=5)
+		_apply_updates([
+			[name, "Retrying", "UNAVAILABLE", now(), 1, next_retry_at],
+			[name, "Sent", None, now(), None, None],
+		])
+
+		log = frappe.db.get_value(
+			"FN Notification Log", name, ["status", "error_message", "retry_count", "next_retry_at"], as_dict=True
+		)
+		self.assertEqual(log.status, "Sent")
+		# The error message and retry count are only replaced when given
+		self.assertEqual(log.error_message, "UNAVAILABLE")
+		self.assertEqual(log.retry_count, 1)
+		# next_retry_at is cleared by every update that does not set it
+		self.assertIsNone(log.next_retry_at)
+
+	def test_later_error_replaces_earlier_one(self):
+		name = self.insert_log()
+		_apply_updates([
+			[name, "Retrying", "UNAVAILABLE", now(), 1, None],
+			[name, "Failed", "INTERNAL", now(), 2, None],
+		])
+
+		log = frappe.db.get_value("FN Notification Log", name, ["status", "error_message", "retry_count"], as_dict=True)
+		self.assertEqual((log.status, log.error_message, log.retry_count), ("Failed", "INTERNAL", 2))
+
+	@patch.object(log_writer, "get_settings", return_value=BUFFERED_SETTINGS)
+	@patch.object(log_writer.frappe, "enqueue")
+	def test_flush_inserts_before_updating(self, enqueue, get_settings):
+		name = self.insert_log(sync=False)
+		update_log_status(name, "Sent")
+		self.assertFalse(frappe.db.exists("FN Notification Log", name))
+
+		flush_log_buffer()
+
+		self.assertEqual(frappe.db.get_value("FN Notification Log", name, "status"), "Sent")
+		enqueue.assert_not_called()
+
+	@patch.object(log_writer, "get_settings", return_value=BUFFERED_SETTINGS)
+	@patch.object(log_writer.frappe, "enqueue")
+	def test_flush_applies_buffered_updates_in_order(self, enqueue, get_settings):
+		name = self.insert_log(sync=False)
+		update_log_status(name, "Queued")
+		update_log_status(name, "Failed", "INTERNAL")
+		update_log_status(name, "Sent")
+
+		flush_log_buffer()
+
+		log = frappe.db.get_value("FN Notification Log", name, ["status", "error_message"], as_dict=True)
+		self.assertEqual((log.status, log.error_message), ("Sent", "INTERNAL"))
+
+	@patch.object(log_writer, "get_settings", return_value=BUFFERED_SETTINGS)
+	@patch.object(log_writer.frappe, "enqueue")
+	def test_failed_update_flush_is_requeued(self, enqueue, get_settings):
+		name = self.insert_log(sync=False)
+		update_log_status(name, "Sent")
+
+		with patch.object(log_writer, "_apply_updates", side_effect=frappe.ValidationError):
+			self.assertRaises(frappe.ValidationError, flush_log_buffer)
+
+		# The inserts were committed on their own; the updates wait for the next flush
+		self.assertEqual(frappe.db.get_value("FN Notification Log", name, "status"), "Pending")
+		flush_log_buffer()
+		self.assertEqual(frappe.db.get_value("FN Notification Log", name, "status"), "Sent")
+
+	@patch.object(log_writer, "get_settings", return_value=BUFFERED_SETTINGS)
+	@patch.object(log_writer.frappe, "enqueue")
+	def test_sync_writes_skip_the_buffer(self, enqueue, get_settings):
+		name = self.insert_log(sync=True)
+		update_log_status(name, "Sent", sync=True)
+
+		self.assertEqual(frappe.db.get_value("FN Notification Log", name, "status"), "Sent")
+		self.assertEqual(frappe.cache.llen(frappe.cache.make_key(INSERT_BUFFER_KEY)), 0)
+		self.assertEqual(frappe.cache.llen(frappe.cache.make_key(UPDATE_BUFFER_KEY)), 0)
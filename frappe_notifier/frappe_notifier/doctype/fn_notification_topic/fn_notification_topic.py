@@ -3,29 +3,37 @@
 
 import frappe
 from frappe.model.document import Document
+from frappe.query_builder import DocType
+from frappe_notifier.utils.token_cache import get_cached_topic_tokens
 
 
 class FNNotificationTopic(Document):
-	pass
+	def on_trash(self):
+		frappe.db.delete("FN Topic Member", {"topic_name": self.topic_name})
 
 def get_channel_tokens_exclue_sender(channel_name:str,sender_id:str):
-	topic_name = frappe.db.get_value("FN Notification Topic",{"topic_name":channel_name},"name")
-	channel_users = frappe.db.get_all("FN Notification Topic User",
-		filters={
-			"parenttype":"FN Notification Topic",
-			"parent":topic_name,
-			"user_id":["!=",sender_id]
-		},
-		pluck="user_id"
-	)
-	if not channel_users:
-		return []
-	channel_tokens = frappe.db.get_all("FN User Device Token",
-		filters={
-			"user_id":["in",channel_users],
-		},
-		pluck="fcm_token"
+	"""
+	Returns the active device tokens of every channel member except the sender.
+	Channel tokens are served from the token cache, so the sender is excluded here.
+	"""
+	rows = get_cached_topic_tokens(channel_name, load_channel_tokens)
+	return list(dict.fromkeys(fcm_token for user_id, fcm_token in rows if user_id != sender_id))
+
+def load_channel_tokens(channel_name: str):
+	"""
+	Loads the active (user_id, fcm_token) rows of every channel member in a
+	single query joining the members and their device tokens.
+	"""
+	topic_member = DocType("FN Topic Member")
+	device_token = DocType("FN User Device Token")
+
+	return (
+		frappe.qb.from_(topic_member)
+		.join(device_token)
+		.on(device_token.user_id == topic_member.user_id)
+		.select(topic_member.user_id, device_token.fcm_token)
+		.distinct()
+		.where(topic_member.topic_name == channel_name)
+		.where(device_token.is_active == 1)
+		.run()
 	)
-	if not channel_tokens:
-		return []
-	return channel_tokens
\ No newline at end of file
@@ -5,5 +5,7 @@
 from frappe.model.document import Document
 
 
+# Former membership child table of FN Notification Topic, replaced by FN Topic Member.
+# Kept so existing rows can be migrated by the move_topic_members_to_member_table patch.
 class FNNotificationTopicUser(Document):
 	pass
@@ -0,0 +1,99 @@
+# Copyright (c) 2025, Shahzad Bin Shahjahan and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.query_builder import DocType
+from frappe.utils import add_to_date, cint, now_datetime
+from frappe_notifier.utils.settings import get_settings
+import json
+import random
+
+CLAIM_BATCH_SIZE = 200
+# Bounds one scheduler tick; whatever is left is claimed by the next one
+MAX_CLAIM_BATCHES = 50
+
+
+class FNScheduledNotification(Document):
+	pass
+
+
+def on_doctype_update():
+	# The scheduler tick walks due rows in send_at order
+	frappe.db.add_index("FN Scheduled Notification", ["status", "send_at"])
+
+
+def spread_send_at(send_at):
+	"""
+	With a Scheduled Send Spread, move send_at up to that many seconds later at random,
+	so notifications scheduled for the same moment reach the workers over a stretch of time.
+	Applied before the ttl of the notification is worked out, so the ttl starts at the spread time.
+	"""
+	spread = cint(get_settings().scheduled_send_spread)
+	if spread > 0:
+		send_at = add_to_date(send_at, seconds=random.uniform(0, spread))
+	return send_at
+
+
+def schedule_notification(notification_type, log_name, send_at, queue, **kwargs):
+	"""Store a notification to be handed to the send queue at send_at"""
+	frappe.get_doc({
+		"doctype": "FN Scheduled Notification",
+		"notification_log": log_name,
+		"notification_type": notification_type,
+		"send_at": send_at,
+		"queue": queue,
+		"payload": json.dumps(kwargs, default=str),
+	}).insert(ignore_permissions=True)
+	return send_at
+
+
+def enqueue_scheduled_notifications():
+	"""
+	Scheduler tick: hand due notifications to their send queues, one job each, so they are
+	spread across all workers.
+	Rows are claimed in batches with SELECT ... FOR UPDATE SKIP LOCKED and marked Enqueued
+	in the same transaction, so concurrent ticks never pick up the same row.
+	"""
+	FN_SCHEDULED = DocType("FN Scheduled Notification")
+
+	for _ in range(MAX_CLAIM_BATCHES):
+		rows = (
+			frappe.qb.from_(FN_SCHEDULED)
+			.select(
+				FN_SCHEDULED.name,
+				FN_SCHEDULED.notification_log,
+				FN_SCHEDULED.notification_type,
+				FN_SCHEDULED.queue,
+				FN_SCHEDULED.payload,
+			)
+			.where(FN_SCHEDULED.status == "Scheduled")
+			.where(FN_SCHEDULED.send_at <= now_datetime())
+			.orderby(FN_SCHEDULED.send_at)
+			.limit(CLAIM_BATCH_SIZE)
+			.for_update(skip_locked=True)
+			.run(as_dict=True)
+		)
+		if not rows:
+			break
+
+		(
+			frappe.qb.update(FN_SCHEDULED)
+			.set(FN_SCHEDULED.status, "Enqueued")
+			.where(FN_SCHEDULED.name.isin([row.name for row in rows]))
+			.run()
+		)
+		for row in rows:
+			# Jobs are only pushed once the claim is committed
+			frappe.enqueue(
+				"frappe_notifier.api.send_notification.process_queued_notification",
+				queue=row.queue or "default",
+				enqueue_after_commit=True,
+				notification_type=row.notification_type,
+				log_name=row.notification_log,
+				**json.loads(row.payload or "{}")
+			)
+		frappe.db.commit()
+
+		if len(rows) < CLAIM_BATCH_SIZE:
+			break
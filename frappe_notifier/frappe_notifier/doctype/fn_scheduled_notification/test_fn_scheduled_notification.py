@@ -0,0 +1,92 @@
+# Copyright (c) 2025, Shahzad Bin Shahjahan and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.database import get_db
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, get_datetime, now_datetime
+
+from frappe_notifier.frappe_notifier.doctype.fn_scheduled_notification import fn_scheduled_notification
+from frappe_notifier.frappe_notifier.doctype.fn_scheduled_notification.fn_scheduled_notification import (
+	enqueue_scheduled_notifications,
+	schedule_notification,
+	spread_send_at,
+)
+from frappe_notifier.utils.log_writer import insert_logs
+
+
+class TestFNScheduledNotification(FrappeTestCase):
+	def setUp(self):
+		self.log_names = []
+
+	def tearDown(self):
+		if self.log_names:
+			frappe.db.delete("FN Scheduled Notification", {"notification_log": ("in", self.log_names)})
+			frappe.db.delete("FN Notification Log", {"name": ("in", self.log_names)})
+			frappe.db.commit()
+
+	def schedule(self, seconds):
+		log_name = insert_logs([{"notification_type": "user", "title": "Test", "body": "Body"}], sync=True)[0]
+		self.log_names.append(log_name)
+		schedule_notification(
+			"user", log_name, add_to_date(now_datetime(), seconds=seconds), "short", title="Test", user_id="user"
+		)
+		frappe.db.commit()
+		return frappe.db.get_value("FN Scheduled Notification", {"notification_log": log_name})
+
+	def get_status(self, name):
+		return frappe.db.get_value("FN Scheduled Notification", name, "status")
+
+	@patch.object(fn_scheduled_notification.frappe, "enqueue")
+	def test_due_rows_are_claimed_and_enqueued(self, enqueue):
+		due = self.schedule(-60)
+		later = self.schedule(3600)
+
+		enqueue_scheduled_notifications()
+
+		self.assertEqual(self.get_status(due), "Enqueued")
+		self.assertEqual(self.get_status(later), "Scheduled")
+		jobs = [call.kwargs for call in enqueue.call_args_list if call.kwargs["log_name"] in self.log_names]
+		self.assertEqual(len(jobs), 1)
+		self.assertEqual(jobs[0]["queue"], "short")
+		self.assertEqual((jobs[0]["title"], jobs[0]["user_id"]), ("Test", "user"))
+
+		# A claimed row is not enqueued a second time
+		enqueue.reset_mock()
+		enqueue_scheduled_notifications()
+		self.assertFalse([call for call in enqueue.call_args_list if call.kwargs["log_name"] in self.log_names])
+
+	@patch.object(fn_scheduled_notification.frappe, "enqueue")
+	def test_rows_locked_by_another_tick_are_skipped(self, enqueue):
+		locked = self.schedule(-60)
+		free = self.schedule(-60)
+
+		other = get_db(
+			host=frappe.conf.db_host,
+			port=frappe.conf.db_port,
+			user=frappe.conf.db_user or frappe.conf.db_name,
+			password=frappe.conf.db_password,
+		)
+		other.connect()
+		try:
+			other.sql("SELECT name FROM `tabFN Scheduled Notification` WHERE name = %s FOR UPDATE", (locked,))
+			# Without SKIP LOCKED this would wait for the other transaction
+			enqueue_scheduled_notifications()
+		finally:
+			other.rollback()
+			other.close()
+
+		self.assertEqual(self.get_status(locked), "Scheduled")
+		self.assertEqual(self.get_status(free), "Enqueued")
+
+	def test_spread_moves_send_at_later_within_the_window(self):
+		send_at = get_datetime("2026-01-01 10:00:00")
+		with patch.object(fn_scheduled_notification, "get_settings", return_value=frappe._dict(scheduled_send_spread=60)):
+			for _ in range(20):
+				spread = get_datetime(spread_send_at(send_at))
+				self.assertTrue(send_at <= spread <= add_to_date(send_at, seconds=60))
+
+		with patch.object(fn_scheduled_notification, "get_settings", return_value=frappe._dict(scheduled_send_spread=0)):
+			self.assertEqual(spread_send_at(send_at), send_at)
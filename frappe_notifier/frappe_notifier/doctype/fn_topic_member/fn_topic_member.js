@@ -0,0 +1,8 @@
+// Copyright (c) 2025, Shahzad Bin Shahjahan and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("FN Topic Member", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,67 @@
+# Copyright (c) 2025, Shahzad Bin Shahjahan and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import now
+
+INSERT_CHUNK_SIZE = 1000
+
+
+class FNTopicMember(Document):
+	pass
+
+
+def on_doctype_update():
+	# One row per member and topic; subscribing twice is a no-op
+	frappe.db.add_unique("FN Topic Member", ["topic_name", "user_id"], constraint_name="unique_topic_user")
+	# Topics of a user, for token registration and cache invalidation
+	frappe.db.add_index("FN Topic Member", ["user_id"])
+
+
+def add_topic_members(topic_name, user_ids):
+	"""
+	Adds users to a topic with multi-row INSERT IGNORE statements.
+	Users who are already members are skipped. Returns how many were added.
+	"""
+	timestamp = now()
+	user = frappe.session.user
+	added = 0
+	for i in range(0, len(user_ids), INSERT_CHUNK_SIZE):
+		chunk = user_ids[i:i + INSERT_CHUNK_SIZE]
+		values = []
+		for user_id in chunk:
+			values.extend([frappe.generate_hash(length=10), topic_name, user_id, user, user, timestamp, timestamp])
+		frappe.db.sql(
+			"""
+			INSERT IGNORE INTO `tabFN Topic Member`
+				(name, topic_name, user_id, owner, modified_by, creation, modified)
+			VALUES {}
+			""".format(", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(chunk))),
+			values,
+		)
+		added += get_affected_rows()
+	return added
+
+
+def remove_topic_member(topic_name, user_id):
+	"""Removes a user from a topic with a single DELETE. Returns whether the user was a member."""
+	frappe.db.sql(
+		"DELETE FROM `tabFN Topic Member` WHERE topic_name = %s AND user_id = %s",
+		(topic_name, user_id),
+	)
+	return get_affected_rows() > 0
+
+
+def get_affected_rows():
+	"""Rows changed by the previous statement on this connection; INSERT IGNORE does not count skipped rows"""
+	return frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+
+
+def get_topic_members(topic_name, user_ids):
+	"""The given users that are members of a topic"""
+	return frappe.get_all(
+		"FN Topic Member",
+		filters={"topic_name": topic_name, "user_id": ("in", user_ids)},
+		pluck="user_id",
+	)
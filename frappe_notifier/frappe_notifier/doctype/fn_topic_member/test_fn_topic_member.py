@@ -0,0 +1,40 @@
+# Copyright (c) 2025, Shahzad Bin Shahjahan and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_notifier.frappe_notifier.doctype.fn_topic_member import fn_topic_member
+from frappe_notifier.frappe_notifier.doctype.fn_topic_member.fn_topic_member import (
+	add_topic_members,
+	get_topic_members,
+	remove_topic_member,
+)
+
+
+class TestFNTopicMember(FrappeTestCase):
+	def setUp(self):
+		self.topic_name = f"test-topic-{frappe.generate_hash(length=8)}"
+
+	def test_only_new_members_are_counted(self):
+		self.assertEqual(add_topic_members(self.topic_name, ["user-a", "user-b"]), 2)
+		self.assertEqual(add_topic_members(self.topic_name, ["user-b", "user-c"]), 1)
+		self.assertEqual(add_topic_members(self.topic_name, []), 0)
+		self.assertEqual(
+			sorted(get_topic_members(self.topic_name, ["user-a", "user-b", "user-c", "user-d"])),
+			["user-a", "user-b", "user-c"],
+		)
+
+	def test_added_members_are_counted_across_chunks(self):
+		user_ids = [f"user-{i}" for i in range(5)]
+		with patch.object(fn_topic_member, "INSERT_CHUNK_SIZE", 2):
+			self.assertEqual(add_topic_members(self.topic_name, user_ids[:3]), 3)
+			self.assertEqual(add_topic_members(self.topic_name, user_ids), 2)
+
+	def test_remove_reports_whether_the_user_was_a_member(self):
+		add_topic_members(self.topic_name, ["user-a"])
+		self.assertTrue(remove_topic_member(self.topic_name, "user-a"))
+		self.assertFalse(remove_topic_member(self.topic_name, "user-a"))
+		self.assertEqual(get_topic_members(self.topic_name, ["user-a"]), [])
@@ -4,15 +4,104 @@
 # import frappe
 from frappe.model.document import Document
 import frappe
+import hashlib
+from typing import List
 from frappe.query_builder import DocType
+from frappe.utils import now
+from frappe_notifier.utils.token_cache import invalidate_user_tokens
 
 
 class FNUserDeviceToken(Document):
-	pass
+	def validate(self):
+		self.token_hash = hash_token(self.fcm_token) if self.fcm_token else None
+
+def hash_token(fcm_token: str) -> str:
+    """
+    SHA-256 hex digest of an FCM token, as MySQL's SHA2(fcm_token, 256) computes it.
+    """
+    return hashlib.sha256(fcm_token.encode()).hexdigest()
 
 def deactivate_device_token(device_token: str):
     """
     Deactivates a device token in the database.
     """
     # frappe.log_error(title="Deactivate device token", message=json.dumps({"device_token": device_token}, indent=2))
-    frappe.db.set_value("FN User Device Token", {"fcm_token": device_token}, "is_active", 0)
\ No newline at end of file
+    deactivate_device_tokens([device_token])
+
+def deactivate_device_tokens(device_tokens: List[str]):
+    """
+    Deactivates a batch of device tokens with a single UPDATE, looked up by their hash.
+    Tokens that were active are queued to be unsubscribed from their user's topics.
+    """
+    if not device_tokens:
+        return
+
+    # Imported here: topic_sync depends on this module through the firebase utils
+    from frappe_notifier.utils.topic_sync import queue_token_unsubscriptions
+
+    token_hashes = [hash_token(token) for token in device_tokens]
+    device_token = DocType("FN User Device Token")
+    rows = (
+        frappe.qb.from_(device_token)
+        .select(device_token.user_id, device_token.fcm_token)
+        .where(device_token.token_hash.isin(token_hashes))
+        .where(device_token.is_active == 1)
+        .run()
+    )
+    (
+        frappe.qb.update(device_token)
+        .set(device_token.is_active, 0)
+        .set(device_token.modified, now())
+        .where(device_token.token_hash.isin(token_hashes))
+        .run()
+    )
+    invalidate_user_tokens(list({user_id for user_id, _ in rows}))
+    queue_token_unsubscriptions(rows)
+
+def on_doctype_update():
+    # Token resolution filters on active tokens of a user
+    frappe.db.add_index("FN User Device Token", ["user_id", "is_active"])
+    # Token maintenance walks inactive and idle tokens by age
+    frappe.db.add_index("FN User Device Token", ["is_active", "modified"])
+    # fcm_token is a text column, so only a prefix can be indexed
+    frappe.db.add_index("FN User Device Token", ["fcm_token(255)"])
+    # Registration upserts on it and token lookups go through its leading column
+    frappe.db.add_unique("FN User Device Token", ["token_hash", "user_id"], constraint_name="unique_token_hash_user")
+
+def upsert_device_token(project_name: str, site_name: str, user_id: str, fcm_token: str) -> str:
+    """
+    Registers a device token with a single INSERT ... ON DUPLICATE KEY UPDATE on (token_hash, user_id).
+    A token the user already has is reactivated with a clean failure counter and moved to the given project and site.
+
+    Returns "created" for a new token, "reactivated" for an inactive one, "moved" for an active token
+    registered from another project or site and "refreshed" for an active token that did not change.
+    """
+    timestamp = now()
+    # The prior state is passed back through LAST_INSERT_ID(expr), so no read is needed before the upsert.
+    # It is evaluated first: the assignments are applied left to right and see the updated columns.
+    frappe.db.sql(
+        """
+        INSERT INTO `tabFN User Device Token`
+            (name, project_name, site_name, user_id, fcm_token, token_hash, is_active, owner, modified_by, creation, modified)
+        VALUES (%s, %s, %s, %s, %s, %s, 1, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            failure_count = 0 * LAST_INSERT_ID(CASE
+                WHEN is_active = 0 THEN 1
+                WHEN project_name <=> VALUES(project_name) AND site_name <=> VALUES(site_name) THEN 3
+                ELSE 2
+            END),
+            is_active = 1,
+            project_name = VALUES(project_name),
+            site_name = VALUES(site_name),
+            modified = VALUES(modified)
+        """,
+        (
+            frappe.generate_hash(length=10), project_name, site_name, user_id, fcm_token, hash_token(fcm_token),
+            frappe.session.user, frappe.session.user, timestamp, timestamp
+        )
+    )
+    # MariaDB reports 1 affected row for an insert and 2 for an update
+    row_count, prior_state = frappe.db.sql("SELECT ROW_COUNT(), LAST_INSERT_ID()")[0]
+    if row_count == 1:
+        return "created"
+    return {1: "reactivated", 2: "moved"}.get(prior_state, "refreshed")
@@ -1,9 +1,45 @@
 # Copyright (c) 2025, Shahzad Bin Shahjahan and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from frappe_notifier.frappe_notifier.doctype.fn_user_device_token.fn_user_device_token import (
+	hash_token,
+	upsert_device_token,
+)
+
+USER = "device-token-test-user"
+
 
 class TestFNUserDeviceToken(FrappeTestCase):
-	pass
+	def setUp(self):
+		self.fcm_token = f"test-token-{frappe.generate_hash(length=12)}"
+
+	def get_token(self):
+		return frappe.get_all(
+			"FN User Device Token",
+			filters={"token_hash": hash_token(self.fcm_token), "user_id": USER},
+			fields=["project_name", "site_name", "is_active", "failure_count"],
+		)
+
+	def test_upsert_reports_what_it_did(self):
+		self.assertEqual(upsert_device_token("project", "site", USER, self.fcm_token), "created")
+		self.assertEqual(upsert_device_token("project", "site", USER, self.fcm_token), "refreshed")
+		self.assertEqual(upsert_device_token("project", "other-site", USER, self.fcm_token), "moved")
+
+		frappe.db.set_value(
+			"FN User Device Token", {"token_hash": hash_token(self.fcm_token)}, {"is_active": 0, "failure_count": 2}
+		)
+		self.assertEqual(upsert_device_token("project", "other-site", USER, self.fcm_token), "reactivated")
+
+		# Every registration updates the one row of the token
+		self.assertEqual(
+			self.get_token(),
+			[{"project_name": "project", "site_name": "other-site", "is_active": 1, "failure_count": 0}],
+		)
+
+	def test_same_token_of_another_user_is_a_new_row(self):
+		upsert_device_token("project", "site", USER, self.fcm_token)
+		self.assertEqual(upsert_device_token("project", "site", f"{USER}-2", self.fcm_token), "created")
+		self.assertEqual(len(frappe.get_all("FN User Device Token", {"token_hash": hash_token(self.fcm_token)})), 2)
@@ -1,9 +1,14 @@
 # Copyright (c) 2025, Shahzad Bin Shahjahan and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
+from frappe_notifier.api.get_config import clear_config_cache
+from frappe_notifier.utils.settings import bump_settings_version
 
 
 class FrappeNotifierSettings(Document):
-	pass
+	def on_update(self):
+		# Other workers would otherwise reload the old values before this save commits
+		frappe.db.after_commit.add(clear_config_cache)
+		frappe.db.after_commit.add(bump_settings_version)
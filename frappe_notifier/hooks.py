@@ -86,6 +86,10 @@ app_license = "mit"
 # after_install = "frappe_notifier.install.after_install"
 after_install = "frappe_notifier.setup.setup_users"
 
+# Build the Firebase app once per worker process, before the first send needs it
+before_request = ["frappe_notifier.utils.firebase.preload_firebase_app"]
+before_job = ["frappe_notifier.utils.firebase.preload_firebase_app"]
+
 # Uninstallation
 # ------------
 
@@ -168,8 +172,17 @@ after_install = "frappe_notifier.setup.setup_users"
 # }
 
 scheduler_events = {
-    "daily": [
-        "frappe_notifier.frappe_notifier.doctype.fn_notification_log.fn_notification_log.clear_old_logs"
+    "cron": {
+        "* * * * *": [
+            "frappe_notifier.utils.log_writer.flush_log_buffer",
+            "frappe_notifier.utils.delayed_jobs.enqueue_due_jobs",
+            "frappe_notifier.utils.topic_sync.sync_topic_subscriptions",
+            "frappe_notifier.frappe_notifier.doctype.fn_scheduled_notification.fn_scheduled_notification.enqueue_scheduled_notifications"
+        ]
+    },
+    "daily_long": [
+        "frappe_notifier.frappe_notifier.doctype.fn_notification_log.fn_notification_log.clear_old_logs",
+        "frappe_notifier.utils.token_health.run_token_maintenance"
     ]
 }
 
@@ -190,6 +203,7 @@ override_whitelisted_methods = {
     'notification_relay.api.token.delete': 'frappe_notifier.api.token.remove',
     'notification_relay.api.send_notification.user': 'frappe_notifier.api.send_notification.user',
     'notification_relay.api.send_notification.topic': 'frappe_notifier.api.send_notification.topic',
+    'notification_relay.api.send_notification.bulk': 'frappe_notifier.api.send_notification.bulk',
     'notification_relay.api.topic.add':'frappe_notifier.api.topic.add',
     'notification_relay.api.topic.remove':'frappe_notifier.api.topic.remove',
     'notification_relay.api.topic.subscribe':'frappe_notifier.api.topic.subscribe',
@@ -0,0 +1,21 @@
+import frappe
+
+def execute():
+    """Remove duplicate (user_id, fcm_token) rows, then fill token_hash for the unique upsert key"""
+    # Keep one row per user and token: the active one, then the most recently modified
+    frappe.db.sql("""
+        DELETE t FROM `tabFN User Device Token` t
+        JOIN `tabFN User Device Token` k
+            ON k.user_id = t.user_id
+            AND k.fcm_token = t.fcm_token
+            AND (
+                k.is_active > t.is_active
+                OR (k.is_active = t.is_active AND k.modified > t.modified)
+                OR (k.is_active = t.is_active AND k.modified = t.modified AND k.name > t.name)
+            )
+    """)
+    frappe.db.sql("""
+        UPDATE `tabFN User Device Token`
+        SET token_hash = SHA2(fcm_token, 256)
+        WHERE token_hash IS NULL AND fcm_token IS NOT NULL
+    """)
@@ -0,0 +1,4 @@
+from frappe_notifier.frappe_notifier.doctype.fn_notification_log.fn_notification_log import on_doctype_update
+
+def execute():
+    on_doctype_update()
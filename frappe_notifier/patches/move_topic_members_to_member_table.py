@@ -0,0 +1,19 @@
+import frappe
+
+def execute():
+    """Copy topic memberships from the FN Notification Topic User child table to FN Topic Member"""
+    if not frappe.db.table_exists("FN Notification Topic User"):
+        return
+
+    # Child row names are unique, so they are reused; duplicate members collapse on the unique key
+    frappe.db.sql("""
+        INSERT IGNORE INTO `tabFN Topic Member`
+            (name, topic_name, user_id, owner, modified_by, creation, modified)
+        SELECT tu.name, t.topic_name, tu.user_id, tu.owner, tu.modified_by, tu.creation, tu.modified
+        FROM `tabFN Notification Topic User` tu
+        JOIN `tabFN Notification Topic` t ON t.name = tu.parent
+        WHERE tu.parenttype = 'FN Notification Topic'
+            AND IFNULL(tu.user_id, '') != ''
+            AND IFNULL(t.topic_name, '') != ''
+    """)
+    frappe.db.delete("FN Notification Topic User", {"parenttype": "FN Notification Topic"})
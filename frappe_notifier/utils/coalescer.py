@@ -0,0 +1,84 @@
+import hashlib
+import json
+from typing import Any, Dict, List
+
+import frappe
+from frappe.utils import cint
+
+from frappe_notifier.utils.delayed_jobs import enqueue_due_jobs, schedule_job
+from frappe_notifier.utils.settings import get_send_queue, get_settings
+
+COALESCE_PREFIX = "fn_coalesce"
+# Keeps a digest whose send job was lost from lingering forever
+DIGEST_EXPIRY_GRACE = 60 * 60
+
+def get_coalesce_window() -> int:
+    return cint(get_settings().coalesce_window)
+
+def get_digest_group(notification_type: str, target: Dict[str, Any]) -> str:
+    """The user or topic a notification is coalesced with"""
+    if notification_type == "topic":
+        return f"topic:{target['topic_name']}"
+    return f"user:{target['project_name']}:{target['site_name']}:{target['user_id']}"
+
+def get_collapse_key(group: str) -> str:
+    """
+    Tag and webpush Topic header shared by every push of a digest group, so a new digest
+    replaces the previous notification on the device. Topic allows at most 32 characters.
+    """
+    return hashlib.sha256(group.encode()).hexdigest()[:32]
+
+def add_to_digest(
+    notification_type: str,
+    target: Dict[str, Any],
+    log_name: str,
+    title: str,
+    body: str | None,
+    data_dict: Dict[str, Any],
+    priority: str | None = None,
+    expires_at: float | None = None,
+    sender: tuple[str | None, str | None] | None = None
+) -> None:
+    """
+    Hold a notification back for the coalescing window of its user or topic.
+    The first notification of a window schedules the digest send; later ones only join it.
+    The digest job runs on the queue of the first notification's priority, and the digest
+    goes out with the priority, expiry and sender (the project/site whose rate limit it is
+    charged against) of its newest notification.
+    """
+    window = get_coalesce_window()
+    group = get_digest_group(notification_type, target)
+    key = frappe.cache.make_key(f"{COALESCE_PREFIX}:{group}")
+
+    pipeline = frappe.cache.pipeline()
+    pipeline.rpush(key, json.dumps({
+        "log_name": log_name,
+        "title": title,
+        "body": body,
+        "data_dict": data_dict,
+        "priority": priority,
+        "expires_at": expires_at,
+        "sender": sender,
+    }))
+    pipeline.expire(key, window + DIGEST_EXPIRY_GRACE)
+    length, _ = pipeline.execute()
+
+    if length == 1:
+        schedule_job(
+            "frappe_notifier.api.send_notification.send_digest",
+            window,
+            queue=get_send_queue(priority),
+            notification_type=notification_type,
+            target=target
+        )
+    # Bursty traffic releases the digests of earlier windows without waiting for the scheduler
+    enqueue_due_jobs()
+
+def pop_digest(notification_type: str, target: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Take every notification held for a user or topic, oldest first"""
+    key = frappe.cache.make_key(f"{COALESCE_PREFIX}:{get_digest_group(notification_type, target)}")
+    pipeline = frappe.cache.pipeline()
+    pipeline.lrange(key, 0, -1)
+    pipeline.delete(key)
+    entries, _ = pipeline.execute()
+    return [json.loads(entry) for entry in entries]
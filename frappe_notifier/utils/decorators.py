@@ -1,6 +1,7 @@
 import frappe
 from functools import wraps
 from frappe_notifier.utils.firebase import initialize_firebase_app
+from frappe_notifier.utils.idempotency import claim, complete, get_duplicate_response, get_request_key, release
 
 def firebase_api_endpoint(f):
     @wraps(f)
@@ -12,4 +13,33 @@ def firebase_api_endpoint(f):
             frappe.log_error(title=f"Firebase API Error in {f.__name__}", message=str(e))
             # Use frappe.get_response to ensure a proper HTTP response is sent
             raise e
-    return wrapper 
\ No newline at end of file
+    return wrapper 
+
+
+def idempotent_send(*key_fields):
+    """
+    Answer repeated send requests with the log_name and result of the first one, without
+    touching the database or FCM again. Requests match on their idempotency_key argument or,
+    when content deduplication is enabled, on a hash of key_fields within the dedupe window.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            request_key = get_request_key(f.__name__, kwargs, key_fields)
+            if not request_key:
+                return f(*args, **kwargs)
+
+            key, ttl = request_key
+            original = claim(key, ttl)
+            if original is not None:
+                return get_duplicate_response(original)
+
+            try:
+                result = f(*args, **kwargs)
+            except Exception:
+                release(key)
+                raise
+            complete(key, ttl, result)
+            return result
+        return wrapper
+    return decorator
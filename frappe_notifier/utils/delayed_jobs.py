@@ -0,0 +1,68 @@
+import json
+import time
+from typing import Any
+
+import frappe
+
+DELAYED_JOBS_KEY = "fn_delayed_jobs"
+RELEASE_LOCK_KEY = "fn_delayed_jobs:release_lock"
+RELEASE_LOCK_TIMEOUT = 60
+# Due jobs are handed to RQ at most this many at a time. Whatever is left stays in the
+# schedule for the next release, so a large wave reaches the workers in slices.
+RELEASE_BATCH_SIZE = 200
+
+def schedule_job(method: str, delay: float, queue: str = "default", **kwargs: Any) -> float:
+    """
+    Enqueue method on queue after delay seconds. Returns the time it becomes due.
+    Jobs wait in a Redis sorted set scored by due time until enqueue_due_jobs releases them,
+    so no RQ scheduler process is needed.
+    """
+    run_at = time.time() + max(delay, 0)
+    job = json.dumps({
+        "id": frappe.generate_hash(length=12),
+        "method": method,
+        "queue": queue,
+        "kwargs": kwargs,
+    }, default=str)
+    pipeline = frappe.cache.pipeline()
+    pipeline.zadd(frappe.cache.make_key(DELAYED_JOBS_KEY), {job: run_at})
+    pipeline.execute()
+    return run_at
+
+def enqueue_due_jobs() -> int:
+    """
+    Hand due jobs to their RQ queues, returning how many were released.
+    Runs every minute from the scheduler and after every send job, so retries are not
+    held back by the scheduler tick while workers are busy.
+    """
+    lock_key = frappe.cache.make_key(RELEASE_LOCK_KEY)
+    if not frappe.cache.set(lock_key, 1, nx=True, ex=RELEASE_LOCK_TIMEOUT):
+        return 0
+
+    key = frappe.cache.make_key(DELAYED_JOBS_KEY)
+    try:
+        pipeline = frappe.cache.pipeline()
+        pipeline.zrangebyscore(key, "-inf", time.time(), start=0, num=RELEASE_BATCH_SIZE)
+        due = pipeline.execute()[0]
+        if not due:
+            return 0
+
+        pipeline = frappe.cache.pipeline()
+        for job in due:
+            pipeline.zrem(key, job)
+        # Another process may have taken a job between the two calls; only release what this one removed
+        due = [job for job, removed in zip(due, pipeline.execute()) if removed]
+
+        for i, job in enumerate(due):
+            payload = json.loads(job)
+            try:
+                frappe.enqueue(payload["method"], queue=payload["queue"], **payload["kwargs"])
+            except Exception:
+                # Put this and the remaining jobs back so the next release tries again
+                pipeline = frappe.cache.pipeline()
+                pipeline.zadd(key, {pending: time.time() for pending in due[i:]})
+                pipeline.execute()
+                raise
+        return len(due)
+    finally:
+        frappe.cache.delete(lock_key)
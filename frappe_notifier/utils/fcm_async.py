@@ -0,0 +1,136 @@
+import asyncio
+import importlib.util
+import threading
+from typing import Any, Coroutine, Dict, List
+
+import firebase_admin
+import httpx
+from firebase_admin import _http_client, _utils, exceptions, messaging
+from firebase_admin.messaging import _MessagingService
+
+from frappe_notifier.utils.fcm_sender import expand_multicast
+
+DEFAULT_MAX_CONCURRENCY = 200
+DEFAULT_REQUEST_TIMEOUT = 10
+
+class AsyncFCMSender:
+    """
+    Sends FCM v1 messages from an asyncio event loop owned by this object.
+
+    The loop runs in a daemon thread for the lifetime of the worker, so the async HTTP
+    client and its connections (HTTP/2 when the h2 package is installed) are shared by
+    every job instead of being rebuilt per call. The send methods are plain functions:
+    they submit a coroutine to the loop and block until it finishes, so RQ jobs and
+    request handlers call them like the firebase_admin.messaging functions.
+
+    In-flight requests are bounded by a semaphore, and each request is given up after
+    request_timeout seconds. If the calling thread is interrupted (for example by an RQ
+    job timeout) the pending requests are cancelled.
+    """
+
+    def __init__(
+        self,
+        fcm_url: str,
+        credential: Any,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT
+    ):
+        self.fcm_url = fcm_url
+        self.request_timeout = request_timeout
+        self.http2 = importlib.util.find_spec("h2") is not None
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = httpx.AsyncClient(
+            http2=self.http2,
+            auth=_http_client.GoogleAuthCredentialFlow(credential),
+            timeout=request_timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            headers={
+                "X-GOOG-API-FORMAT-VERSION": "2",
+                "X-FIREBASE-CLIENT": f"fire-admin-python/{firebase_admin.__version__}",
+                **_http_client.METRICS_HEADERS
+            }
+        )
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="fcm-async-sender", daemon=True).start()
+
+    @classmethod
+    def from_app(
+        cls,
+        app: firebase_admin.App,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT
+    ) -> "AsyncFCMSender":
+        if not app.project_id:
+            raise ValueError("Project ID is required to access Cloud Messaging service.")
+        return cls(
+            fcm_url=_MessagingService.FCM_URL.format(app.project_id),
+            credential=app.credential.get_credential(),
+            max_concurrency=max_concurrency,
+            request_timeout=request_timeout
+        )
+
+    def send(self, message: messaging.Message, dry_run: bool = False) -> str:
+        """Send one message, returning its message id or raising a FirebaseError"""
+        response = self._run(self._send(self._message_data(message, dry_run)))
+        if response.exception:
+            raise response.exception
+        return response.message_id
+
+    def send_each(self, messages: List[messaging.Message], dry_run: bool = False) -> messaging.BatchResponse:
+        """
+        Send messages concurrently, bounded by the semaphore rather than in 500-message batches.
+        Responses are in the same order as the messages.
+        """
+        return self._run(self.send_each_async(messages, dry_run))
+
+    def send_each_for_multicast(
+        self,
+        multicast_message: messaging.MulticastMessage,
+        dry_run: bool = False
+    ) -> messaging.BatchResponse:
+        return self.send_each(expand_multicast(multicast_message), dry_run)
+
+    async def send_each_async(self, messages: List[messaging.Message], dry_run: bool = False) -> messaging.BatchResponse:
+        message_data = [self._message_data(message, dry_run) for message in messages]
+        return messaging.BatchResponse(list(await asyncio.gather(*[self._send(data) for data in message_data])))
+
+    def close(self) -> None:
+        try:
+            self._run(self.client.aclose())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _run(self, coroutine: Coroutine) -> Any:
+        """Sync bridge: run a coroutine on the sender's loop and wait for its result"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            # Cancelling the outer task cancels every request gathered under it
+            future.cancel()
+            raise
+
+    def _message_data(self, message: messaging.Message, dry_run: bool) -> Dict[str, Any]:
+        data = {"message": _MessagingService.encode_message(message)}
+        if dry_run:
+            data["validate_only"] = True
+        return data
+
+    async def _send(self, data: Dict[str, Any]) -> messaging.SendResponse:
+        async with self.semaphore:
+            try:
+                response = await asyncio.wait_for(
+                    self.client.post(self.fcm_url, json=data), timeout=self.request_timeout
+                )
+                response.raise_for_status()
+            except asyncio.TimeoutError:
+                return messaging.SendResponse(
+                    None,
+                    exceptions.DeadlineExceededError(f"FCM request timed out after {self.request_timeout} seconds.")
+                )
+            except httpx.HTTPError as error:
+                return messaging.SendResponse(
+                    None,
+                    _utils.handle_platform_error_from_httpx(error, _MessagingService._build_fcm_error_httpx)
+                )
+        return messaging.SendResponse(response.json(), None)
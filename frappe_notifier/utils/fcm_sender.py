@@ -0,0 +1,157 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import firebase_admin
+import requests
+from firebase_admin import _http_client, _utils, messaging
+from firebase_admin.messaging import _MessagingService
+
+from frappe.utils import cint, flt
+
+from frappe_notifier.utils.settings import get_settings
+
+DEFAULT_MAX_CONNECTIONS = 100
+
+class FCMSender:
+    """
+    Sends FCM v1 messages over one long-lived, authorized HTTP session whose
+    keep-alive connection pool is as large as the number of requests in flight,
+    so TLS connections are set up once per worker and reused across sends.
+    Mirrors the send functions of firebase_admin.messaging, so either can be
+    used interchangeably.
+    """
+
+    def __init__(
+        self,
+        fcm_url: str,
+        credential: Any,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        timeout: float = _http_client.DEFAULT_TIMEOUT_SECONDS
+    ):
+        self.fcm_url = fcm_url
+        self.headers = {
+            "X-GOOG-API-FORMAT-VERSION": "2",
+            "X-FIREBASE-CLIENT": f"fire-admin-python/{firebase_admin.__version__}",
+        }
+        self.client = _http_client.JsonHttpClient(credential=credential, timeout=timeout)
+        # firebase_admin mounts adapters with the default pool of 10 connections, so
+        # concurrent sends beyond that open and discard a TLS connection each time.
+        # pool_block keeps the pool from growing past max_connections under load.
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max_connections,
+            pool_block=True,
+            max_retries=_http_client.DEFAULT_RETRY_CONFIG
+        )
+        self.client.session.mount("https://", adapter)
+        self.client.session.mount("http://", adapter)
+        # Long-lived threads instead of a new pool of up to 500 threads per batch
+        self.executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="fcm-sender")
+
+    @classmethod
+    def from_app(cls, app: firebase_admin.App, max_connections: int = DEFAULT_MAX_CONNECTIONS) -> "FCMSender":
+        if not app.project_id:
+            raise ValueError("Project ID is required to access Cloud Messaging service.")
+        return cls(
+            fcm_url=_MessagingService.FCM_URL.format(app.project_id),
+            credential=app.credential.get_credential(),
+            max_connections=max_connections,
+            timeout=app.options.get("httpTimeout", _http_client.DEFAULT_TIMEOUT_SECONDS)
+        )
+
+    def send(self, message: messaging.Message, dry_run: bool = False) -> str:
+        """Send one message, returning its message id or raising a FirebaseError"""
+        response = self._send(self._message_data(message, dry_run))
+        if response.exception:
+            raise response.exception
+        return response.message_id
+
+    def send_each(self, messages: List[messaging.Message], dry_run: bool = False) -> messaging.BatchResponse:
+        """Send up to 500 messages concurrently over the shared connections"""
+        if len(messages) > 500:
+            raise ValueError("messages must not contain more than 500 elements.")
+        message_data = [self._message_data(message, dry_run) for message in messages]
+        return messaging.BatchResponse(list(self.executor.map(self._send, message_data)))
+
+    def send_each_for_multicast(
+        self,
+        multicast_message: messaging.MulticastMessage,
+        dry_run: bool = False
+    ) -> messaging.BatchResponse:
+        return self.send_each(expand_multicast(multicast_message), dry_run)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+        self.client.close()
+
+    def _message_data(self, message: messaging.Message, dry_run: bool) -> Dict[str, Any]:
+        data = {"message": _MessagingService.encode_message(message)}
+        if dry_run:
+            data["validate_only"] = True
+        return data
+
+    def _send(self, data: Dict[str, Any]) -> messaging.SendResponse:
+        try:
+            response = self.client.body("post", url=self.fcm_url, headers=self.headers, json=data)
+        except requests.exceptions.RequestException as error:
+            return messaging.SendResponse(
+                None,
+                _utils.handle_platform_error_from_requests(error, _MessagingService._build_fcm_error_requests)
+            )
+        return messaging.SendResponse(response, None)
+
+def expand_multicast(multicast_message: messaging.MulticastMessage) -> List[messaging.Message]:
+    """One Message per token of a MulticastMessage, as firebase_admin does before sending"""
+    return [
+        messaging.Message(
+            data=multicast_message.data,
+            notification=multicast_message.notification,
+            android=multicast_message.android,
+            webpush=multicast_message.webpush,
+            apns=multicast_message.apns,
+            fcm_options=multicast_message.fcm_options,
+            token=token
+        )
+        for token in multicast_message.tokens
+    ]
+
+# The sender of this process and the Firebase app it was built for
+_sender = {"app": None, "sender": None}
+_sender_lock = threading.Lock()
+
+def get_fcm_sender():
+    """
+    Returns the object FCM sends go through: the AsyncFCMSender of this worker when the
+    Asyncio send engine is selected, its pooled FCMSender, or the firebase_admin.messaging
+    module when the pooled transport is disabled. The sender is rebuilt whenever the
+    Firebase app is, which happens whenever the settings are saved.
+    """
+    settings = get_settings()
+    use_async_engine = settings.send_engine == "Asyncio"
+    if not use_async_engine and not settings.use_pooled_fcm_transport:
+        return messaging
+
+    app = firebase_admin.get_app()
+    if _sender["app"] is app:
+        return _sender["sender"]
+
+    with _sender_lock:
+        if _sender["app"] is not app:
+            previous = _sender["sender"]
+            if use_async_engine:
+                from frappe_notifier.utils.fcm_async import DEFAULT_MAX_CONCURRENCY, DEFAULT_REQUEST_TIMEOUT, AsyncFCMSender
+
+                _sender["sender"] = AsyncFCMSender.from_app(
+                    app,
+                    max_concurrency=cint(settings.fcm_max_concurrency) or DEFAULT_MAX_CONCURRENCY,
+                    request_timeout=flt(settings.fcm_request_timeout) or DEFAULT_REQUEST_TIMEOUT
+                )
+            else:
+                _sender["sender"] = FCMSender.from_app(
+                    app, max_connections=cint(settings.fcm_max_connections) or DEFAULT_MAX_CONNECTIONS
+                )
+            _sender["app"] = app
+            if previous:
+                previous.close()
+    return _sender["sender"]
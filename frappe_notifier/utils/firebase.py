@@ -1,21 +1,51 @@
 import frappe
-from firebase_admin import _apps, initialize_app
-from typing import List
-from frappe_notifier.frappe_notifier.doctype.fn_user_device_token.fn_user_device_token import deactivate_device_token
+import threading
+from firebase_admin import _apps, delete_app, exceptions, get_app, initialize_app
+from typing import List, Set, Tuple
+from frappe_notifier.frappe_notifier.doctype.fn_user_device_token.fn_user_device_token import deactivate_device_tokens
+from frappe_notifier.utils.token_cache import get_cached_user_tokens
+from frappe_notifier.utils.settings import get_settings, get_settings_version
 import json
 
 SETTINGS_DOCTYPE = "Frappe Notifier Settings"
 USER_TOKEN_DOCTYPE = "FN User Device Token"
+# Per-token errors of IID topic calls. Invalid tokens are deactivated, transient errors
+# are worth another attempt, and anything else will fail the same way again.
+INVALID_IID_ERRORS = ("INVALID_ARGUMENT", "NOT_FOUND", "UNREGISTERED")
+RETRYABLE_IID_ERRORS = ("INTERNAL", "UNAVAILABLE", "RESOURCE_EXHAUSTED")
+# Failures of a whole IID call that may pass when it is made again
+RETRYABLE_IID_CALL_ERRORS = (
+    exceptions.UnavailableError,
+    exceptions.InternalError,
+    exceptions.DeadlineExceededError,
+    exceptions.ResourceExhaustedError,
+    exceptions.UnknownError,
+)
+
+# The default Firebase app of this process and the (site, settings version) it was built from
+_firebase_app = {"app": None, "version": None}
+_firebase_app_lock = threading.Lock()
 
 class FirebaseInitializationError(Exception):
     """Raised when Firebase initialization fails"""
     pass
 
 def initialize_firebase_app() -> None:
-    """Initialize Firebase app with proper error handling"""
+    """
+    Initialize Firebase app with proper error handling.
+    The app is built once per worker process and rebuilt only when the settings version changes,
+    so credential or config changes apply without restarting workers.
+    """
     try:
-        if not _apps:
-            firebase_config_json = frappe.db.get_single_value(SETTINGS_DOCTYPE, "firebase_config")
+        version = (frappe.local.site, get_settings_version())
+        if _firebase_app["app"] and _firebase_app["version"] == version:
+            return
+
+        with _firebase_app_lock:
+            if _firebase_app["app"] and _firebase_app["version"] == version:
+                return
+
+            firebase_config_json = get_settings().firebase_config
             if not firebase_config_json:
                 raise FirebaseInitializationError("Firebase configuration not found in settings")
             
@@ -25,13 +55,29 @@ def initialize_firebase_app() -> None:
                 raise FirebaseInitializationError(f"Invalid Firebase configuration JSON: {str(e)}")
             
             try:
-                initialize_app(options=firebase_config)
+                # The default app may have been created elsewhere, e.g. before this registry existed
+                if _apps:
+                    delete_app(get_app())
+                _firebase_app["app"] = initialize_app(options=firebase_config)
+                _firebase_app["version"] = version
             except Exception as e:
                 raise FirebaseInitializationError(f"Failed to initialize Firebase app: {str(e)}")
     except Exception as e:
         # Re-raise to be caught by the decorator
         raise FirebaseInitializationError(f"Firebase initialization failed: {str(e)}")
 
+def preload_firebase_app() -> None:
+    """
+    Build the Firebase app when a worker starts serving requests or jobs, so the first send does not pay for it.
+    Only the first call in a process does any work; failures surface on the next send instead.
+    """
+    if _firebase_app["app"]:
+        return
+    try:
+        initialize_firebase_app()
+    except FirebaseInitializationError:
+        pass
+
 def subscribe_tokens_to_topic(tokens: List[str], topic_name: str):
     """
     Subscribes a list of tokens to a Firebase topic.
@@ -41,32 +87,22 @@ def subscribe_tokens_to_topic(tokens: List[str], topic_name: str):
         return
     from firebase_admin import messaging
     response = messaging.subscribe_to_topic(tokens, topic_name)
-    if response.failure_count > 0:
-        errors = [e.reason for e in response.errors]
-        errored_index = [e.index for e in response.errors]
-        frappe.log_error(
-            title="FCM Subscribe Debug",
-            message=json.dumps({
-                "success_count": response.success_count,
-                "failure_count": response.failure_count,
-                "errors": errors
-            }, indent=2)
-        )
-        if errors:
-            if errors[0] == "INVALID_ARGUMENT" or errors[0] == "UNREGISTERED":
-                for i in errored_index:
-                    deactivate_device_token(tokens[i])
-            else:
-                frappe.log_error(
-                    title="FCM Subscribe topic error",
-                    message=json.dumps({
-                        "error": errors,
-                        "index": errored_index,
-                        "tokens": [tokens[i] for i in errored_index]
-                    }, indent=2)
-                )
-        if response.success_count == 0:
-            raise Exception(f"Failed to subscribe any device to topic: {topic_name}. Errors: {errors}")
+    handle_subscribe_response(tokens, topic_name, response)
+    if response.success_count == 0:
+        raise Exception(f"Failed to subscribe any device to topic: {topic_name}")
+
+def handle_subscribe_response(tokens: List[str], topic_name: str, response) -> List[str]:
+    """
+    Deactivates tokens an IID subscribe call rejected as invalid and logs the other failures.
+    Returns the tokens that failed with an error worth retrying.
+    """
+    if response.failure_count == 0:
+        return []
+
+    invalid, retryable = split_iid_errors(tokens, response)
+    deactivate_device_tokens(invalid)
+    log_iid_errors("FCM Subscribe topic error", tokens, topic_name, response, skip=set(invalid))
+    return retryable
 
 def unsubscribe_tokens_from_topic(tokens: List[str], topic_name: str):
     """
@@ -78,32 +114,76 @@ def unsubscribe_tokens_from_topic(tokens: List[str], topic_name: str):
 
     from firebase_admin import messaging
     response = messaging.unsubscribe_from_topic(tokens, topic_name)
-    if response.failure_count > 0:
-        errors = [e.reason for e in response.errors]
-        frappe.log_error(f"Partial failure unsubscribing from topic {topic_name}", str(errors))
-        if response.success_count == 0:
-            raise Exception(f"Failed to unsubscribe any device from topic: {topic_name}. Errors: {errors}")
+    handle_unsubscribe_response(tokens, topic_name, response)
+    if response.success_count == 0:
+        raise Exception(f"Failed to unsubscribe any device from topic: {topic_name}")
 
-def get_user_tokens(user_id: str, project_name: str = None, site_name: str = None) -> List[str]:
+def handle_unsubscribe_response(tokens: List[str], topic_name: str, response) -> List[str]:
+    """
+    Logs the failures of an IID unsubscribe call, except for invalid tokens, which are not subscribed to anything.
+    Returns the tokens that failed with an error worth retrying.
+    """
+    if response.failure_count == 0:
+        return []
+
+    invalid, retryable = split_iid_errors(tokens, response)
+    log_iid_errors(f"Partial failure unsubscribing from topic {topic_name}", tokens, topic_name, response, skip=set(invalid))
+    return retryable
+
+def split_iid_errors(tokens: List[str], response) -> Tuple[List[str], List[str]]:
+    """Returns the tokens an IID call rejected as invalid and those it failed for with a transient error"""
+    invalid = [tokens[e.index] for e in response.errors if e.reason in INVALID_IID_ERRORS]
+    retryable = [tokens[e.index] for e in response.errors if e.reason in RETRYABLE_IID_ERRORS]
+    return invalid, retryable
+
+def log_iid_errors(title: str, tokens: List[str], topic_name: str, response, skip: Set[str]) -> None:
+    errors = [e for e in response.errors if tokens[e.index] not in skip]
+    if not errors:
+        return
+    frappe.log_error(
+        title=title,
+        message=json.dumps({
+            "topic": topic_name,
+            "success_count": response.success_count,
+            "failure_count": response.failure_count,
+            "error": [e.reason for e in errors],
+            "index": [e.index for e in errors],
+            "tokens": [tokens[e.index] for e in errors]
+        }, indent=2)
+    )
+
+def get_user_tokens(user_id: str | List[str], project_name: str = None, site_name: str = None) -> List[str]:
     """
     Get user FCM tokens.
     Can be filtered by project and site.
+    Tokens of a single user are served from the token cache.
     """
-    filters = {"user_id": user_id}
-    if project_name:
-        filters["project_name"] = project_name
-    if site_name:
-        filters["site_name"] = site_name
-    
-    # Only get active tokens
-    filters["is_active"] = 1
     try:
-        data = frappe.db.get_all(
-            USER_TOKEN_DOCTYPE,
-            filters=filters,
-            fields=["fcm_token"]
-        )
-        return [item["fcm_token"] for item in data if item.get("fcm_token")]
+        if isinstance(user_id, str):
+            rows = get_cached_user_tokens(user_id, load_active_user_tokens)
+        else:
+            rows = load_active_user_tokens(user_id)
+        return [
+            fcm_token
+            for _, token_project, token_site, fcm_token in rows
+            if (not project_name or token_project == project_name)
+            and (not site_name or token_site == site_name)
+        ]
     except Exception as e:
         frappe.log_error(title="Failed to fetch user tokens", message=str(e))
-        return [] # Return empty list on failure 
\ No newline at end of file
+        return [] # Return empty list on failure
+
+def load_active_user_tokens(user_ids: List[str]) -> List[tuple]:
+    """Load the active (user_id, project_name, site_name, fcm_token) rows of the given users"""
+    data = frappe.db.get_all(
+        USER_TOKEN_DOCTYPE,
+        filters={
+            "user_id": ("in", user_ids),
+            "is_active": 1
+        },
+        fields=["user_id", "project_name", "site_name", "fcm_token"]
+    )
+    return [
+        (item["user_id"], item["project_name"], item["site_name"], item["fcm_token"])
+        for item in data if item.get("fcm_token")
+    ]
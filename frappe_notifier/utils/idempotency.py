@@ -0,0 +1,79 @@
+import hashlib
+import json
+from typing import Any, Dict, Iterable, Tuple
+
+import frappe
+from frappe.utils import cint
+
+from frappe_notifier.utils.settings import get_settings
+
+IDEMPOTENCY_PREFIX = "fn_idempotency"
+DEFAULT_KEY_TTL = 60 * 60
+IN_FLIGHT = "in_flight"
+DONE = "done"
+
+def get_request_key(endpoint: str, kwargs: Dict[str, Any], key_fields: Iterable[str]) -> Tuple[str, int] | None:
+    """
+    Returns the Redis key identifying a send request and how long it is remembered, or None
+    when the request is not deduplicated. An explicit idempotency_key wins; otherwise the
+    request is identified by a hash of its content when content deduplication is enabled.
+    Keys are scoped to the calling user, so clients cannot collide with each other.
+    """
+    settings = get_settings()
+    scope = f"{IDEMPOTENCY_PREFIX}:{endpoint}:{frappe.session.user}"
+    if kwargs.get("idempotency_key"):
+        return (
+            f"{scope}:key:{_digest(str(kwargs['idempotency_key']))}",
+            cint(settings.idempotency_key_ttl) or DEFAULT_KEY_TTL
+        )
+
+    window = cint(settings.content_dedupe_window)
+    if window <= 0:
+        return None
+    content = json.dumps([kwargs.get(field) for field in key_fields], sort_keys=True, default=str)
+    return f"{scope}:content:{_digest(content)}", window
+
+def claim(key: str, ttl: int) -> Dict[str, Any] | None:
+    """
+    Mark a request as in flight. Returns None when this is the first request with the key,
+    otherwise what is known about the original one.
+    """
+    redis_key = frappe.cache.make_key(key)
+    if frappe.cache.set(redis_key, json.dumps({"state": IN_FLIGHT}), nx=True, ex=ttl):
+        frappe.local.fn_idempotency_key = key
+        return None
+    original = frappe.cache.get(redis_key)
+    # The original may have expired in between; treat it as still running
+    return json.loads(original) if original else {"state": IN_FLIGHT}
+
+def remember_log_name(log_name: str) -> None:
+    """Attach the log of the request being processed, so duplicates arriving meanwhile can return it"""
+    key = getattr(frappe.local, "fn_idempotency_key", None)
+    if key:
+        frappe.cache.set(
+            frappe.cache.make_key(key), json.dumps({"state": IN_FLIGHT, "log_name": log_name}), xx=True, keepttl=True
+        )
+
+def complete(key: str, ttl: int, result: Any) -> None:
+    """Store the result of the original request for its duplicates"""
+    frappe.local.fn_idempotency_key = None
+    frappe.cache.set(frappe.cache.make_key(key), json.dumps({"state": DONE, "result": result}, default=str), ex=ttl)
+
+def release(key: str) -> None:
+    """Forget a request that failed, so the client can retry it"""
+    frappe.local.fn_idempotency_key = None
+    frappe.cache.delete(frappe.cache.make_key(key))
+
+def get_duplicate_response(original: Dict[str, Any]) -> Dict[str, Any]:
+    """The response to a duplicate request, built from the original one"""
+    if original.get("state") == DONE and isinstance(original.get("result"), dict):
+        return {**original["result"], "duplicate": True}
+    return {
+        "success": True,
+        "duplicate": True,
+        "in_progress": True,
+        "log_name": original.get("log_name"),
+    }
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
@@ -0,0 +1,214 @@
+import json
+import time
+from typing import Any, Dict, List, Tuple
+
+import frappe
+from frappe.utils import cint, now
+
+from frappe_notifier.utils.settings import get_settings
+from frappe_notifier.frappe_notifier.doctype.fn_user_device_token.fn_user_device_token import hash_token
+
+NOTIFICATION_LOG_DOCTYPE = "FN Notification Log"
+INSERT_BUFFER_KEY = "fn_log_buffer:inserts"
+UPDATE_BUFFER_KEY = "fn_log_buffer:updates"
+FIRST_BUFFERED_AT_KEY = "fn_log_buffer:first_at"
+FLUSH_LOCK_KEY = "fn_log_buffer:flush_lock"
+FLUSH_LOCK_TIMEOUT = 5 * 60
+FLUSH_JOB_ID = "frappe_notifier_flush_notification_logs"
+LOG_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by",
+    "status", "notification_type", "title", "body", "notification_data", "error_message"
+]
+DELIVERY_DOCTYPE = "FN Notification Delivery"
+DELIVERY_FIELDS = ["name", "creation", "modified", "owner", "modified_by", "notification_log", "token_hash", "error_code", "attempt"]
+DELIVERY_INSERT_CHUNK_SIZE = 5000
+DEFAULT_BUFFER_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 10
+UPDATE_CHUNK_SIZE = 500
+
+def is_buffering_enabled() -> bool:
+    return bool(get_settings().buffer_notification_logs)
+
+def insert_logs(entries: List[Dict[str, Any]], sync: bool = False) -> List[str]:
+    """
+    Write FN Notification Log rows without the document lifecycle.
+    Names are generated up front, so they are known even while the rows are still buffered.
+    Pass sync=True when the row has to exist in the database before this call returns.
+    """
+    timestamp = now()
+    rows = []
+    for entry in entries:
+        notification_data = entry.get("notification_data")
+        rows.append([
+            frappe.generate_hash(length=10), timestamp, timestamp, frappe.session.user, frappe.session.user,
+            entry.get("status") or "Pending",
+            entry.get("notification_type"),
+            entry.get("title"),
+            entry.get("body"),
+            notification_data if isinstance(notification_data, str) else json.dumps(notification_data),
+            entry.get("error_message"),
+        ])
+
+    if sync or not is_buffering_enabled():
+        frappe.db.bulk_insert(NOTIFICATION_LOG_DOCTYPE, fields=LOG_FIELDS, values=rows)
+    else:
+        _buffer(INSERT_BUFFER_KEY, rows)
+    return [row[0] for row in rows]
+
+def update_log_status(
+    log_name: str,
+    status: str,
+    error_message: str | None = None,
+    sync: bool = False,
+    retry_count: int | None = None,
+    next_retry_at: str | None = None
+) -> None:
+    """
+    Set the status of a log row. The error message and retry count are only replaced
+    when given; next_retry_at is cleared by every update that does not set it.
+    """
+    update = [log_name, status, error_message, now(), retry_count, next_retry_at]
+    if sync or not is_buffering_enabled():
+        _apply_updates([update])
+    else:
+        _buffer(UPDATE_BUFFER_KEY, [update])
+
+def insert_delivery_results(results: List[Tuple[str, str, str, int]]) -> None:
+    """
+    Write one narrow FN Notification Delivery row per recipient from
+    (log name, FCM token, error code, attempt) tuples, with multi-row INSERTs.
+    Tokens are stored as their SHA-256; an empty error code means FCM accepted the message.
+    """
+    if not results or not get_settings().store_delivery_results:
+        return
+
+    timestamp = now()
+    rows = [
+        [
+            # Far more rows than logs, so the names need more entropy than log names
+            frappe.generate_hash(length=20), timestamp, timestamp, frappe.session.user, frappe.session.user,
+            log_name, hash_token(token), error_code or "", attempt
+        ]
+        for log_name, token, error_code, attempt in results
+    ]
+    frappe.db.bulk_insert(DELIVERY_DOCTYPE, fields=DELIVERY_FIELDS, values=rows, chunk_size=DELIVERY_INSERT_CHUNK_SIZE)
+
+def flush_log_buffer() -> None:
+    """
+    Write buffered log rows with multi-row INSERTs followed by batched status UPDATEs.
+    Runs from the scheduler and whenever a buffer exceeds its size or age limit.
+    """
+    lock_key = frappe.cache.make_key(FLUSH_LOCK_KEY)
+    if not frappe.cache.set(lock_key, 1, nx=True, ex=FLUSH_LOCK_TIMEOUT):
+        return
+
+    try:
+        batch_size = cint(get_settings().log_buffer_size) or DEFAULT_BUFFER_SIZE
+        frappe.cache.delete(frappe.cache.make_key(FIRST_BUFFERED_AT_KEY))
+
+        # Every update popped here was buffered after its insert, so draining the
+        # inserts afterwards guarantees the rows exist when the updates are applied.
+        updates = _pop_all(UPDATE_BUFFER_KEY, batch_size)
+        try:
+            while inserts := _pop(INSERT_BUFFER_KEY, batch_size):
+                try:
+                    frappe.db.bulk_insert(NOTIFICATION_LOG_DOCTYPE, fields=LOG_FIELDS, values=inserts)
+                    frappe.db.commit()
+                except Exception:
+                    frappe.db.rollback()
+                    _requeue(INSERT_BUFFER_KEY, inserts)
+                    raise
+
+            if updates:
+                _apply_updates(updates)
+                frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            _requeue(UPDATE_BUFFER_KEY, updates)
+            raise
+    finally:
+        frappe.cache.delete(lock_key)
+
+def _buffer(key: str, rows: List[List[Any]]) -> None:
+    settings = get_settings()
+    buffer_size = cint(settings.log_buffer_size) or DEFAULT_BUFFER_SIZE
+    flush_interval = cint(settings.log_flush_interval) or DEFAULT_FLUSH_INTERVAL
+
+    pipeline = frappe.cache.pipeline()
+    pipeline.rpush(frappe.cache.make_key(key), *[json.dumps(row) for row in rows])
+    pipeline.set(frappe.cache.make_key(FIRST_BUFFERED_AT_KEY), time.time(), nx=True)
+    pipeline.get(frappe.cache.make_key(FIRST_BUFFERED_AT_KEY))
+    length, _, first_buffered_at = pipeline.execute()
+
+    if length >= buffer_size or time.time() - float(first_buffered_at) >= flush_interval:
+        frappe.enqueue(
+            "frappe_notifier.utils.log_writer.flush_log_buffer",
+            queue="short",
+            job_id=FLUSH_JOB_ID,
+            deduplicate=True
+        )
+
+def _pop(key: str, count: int) -> List[List[Any]]:
+    """Atomically take up to count rows from the head of a buffer"""
+    redis_key = frappe.cache.make_key(key)
+    pipeline = frappe.cache.pipeline()
+    pipeline.lrange(redis_key, 0, count - 1)
+    pipeline.ltrim(redis_key, count, -1)
+    rows, _ = pipeline.execute()
+    return [json.loads(row) for row in rows]
+
+def _requeue(key: str, rows: List[List[Any]]) -> None:
+    """Put rows back at the head of a buffer after a failed flush"""
+    if rows:
+        pipeline = frappe.cache.pipeline()
+        pipeline.lpush(frappe.cache.make_key(key), *[json.dumps(row) for row in reversed(rows)])
+        pipeline.execute()
+
+def _pop_all(key: str, batch_size: int) -> List[List[Any]]:
+    rows = []
+    while batch := _pop(key, batch_size):
+        rows.extend(batch)
+    return rows
+
+def _apply_updates(updates: List[List[Any]]) -> None:
+    """Apply status updates with one UPDATE ... CASE statement per chunk, last update wins"""
+    latest = {}
+    for update in updates:
+        # Rows buffered before retries were tracked have no retry columns
+        log_name, status, error_message, modified, retry_count, next_retry_at = (list(update) + [None, None])[:6]
+        previous = latest.get(log_name)
+        latest[log_name] = (
+            status,
+            error_message or (previous[1] if previous else None),
+            modified,
+            retry_count if retry_count is not None else (previous[3] if previous else None),
+            next_retry_at,
+        )
+
+    names = list(latest)
+    for i in range(0, len(names), UPDATE_CHUNK_SIZE):
+        chunk = names[i:i + UPDATE_CHUNK_SIZE]
+        status_cases = " ".join(["WHEN %s THEN %s"] * len(chunk))
+        error_cases = " ".join(["WHEN %s THEN COALESCE(%s, error_message)"] * len(chunk))
+        modified_cases = " ".join(["WHEN %s THEN %s"] * len(chunk))
+        retry_count_cases = " ".join(["WHEN %s THEN COALESCE(%s, retry_count)"] * len(chunk))
+        next_retry_cases = " ".join(["WHEN %s THEN %s"] * len(chunk))
+        values = []
+        for column in range(5):
+            for log_name in chunk:
+                values.extend([log_name, latest[log_name][column]])
+        values.extend(chunk)
+
+        frappe.db.sql(
+            f"""
+            UPDATE `tabFN Notification Log`
+            SET
+                status = CASE name {status_cases} END,
+                error_message = CASE name {error_cases} END,
+                modified = CASE name {modified_cases} END,
+                retry_count = CASE name {retry_count_cases} END,
+                next_retry_at = CASE name {next_retry_cases} END
+            WHERE name IN ({", ".join(["%s"] * len(chunk))})
+            """,
+            values
+        )
@@ -0,0 +1,139 @@
+import math
+import time
+from typing import Any, Dict, List, Tuple
+
+import frappe
+from frappe.utils import cint, flt
+
+from frappe_notifier.utils.settings import get_settings
+
+BUCKET_PREFIX = "fn_rate_limit"
+# Refill and take tokens in one atomic step. A bucket may go into debt when the cost is
+# larger than its capacity, so big sends pass once the bucket is full and later sends
+# wait until the debt is paid back at the configured rate.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+
+local wait = 0
+if tokens >= math.min(cost, capacity) then
+    tokens = tokens - cost
+else
+    wait = (math.min(cost, capacity) - tokens) / rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now), "rate", tostring(rate), "capacity", tostring(capacity))
+redis.call("EXPIRE", KEYS[1], math.ceil((capacity - math.min(tokens, 0)) / rate) + 60)
+return tostring(wait)
+"""
+
+class RateLimitExceededError(frappe.TooManyRequestsError):
+    """Raised when a project or site is over its send rate and over-limit sends are rejected"""
+    http_status_code = 429
+
+_script = {}
+
+def get_rate_limit(project_name: str | None, site_name: str | None) -> Tuple[str, float, float] | None:
+    """
+    Returns (bucket, messages per second, burst capacity) for a project/site, or None when
+    it is not limited. A row for the exact site wins over a row for the whole project
+    (blank site), which shares one bucket across the project's sites. Anything else gets
+    the default limit in a bucket of its own.
+    """
+    settings = get_settings()
+    if not settings.enable_rate_limiting:
+        return None
+
+    project_row = None
+    for row in settings.rate_limits:
+        if row.project_name != project_name:
+            continue
+        if row.site_name == site_name:
+            return f"{project_name}:{site_name}", flt(row.messages_per_second), _capacity(row)
+        if not row.site_name:
+            project_row = row
+    if project_row:
+        return f"{project_name}:*", flt(project_row.messages_per_second), _capacity(project_row)
+
+    rate = flt(settings.default_rate_limit)
+    if rate <= 0:
+        return None
+    return f"{project_name or ''}:{site_name or ''}", rate, max(rate, 1)
+
+def acquire(project_name: str | None, site_name: str | None, cost: int = 1) -> float:
+    """
+    Take cost messages from the bucket of a project/site.
+    Returns 0 when they were taken, otherwise the seconds until they can be (nothing is taken).
+    """
+    limit = get_rate_limit(project_name, site_name)
+    if not limit or limit[1] <= 0:
+        return 0.0
+    bucket, rate, capacity = limit
+    return float(_get_script()(keys=[_bucket_key(bucket)], args=[rate, capacity, max(cost, 1)]))
+
+def check_rate_limit(project_name: str | None, site_name: str | None, cost: int = 1) -> bool:
+    """
+    Charge a send against its rate limit at the API boundary.
+    Returns True when the send is over the limit and has to be queued instead of sent now,
+    or raises RateLimitExceededError when over-limit sends are rejected.
+    """
+    wait = acquire(project_name, site_name, cost)
+    if not wait:
+        return False
+    if get_settings().rate_limit_action != "Queue":
+        # Sent back in the body of the 429 response next to the error
+        frappe.local.response["retry_after"] = math.ceil(wait)
+        raise RateLimitExceededError(
+            f"Rate limit exceeded for {project_name or 'unattributed'}/{site_name or '*'}, retry in {math.ceil(wait)}s"
+        )
+    return True
+
+def get_bucket_levels() -> List[Dict[str, Any]]:
+    """Current fill level of every active bucket, refilled up to now"""
+    keys = list(frappe.cache.scan_iter(_bucket_key("*")))
+    if not keys:
+        return []
+
+    pipeline = frappe.cache.pipeline()
+    for key in keys:
+        pipeline.hgetall(key)
+    now = time.time()
+    prefix = _bucket_key("")
+
+    levels = []
+    for key, bucket in zip(keys, pipeline.execute()):
+        bucket = {k.decode(): float(v) for k, v in bucket.items()}
+        if not bucket:
+            continue
+        key = key.decode() if isinstance(key, bytes) else key
+        project_name, _, site_name = key[key.index(prefix) + len(prefix):].partition(":")
+        tokens = min(bucket["capacity"], bucket["tokens"] + max(0, now - bucket["updated_at"]) * bucket["rate"])
+        levels.append({
+            "project_name": project_name,
+            "site_name": site_name,
+            "messages_per_second": bucket["rate"],
+            "capacity": bucket["capacity"],
+            "tokens": round(tokens, 3),
+            "fill_ratio": round(max(tokens, 0) / bucket["capacity"], 3),
+        })
+    return sorted(levels, key=lambda level: level["fill_ratio"])
+
+def _capacity(row) -> float:
+    return max(cint(row.burst) or flt(row.messages_per_second), 1)
+
+def _bucket_key(bucket: str) -> str:
+    return frappe.cache.make_key(f"{BUCKET_PREFIX}:{bucket}")
+
+def _get_script():
+    # Registered once per process; redis-py runs it by SHA and reloads it if Redis lost it
+    if "token_bucket" not in _script:
+        _script["token_bucket"] = frappe.cache.register_script(TOKEN_BUCKET_SCRIPT)
+    return _script["token_bucket"]
@@ -0,0 +1,57 @@
+import threading
+
+import frappe
+
+SETTINGS_DOCTYPE = "Frappe Notifier Settings"
+SETTINGS_VERSION_KEY = "fn_settings_version"
+
+# Per-process registry of the settings each site was last loaded with, keyed by site.
+# Entries are rebuilt only when the settings version in Redis changes.
+_registry = {}
+_registry_lock = threading.Lock()
+
+def get_settings():
+    """
+    Returns the Frappe Notifier Settings document.
+    Kept in memory per worker process and reloaded only after the settings are saved.
+    """
+    version = get_settings_version()
+    entry = _registry.get(frappe.local.site)
+    if entry and entry[0] == version:
+        return entry[1]
+
+    with _registry_lock:
+        entry = _registry.get(frappe.local.site)
+        if not entry or entry[0] != version:
+            entry = (version, frappe.get_doc(SETTINGS_DOCTYPE))
+            _registry[frappe.local.site] = entry
+    return entry[1]
+
+def get_settings_version() -> str:
+    """
+    Returns the current settings version of the site.
+    Looked up in Redis once per request or job.
+    """
+    version = getattr(frappe.local, "fn_settings_version", None)
+    if version is None:
+        version = frappe.cache.get_value(SETTINGS_VERSION_KEY)
+        if not version:
+            # Redis was flushed; start a new version so no worker keeps what it had loaded
+            version = frappe.generate_hash(length=12)
+            frappe.cache.set_value(SETTINGS_VERSION_KEY, version)
+        frappe.local.fn_settings_version = version
+    return version
+
+def bump_settings_version() -> None:
+    """Make every worker reload the settings and rebuild the Firebase app on next use"""
+    frappe.cache.set_value(SETTINGS_VERSION_KEY, frappe.generate_hash(length=12))
+    frappe.local.fn_settings_version = None
+
+def get_send_queue(priority: str | None = None) -> str:
+    """The worker queue for a priority. Workers listening on several queues drain them in the order given."""
+    settings = get_settings()
+    if priority == "high":
+        return settings.high_priority_queue or "short"
+    if priority == "low":
+        return settings.low_priority_queue or "long"
+    return settings.send_queue or "default"
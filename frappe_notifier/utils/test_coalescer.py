@@ -0,0 +1,58 @@
+from unittest.mock import patch
+
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_notifier.utils import coalescer
+from frappe_notifier.utils.coalescer import add_to_digest, get_collapse_key, get_digest_group, pop_digest
+
+TARGET = {"project_name": "project", "site_name": "site", "user_id": "coalescer-test-user"}
+
+
+class TestCoalescer(FrappeTestCase):
+    def setUp(self):
+        pop_digest("user", TARGET)
+        patches = (
+            patch.object(coalescer, "get_coalesce_window", return_value=30),
+            patch.object(coalescer, "get_send_queue", side_effect=lambda priority: f"queue-{priority}"),
+            patch.object(coalescer, "enqueue_due_jobs"),
+        )
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        pop_digest("user", TARGET)
+
+    def add(self, log_name, priority=None):
+        add_to_digest("user", TARGET, log_name, f"Title {log_name}", "Body", {}, priority=priority)
+
+    @patch.object(coalescer, "schedule_job")
+    def test_first_notification_of_a_window_schedules_the_digest(self, schedule_job):
+        self.add("log-a", priority="high")
+        self.add("log-b", priority="low")
+
+        schedule_job.assert_called_once()
+        self.assertEqual(schedule_job.call_args.args, ("frappe_notifier.api.send_notification.send_digest", 30))
+        self.assertEqual(schedule_job.call_args.kwargs["queue"], "queue-high")
+        self.assertEqual(schedule_job.call_args.kwargs["target"], TARGET)
+
+    @patch.object(coalescer, "schedule_job")
+    def test_pop_returns_the_window_oldest_first_and_empties_it(self, schedule_job):
+        for log_name in ("log-a", "log-b", "log-c"):
+            self.add(log_name)
+
+        self.assertEqual([entry["log_name"] for entry in pop_digest("user", TARGET)], ["log-a", "log-b", "log-c"])
+        self.assertEqual(pop_digest("user", TARGET), [])
+
+        # The next notification opens a new window
+        self.add("log-d")
+        self.assertEqual(schedule_job.call_count, 2)
+
+    def test_groups_and_collapse_keys(self):
+        self.assertEqual(get_digest_group("topic", {"topic_name": "news"}), "topic:news")
+        self.assertEqual(get_digest_group("user", TARGET), "user:project:site:coalescer-test-user")
+
+        collapse_key = get_collapse_key(get_digest_group("user", TARGET))
+        self.assertEqual(len(collapse_key), 32)
+        self.assertEqual(collapse_key, get_collapse_key("user:project:site:coalescer-test-user"))
+        self.assertNotEqual(collapse_key, get_collapse_key("topic:news"))
@@ -0,0 +1,70 @@
+from unittest.mock import MagicMock, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_notifier.utils import idempotency
+from frappe_notifier.utils.decorators import idempotent_send
+from frappe_notifier.utils.idempotency import remember_log_name
+
+SETTINGS = frappe._dict(idempotency_key_ttl=60, content_dedupe_window=0)
+
+
+class TestIdempotentSend(FrappeTestCase):
+    def setUp(self):
+        self.send = MagicMock(return_value={"success": True, "log_name": "log-a"})
+        # Keys are scoped by the endpoint name, so every test gets its own
+        self.send.__name__ = f"send_{frappe.generate_hash(length=8)}"
+        self.endpoint = idempotent_send("title", "body")(self.send)
+        patcher = patch.object(idempotency, "get_settings", return_value=SETTINGS)
+        self.get_settings = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.clear_keys)
+
+    def clear_keys(self):
+        frappe.local.fn_idempotency_key = None
+        frappe.cache.delete_keys(f"{idempotency.IDEMPOTENCY_PREFIX}:{self.send.__name__}:")
+
+    def test_repeated_key_returns_first_result(self):
+        self.assertEqual(self.endpoint(title="a", idempotency_key="k1"), {"success": True, "log_name": "log-a"})
+        duplicate = self.endpoint(title="b", idempotency_key="k1")
+
+        self.assertEqual(duplicate, {"success": True, "log_name": "log-a", "duplicate": True})
+        self.assertEqual(self.send.call_count, 1)
+
+    def test_other_key_is_sent(self):
+        self.endpoint(title="a", idempotency_key="k1")
+        self.endpoint(title="a", idempotency_key="k2")
+        self.assertEqual(self.send.call_count, 2)
+
+    def test_without_key_or_window_every_request_is_sent(self):
+        self.endpoint(title="a")
+        self.endpoint(title="a")
+        self.assertEqual(self.send.call_count, 2)
+
+    def test_same_content_within_window_is_deduplicated(self):
+        self.get_settings.return_value = frappe._dict(SETTINGS, content_dedupe_window=60)
+        self.endpoint(title="a", body="x")
+        self.endpoint(title="a", body="x", tag="ignored")
+        self.endpoint(title="a", body="y")
+        self.assertEqual(self.send.call_count, 2)
+
+    def test_failed_request_can_be_retried(self):
+        self.send.side_effect = [frappe.ValidationError, {"success": True}]
+        self.assertRaises(frappe.ValidationError, self.endpoint, title="a", idempotency_key="k1")
+        self.assertEqual(self.endpoint(title="a", idempotency_key="k1"), {"success": True})
+
+    def test_duplicate_of_request_in_flight_returns_its_log(self):
+        responses = []
+
+        def send(**kwargs):
+            remember_log_name("log-b")
+            responses.append(self.endpoint(**kwargs))
+            return {"success": True, "log_name": "log-b"}
+
+        self.send.side_effect = send
+        self.endpoint(title="a", idempotency_key="k1")
+
+        self.assertEqual(
+            responses, [{"success": True, "duplicate": True, "in_progress": True, "log_name": "log-b"}]
+        )
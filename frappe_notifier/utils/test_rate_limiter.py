@@ -0,0 +1,77 @@
+import time
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from frappe_notifier.utils import rate_limiter
+from frappe_notifier.utils.rate_limiter import _bucket_key, _get_script, get_rate_limit
+
+TEST_BUCKET = "fn-test:token-bucket"
+
+
+class TestRateLimiter(FrappeTestCase):
+    def setUp(self):
+        self.bucket_key = _bucket_key(TEST_BUCKET)
+        frappe.cache.delete(self.bucket_key)
+
+    def tearDown(self):
+        frappe.cache.delete(self.bucket_key)
+
+    def take(self, cost, rate=1, capacity=10):
+        return float(_get_script()(keys=[self.bucket_key], args=[rate, capacity, cost]))
+
+    def bucket_tokens(self):
+        # Raw pipeline: frappe.cache.hget would prefix the key again and unpickle the value
+        pipeline = frappe.cache.pipeline()
+        pipeline.hget(self.bucket_key, "tokens")
+        return float(pipeline.execute()[0])
+
+    def test_token_bucket_starts_full(self):
+        self.assertEqual(self.take(4), 0)
+        self.assertAlmostEqual(self.bucket_tokens(), 6, delta=0.1)
+
+    def test_token_bucket_waits_without_taking(self):
+        self.assertEqual(self.take(10), 0)
+        wait = self.take(5)
+        self.assertAlmostEqual(wait, 5, delta=0.1)
+        # Nothing was taken by the call that has to wait
+        self.assertAlmostEqual(self.bucket_tokens(), 0, delta=0.1)
+
+    def test_token_bucket_refills_at_its_rate(self):
+        self.assertEqual(self.take(10, rate=100), 0)
+        time.sleep(0.05)
+        self.assertEqual(self.take(4, rate=100), 0)
+
+    def test_token_bucket_never_refills_past_capacity(self):
+        self.assertEqual(self.take(1), 0)
+        frappe.cache.hset(self.bucket_key, "updated_at", time.time() - 3600)
+        self.assertEqual(self.take(1), 0)
+        self.assertAlmostEqual(self.bucket_tokens(), 9, delta=0.1)
+
+    def test_token_bucket_goes_into_debt_for_large_sends(self):
+        # A send larger than the capacity passes once the bucket is full
+        self.assertEqual(self.take(25), 0)
+        self.assertAlmostEqual(self.bucket_tokens(), -15, delta=0.1)
+        # and the next send waits until the debt is paid back
+        self.assertAlmostEqual(self.take(1), 16, delta=0.1)
+
+    def test_token_bucket_expires_once_refilled(self):
+        self.take(10)
+        ttl = frappe.cache.ttl(self.bucket_key)
+        self.assertGreater(ttl, 0)
+        self.assertLessEqual(ttl, 10 + 60)
+
+    def test_site_limit_wins_over_project_limit(self):
+        settings = frappe._dict(
+            enable_rate_limiting=1,
+            default_rate_limit=0,
+            rate_limits=[
+                frappe._dict(project_name="project", site_name="", messages_per_second=50, burst=0),
+                frappe._dict(project_name="project", site_name="site", messages_per_second=5, burst=20),
+            ],
+        )
+        with patch.object(rate_limiter, "get_settings", return_value=settings):
+            self.assertEqual(get_rate_limit("project", "site"), ("project:site", 5, 20))
+            self.assertEqual(get_rate_limit("project", "other"), ("project:*", 50, 50))
+            self.assertIsNone(get_rate_limit("other", "site"))
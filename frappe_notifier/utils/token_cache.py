@@ -0,0 +1,204 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import frappe
+from frappe.query_builder import DocType
+
+# Cached values live in Redis for an hour and are dropped explicitly whenever
+# tokens or topic memberships change. Entries of the per-worker LRU in front of
+# Redis are keyed by a version every invalidation bumps, so other workers stop
+# using them on their next request or job. Within one request or job they are
+# still served until they expire, so they are kept short-lived.
+REDIS_TTL = 60 * 60
+LOCAL_TTL = 5
+LOCAL_MAXSIZE = 256
+# The LRU is bounded by the token rows it holds, not only by its entries. Lists longer
+# than LOCAL_MAX_ENTRY_ROWS, such as the tokens of a large channel, are served from Redis only.
+LOCAL_MAX_ROWS = 50000
+LOCAL_MAX_ENTRY_ROWS = 5000
+STATS_KEY = "fn_token_cache_stats"
+VERSION_KEY = "fn_token_cache_version"
+STATS_FLUSH_EVERY = 100
+
+USER_TOKENS_PREFIX = "fn_tokens:user"
+TOPIC_TOKENS_PREFIX = "fn_tokens:topic"
+
+class _LocalLRU:
+    """
+    Small thread-safe LRU with a per-entry TTL, private to the worker process.
+    Bounded by entry count and by the total length of the cached lists.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, max_rows: int = LOCAL_MAX_ROWS, max_entry_rows: int = LOCAL_MAX_ENTRY_ROWS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.max_entry_rows = max_entry_rows
+        self._data: OrderedDict = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Tuple, value: Any) -> None:
+        with self._lock:
+            self._pop(key)
+            if len(value) > self.max_entry_rows:
+                return
+            now = time.monotonic()
+            self._data[key] = (now + self.ttl, value)
+            self._rows += len(value)
+            # Expired entries are dropped from the cold end first, then the least recently used ones
+            while self._data:
+                oldest_key, (expires_at, oldest) = next(iter(self._data.items()))
+                if expires_at >= now and len(self._data) <= self.maxsize and self._rows <= self.max_rows:
+                    break
+                self._pop(oldest_key)
+
+    def delete(self, key: Tuple) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key: Tuple) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._rows -= len(entry[1])
+
+_local_cache = _LocalLRU(LOCAL_MAXSIZE, LOCAL_TTL)
+_stats = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+_pending_stats = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+def get_cached_user_tokens(user_id: str, loader: Callable[[List[str]], List[Tuple]]) -> List[Tuple]:
+    """
+    Returns the active (user_id, project_name, site_name, fcm_token) rows of a user.
+    Project and site filtering is left to the caller so one entry serves every filter.
+    """
+    return _get(f"{USER_TOKENS_PREFIX}:{user_id}", lambda: loader([user_id]))
+
+def get_cached_topic_tokens(topic_name: str, loader: Callable[[str], List[Tuple]]) -> List[Tuple]:
+    """Returns the active (user_id, fcm_token) rows of every member of a topic."""
+    return _get(f"{TOPIC_TOKENS_PREFIX}:{topic_name}", lambda: loader(topic_name))
+
+def invalidate_user_tokens(user_ids: str | Iterable[str]) -> None:
+    """Drop cached tokens of the given users and of every topic they are members of"""
+    if isinstance(user_ids, str):
+        user_ids = [user_ids]
+    user_ids = list(set(filter(None, user_ids)))
+    if not user_ids:
+        return
+
+    _invalidate(
+        [f"{USER_TOKENS_PREFIX}:{user_id}" for user_id in user_ids]
+        + [f"{TOPIC_TOKENS_PREFIX}:{topic_name}" for topic_name in get_user_topic_names(user_ids)]
+    )
+
+def invalidate_topic_tokens(topic_names: str | Iterable[str]) -> None:
+    """Drop cached channel tokens of the given topics"""
+    if isinstance(topic_names, str):
+        topic_names = [topic_names]
+    _invalidate([f"{TOPIC_TOKENS_PREFIX}:{topic_name}" for topic_name in set(filter(None, topic_names))])
+
+def get_user_topic_names(user_ids: List[str]) -> List[str]:
+    topic_member = DocType("FN Topic Member")
+    return (
+        frappe.qb.from_(topic_member)
+        .select(topic_member.topic_name)
+        .distinct()
+        .where(topic_member.user_id.isin(user_ids))
+        .run(pluck=True)
+    )
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters of this worker and the totals aggregated in Redis across workers"""
+    _flush_stats()
+    # Raw pipeline: the counters are plain integers, not pickled cache values
+    pipeline = frappe.cache.pipeline()
+    pipeline.hgetall(frappe.cache.make_key(STATS_KEY))
+    totals = pipeline.execute()[0] or {}
+    with _stats_lock:
+        return {
+            "worker": dict(_stats),
+            "total": {key.decode() if isinstance(key, bytes) else key: int(value) for key, value in totals.items()},
+        }
+
+def get_cache_version() -> str:
+    """
+    Returns the current token cache version of the site.
+    Looked up in Redis once per request or job.
+    """
+    version = getattr(frappe.local, "fn_token_cache_version", None)
+    if version is None:
+        version = frappe.cache.get_value(VERSION_KEY)
+        if not version:
+            # Redis was flushed; start a new version so no worker keeps what it had cached
+            version = frappe.generate_hash(length=12)
+            frappe.cache.set_value(VERSION_KEY, version)
+        frappe.local.fn_token_cache_version = version
+    return version
+
+def _get(key: str, load: Callable[[], List[Tuple]]) -> List[Tuple]:
+    local_key = (frappe.local.site, get_cache_version(), key)
+    value = _local_cache.get(local_key)
+    if value is not None:
+        _count("local_hits")
+        return value
+
+    value = frappe.cache.get_value(key)
+    if value is not None:
+        _count("redis_hits")
+    else:
+        _count("misses")
+        value = [tuple(row) for row in load()]
+        frappe.cache.set_value(key, value, expires_in_sec=REDIS_TTL)
+
+    _local_cache.set(local_key, value)
+    return value
+
+def _invalidate(keys: List[str]) -> None:
+    if not keys:
+        return
+
+    def delete():
+        frappe.cache.delete_value(keys)
+        # Every worker's local entries are keyed by the old version from now on
+        frappe.cache.set_value(VERSION_KEY, frappe.generate_hash(length=12))
+        frappe.local.fn_token_cache_version = None
+
+    delete()
+    # Readers may repopulate the cache from the old rows until this transaction commits
+    frappe.db.after_commit.add(delete)
+
+def _count(counter: str) -> None:
+    with _stats_lock:
+        _stats[counter] += 1
+        _pending_stats[counter] += 1
+        should_flush = sum(_pending_stats.values()) >= STATS_FLUSH_EVERY
+    if should_flush:
+        _flush_stats()
+
+def _flush_stats() -> None:
+    with _stats_lock:
+        pending = {counter: count for counter, count in _pending_stats.items() if count}
+        for counter in _pending_stats:
+            _pending_stats[counter] = 0
+    if not pending:
+        return
+
+    key = frappe.cache.make_key(STATS_KEY)
+    pipeline = frappe.cache.pipeline()
+    for counter, count in pending.items():
+        pipeline.hincrby(key, counter, count)
+    pipeline.execute()
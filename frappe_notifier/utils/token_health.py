@@ -0,0 +1,185 @@
+import gzip
+import json
+import os
+from typing import List
+
+import frappe
+from firebase_admin import exceptions, messaging
+from frappe.query_builder import DocType
+from frappe.utils import add_days, cint, now, now_datetime
+
+from frappe_notifier.frappe_notifier.doctype.fn_user_device_token.fn_user_device_token import (
+    deactivate_device_tokens,
+    hash_token,
+)
+from frappe_notifier.utils.fcm_sender import get_fcm_sender
+from frappe_notifier.utils.firebase import initialize_firebase_app
+from frappe_notifier.utils.settings import get_settings
+from frappe_notifier.utils.token_cache import invalidate_user_tokens
+from frappe_notifier.utils.topic_sync import queue_token_unsubscriptions
+
+# Tokens FCM will never deliver to again
+INVALID_TOKEN_ERRORS = (messaging.UnregisteredError, messaging.SenderIdMismatchError)
+# Transient FCM failures worth sending again
+RETRYABLE_ERRORS = (
+    exceptions.UnavailableError,
+    exceptions.InternalError,
+    exceptions.DeadlineExceededError,
+    messaging.QuotaExceededError,
+)
+
+DEFAULT_INACTIVE_RETENTION_DAYS = 30
+DEFAULT_IDLE_DAYS = 30
+DEFAULT_VALIDATION_LIMIT = 10000
+PURGE_BATCH_SIZE = 5000
+# FCM sends are batched 500 messages at a time
+VALIDATION_BATCH_SIZE = 500
+ARCHIVE_FOLDER = "fn_device_token_archive"
+
+def run_token_maintenance() -> None:
+    """Daily job: purge long-inactive tokens, then validate long-idle active ones"""
+    if not get_settings().enable_token_gc:
+        return
+    purge_inactive_tokens()
+    validate_idle_tokens()
+
+def is_token_failure(error: Exception | None) -> bool:
+    """
+    Whether a failed send counts against the token itself. Only INVALID_ARGUMENT can be about the
+    token, and only when the payload is known to be fine, such as when the same message reached
+    other tokens. Auth, permission and transient errors hit every token of the project alike and
+    are never counted.
+    """
+    return isinstance(error, exceptions.InvalidArgumentError)
+
+def record_token_failures(tokens: List[str]) -> None:
+    """
+    Add one failure to each token and retire tokens that reach Max Token Failures, in the same UPDATE.
+    Retired tokens are queued to be unsubscribed from their topics.
+    The counter is reset when a dry-run validation or a new registration of the token succeeds.
+    """
+    settings = get_settings()
+    max_failures = cint(settings.max_token_failures)
+    if not tokens or not settings.enable_token_gc or max_failures <= 0:
+        return
+
+    token_hashes = [hash_token(token) for token in set(tokens)]
+    for i in range(0, len(token_hashes), VALIDATION_BATCH_SIZE):
+        chunk = tuple(token_hashes[i:i + VALIDATION_BATCH_SIZE])
+        retired = frappe.get_all(
+            "FN User Device Token",
+            filters={"token_hash": ("in", chunk), "is_active": 1, "failure_count": (">=", max_failures - 1)},
+            fields=["user_id", "fcm_token"],
+            as_list=True
+        )
+        # is_active and modified are assigned first, so they still see the old failure_count.
+        # Retiring sets modified, which the purge retention window counts from.
+        frappe.db.sql(
+            """
+            UPDATE `tabFN User Device Token`
+            SET is_active = IF(failure_count + 1 >= %s, 0, is_active),
+                modified = IF(failure_count + 1 >= %s, %s, modified),
+                failure_count = failure_count + 1
+            WHERE token_hash IN %s
+            """,
+            (max_failures, max_failures, now(), chunk)
+        )
+        invalidate_user_tokens(list({user_id for user_id, _ in retired}))
+        queue_token_unsubscriptions(retired)
+
+def purge_inactive_tokens() -> int:
+    """
+    Delete tokens inactive for longer than Inactive Token Retention (Days), in chunks
+    committed one by one. With Archive Tokens Before Purge the rows are first appended
+    to a gzipped JSONL file in the site's private files. Returns how many were deleted.
+    """
+    settings = get_settings()
+    cutoff = add_days(now_datetime(), -(cint(settings.inactive_token_retention_days) or DEFAULT_INACTIVE_RETENTION_DAYS))
+    device_token = DocType("FN User Device Token")
+    purged = 0
+
+    while True:
+        names = sorted(
+            frappe.qb.from_(device_token)
+            .select(device_token.name)
+            .where(device_token.is_active == 0)
+            .where(device_token.modified < cutoff)
+            .orderby(device_token.modified)
+            .limit(PURGE_BATCH_SIZE)
+            .run(pluck=True)
+        )
+        if not names:
+            break
+
+        if settings.archive_tokens_before_purge:
+            archive_tokens(names)
+        frappe.db.delete("FN User Device Token", {"name": ("in", names)})
+        frappe.db.commit()
+        purged += len(names)
+
+        if len(names) < PURGE_BATCH_SIZE:
+            break
+    return purged
+
+def archive_tokens(names: List[str]) -> None:
+    """Append the given token rows to today's gzipped JSONL archive in the site's private files"""
+    rows = frappe.db.get_all("FN User Device Token", filters={"name": ("in", names)}, fields=["*"])
+    folder = frappe.get_site_path("private", "files", ARCHIVE_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"fn-device-token-{now_datetime().date()}.jsonl.gz")
+    # gzip members can be concatenated, so every chunk is appended as its own member
+    with gzip.open(path, "at", encoding="utf-8") as archive:
+        for row in rows:
+            archive.write(json.dumps(row, default=str) + "\n")
+
+def validate_idle_tokens() -> int:
+    """
+    Check active tokens that were neither registered again nor validated for Token Idle Days
+    with validate_only dry-run sends, 500 per batch and at most Token Validation Limit per run.
+    Tokens FCM rejects as invalid are deactivated, and so are those failing with INVALID_ARGUMENT:
+    the dry run carries nothing but the token, so that error is about the token itself.
+    Tokens that pass get their failure counter reset. Returns how many tokens were checked.
+    """
+    settings = get_settings()
+    idle_days = cint(settings.token_idle_days) or DEFAULT_IDLE_DAYS
+    cutoff = add_days(now_datetime(), -idle_days)
+    device_token = DocType("FN User Device Token")
+
+    tokens = (
+        frappe.qb.from_(device_token)
+        .select(device_token.fcm_token)
+        .where(device_token.is_active == 1)
+        .where(device_token.modified < cutoff)
+        .where(device_token.last_validated_at.isnull() | (device_token.last_validated_at < cutoff))
+        .orderby(device_token.modified)
+        .limit(cint(settings.token_validation_limit) or DEFAULT_VALIDATION_LIMIT)
+        .run(pluck=True)
+    )
+    tokens = list(dict.fromkeys(filter(None, tokens)))
+    if not tokens:
+        return 0
+
+    initialize_firebase_app()
+    sender = get_fcm_sender()
+    for i in range(0, len(tokens), VALIDATION_BATCH_SIZE):
+        batch = tokens[i:i + VALIDATION_BATCH_SIZE]
+        responses = sender.send_each([messaging.Message(token=token) for token in batch], dry_run=True).responses
+
+        valid = [token for token, response in zip(batch, responses) if response.success]
+        if valid:
+            # modified is left alone: it tracks when the token was last registered
+            frappe.db.sql(
+                """
+                UPDATE `tabFN User Device Token`
+                SET last_validated_at = %s, failure_count = 0
+                WHERE token_hash IN %s
+                """,
+                (now(), tuple(hash_token(token) for token in valid))
+            )
+        # Transient errors leave the token unvalidated, so the next run checks it again
+        deactivate_device_tokens([
+            token for token, response in zip(batch, responses)
+            if isinstance(response.exception, INVALID_TOKEN_ERRORS) or is_token_failure(response.exception)
+        ])
+        frappe.db.commit()
+    return len(tokens)
@@ -0,0 +1,428 @@
+import json
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Set
+
+import frappe
+from firebase_admin import messaging
+from frappe.query_builder import DocType
+from frappe.utils import cint
+
+from frappe_notifier.frappe_notifier.doctype.fn_user_device_token.fn_user_device_token import hash_token
+from frappe_notifier.utils.delayed_jobs import schedule_job
+from frappe_notifier.utils.firebase import (
+    RETRYABLE_IID_CALL_ERRORS,
+    handle_subscribe_response,
+    handle_unsubscribe_response,
+    initialize_firebase_app,
+    load_active_user_tokens,
+)
+from frappe_notifier.utils.settings import get_settings
+from frappe_notifier.utils.token_cache import invalidate_topic_tokens
+
+PENDING_SUBSCRIPTIONS_KEY = "fn_topic_sync:subscribe"
+PENDING_UNSUBSCRIPTIONS_KEY = "fn_topic_sync:unsubscribe"
+SYNC_JOB_ID = "fn_topic_sync"
+# The IID batch API accepts at most 1000 tokens per call
+IID_BATCH_SIZE = 1000
+# Pairs taken from Redis per round of the sync job
+SYNC_CHUNK_SIZE = 10000
+RETRY_DELAY = 60
+# Attempts per pending pair before it is given up on, counted in a Redis hash
+SYNC_ATTEMPTS_KEY = "fn_topic_sync:attempts"
+MAX_SYNC_ATTEMPTS = 5
+SYNC_ATTEMPTS_TTL = 24 * 60 * 60
+DEFAULT_IID_WORKERS = 4
+# Users whose tokens are loaded per query, and token rows per page of a topic removal
+USER_PAGE_SIZE = 1000
+TOKEN_PAGE_SIZE = 10000
+
+REMOVAL_PREFIX = "fn_topic_removal"
+SUBSCRIPTION_PREFIX = "fn_topic_subscription"
+# Removal and subscription jobs hand over to a fresh job after this many seconds, well inside the RQ timeout
+LONG_JOB_BUDGET = 240
+PROGRESS_TTL = 7 * 24 * 60 * 60
+
+def queue_topic_subscriptions(fcm_token: str, topic_names: Iterable[str]) -> None:
+    """
+    Record that a token has to be subscribed to the given topics and make sure a sync job will pick it up.
+    Pairs wait in a Redis set, so a token registered twice is only subscribed once.
+    """
+    queue_pairs([json.dumps([topic_name, fcm_token]) for topic_name in topic_names])
+
+def queue_token_unsubscriptions(rows: Iterable[tuple]) -> None:
+    """
+    Queue the tokens of removed or deactivated (user_id, fcm_token) rows to be unsubscribed from the
+    topics of their user, so they stop receiving topic sends. Topics a token still reaches through
+    another active registration of the same device are kept. Call it after the rows were changed.
+    """
+    rows = {(user_id, fcm_token) for user_id, fcm_token in rows if user_id and fcm_token}
+    if not rows:
+        return
+
+    device_token = DocType("FN User Device Token")
+    still_active = (
+        frappe.qb.from_(device_token)
+        .select(device_token.user_id, device_token.fcm_token)
+        .where(device_token.token_hash.isin(list({hash_token(fcm_token) for _, fcm_token in rows})))
+        .where(device_token.is_active == 1)
+        .run()
+    )
+    topics_by_user = get_topics_by_user({user_id for user_id, _ in rows}.union(user_id for user_id, _ in still_active))
+    keep = {(topic_name, fcm_token) for user_id, fcm_token in still_active for topic_name in topics_by_user[user_id]}
+    queue_pairs([
+        json.dumps([topic_name, fcm_token])
+        for user_id, fcm_token in rows
+        for topic_name in topics_by_user[user_id]
+        if (topic_name, fcm_token) not in keep
+    ], subscribe=False)
+
+def get_topics_by_user(user_ids: Iterable[str]) -> Dict[str, List[str]]:
+    user_ids = sorted(user_ids)
+    topic_member = DocType("FN Topic Member")
+    topics_by_user = defaultdict(list)
+    for i in range(0, len(user_ids), USER_PAGE_SIZE):
+        for user_id, topic_name in (
+            frappe.qb.from_(topic_member)
+            .select(topic_member.user_id, topic_member.topic_name)
+            .where(topic_member.user_id.isin(user_ids[i:i + USER_PAGE_SIZE]))
+            .run()
+        ):
+            topics_by_user[user_id].append(topic_name)
+    return topics_by_user
+
+def queue_pairs(pairs: List[str], subscribe: bool = True) -> None:
+    """
+    Queue (topic, token) pairs to be subscribed or unsubscribed. A pair still waiting for the
+    opposite change is taken out of that queue, so the latest change wins.
+    """
+    if not pairs:
+        return
+    target, opposite = PENDING_SUBSCRIPTIONS_KEY, PENDING_UNSUBSCRIPTIONS_KEY
+    if not subscribe:
+        target, opposite = opposite, target
+    pipeline = frappe.cache.pipeline()
+    pipeline.srem(frappe.cache.make_key(opposite), *pairs)
+    pipeline.sadd(frappe.cache.make_key(target), *pairs)
+    pipeline.execute()
+    enqueue_topic_sync()
+
+def enqueue_topic_sync() -> None:
+    # One sync job at a time; it drains everything that was queued before it finishes
+    frappe.enqueue(
+        "frappe_notifier.utils.topic_sync.sync_topic_subscriptions",
+        queue="default",
+        job_id=SYNC_JOB_ID,
+        deduplicate=True,
+        enqueue_after_commit=True
+    )
+
+def sync_topic_subscriptions() -> int:
+    """
+    Background job: subscribe pending tokens to their topics, then unsubscribe those pending
+    removal, grouped by topic in IID batch calls of up to 1000 tokens. Returns how many pairs were handled.
+    Also runs every minute from the scheduler, for pairs queued while a sync job was finishing.
+    Pairs that failed with a transient error are put back and retried a minute later, at most
+    MAX_SYNC_ATTEMPTS times; tokens FCM rejected for good are dropped.
+    """
+    handled = 0
+    retry_later = False
+    for subscribe in (True, False):
+        key = frappe.cache.make_key(PENDING_SUBSCRIPTIONS_KEY if subscribe else PENDING_UNSUBSCRIPTIONS_KEY)
+        while True:
+            pipeline = frappe.cache.pipeline()
+            pipeline.spop(key, SYNC_CHUNK_SIZE)
+            pairs = pipeline.execute()[0]
+            if not pairs:
+                break
+
+            initialize_firebase_app()
+            failed = []
+            for topic_name, tokens in group_by_topic(pairs).items():
+                failed.extend(json.dumps([topic_name, token]) for token in run_iid_batches(topic_name, tokens, subscribe))
+            handled += len(pairs)
+
+            retry = count_sync_attempts(pairs, failed, subscribe)
+            if retry:
+                pipeline = frappe.cache.pipeline()
+                pipeline.sadd(key, *retry)
+                pipeline.execute()
+                retry_later = True
+                break
+
+    if retry_later:
+        schedule_job("frappe_notifier.utils.topic_sync.sync_topic_subscriptions", RETRY_DELAY)
+    return handled
+
+def count_sync_attempts(pairs: List[bytes | str], failed: List[str], subscribe: bool = True) -> List[str]:
+    """
+    Count a failed attempt for each failed pair and forget the attempts of the others.
+    Returns the failed pairs that have attempts left; the rest are logged and given up on.
+    """
+    attempts_key = frappe.cache.make_key(f"{SYNC_ATTEMPTS_KEY}:{'subscribe' if subscribe else 'unsubscribe'}")
+    done = {pair.decode() if isinstance(pair, bytes) else pair for pair in pairs}.difference(failed)
+
+    pipeline = frappe.cache.pipeline()
+    if done:
+        pipeline.hdel(attempts_key, *done)
+    for pair in failed:
+        pipeline.hincrby(attempts_key, pair, 1)
+    if failed:
+        pipeline.expire(attempts_key, SYNC_ATTEMPTS_TTL)
+    results = pipeline.execute()
+    attempts = results[1:len(failed) + 1] if done else results[:len(failed)]
+
+    retry = [pair for pair, count in zip(failed, attempts) if count < MAX_SYNC_ATTEMPTS]
+    given_up = [pair for pair, count in zip(failed, attempts) if count >= MAX_SYNC_ATTEMPTS]
+    if given_up:
+        pipeline = frappe.cache.pipeline()
+        pipeline.hdel(attempts_key, *given_up)
+        pipeline.execute()
+        frappe.log_error(
+            title="FCM topic sync gave up",
+            message=f"{len(given_up)} topic {'subscriptions' if subscribe else 'unsubscriptions'} failed {MAX_SYNC_ATTEMPTS} times:\n" + "\n".join(given_up[:100])
+        )
+    return retry
+
+def group_by_topic(pairs: List[bytes | str]) -> Dict[str, List[str]]:
+    tokens_by_topic = defaultdict(list)
+    for pair in pairs:
+        topic_name, fcm_token = json.loads(pair)
+        tokens_by_topic[topic_name].append(fcm_token)
+    return tokens_by_topic
+
+def run_iid_batches(topic_name: str, tokens: List[str], subscribe: bool = True) -> List[str]:
+    """
+    Subscribe tokens to a topic, or unsubscribe them, in IID batch calls of up to 1000 tokens,
+    with at most FCM Batch Workers calls in flight. The HTTP calls run on the thread pool and
+    their responses are handled here, where the site context is available.
+    Returns the tokens worth trying again: those FCM reported a transient error for and those of
+    batches whose call failed with a transient error. Tokens rejected as invalid are deactivated
+    by the response handler, and every other failure is only logged.
+    """
+    batches = [tokens[i:i + IID_BATCH_SIZE] for i in range(0, len(tokens), IID_BATCH_SIZE)]
+    if not batches:
+        return []
+
+    call = messaging.subscribe_to_topic if subscribe else messaging.unsubscribe_from_topic
+    handle = handle_subscribe_response if subscribe else handle_unsubscribe_response
+    max_workers = min(len(batches), cint(get_settings().fcm_batch_workers) or DEFAULT_IID_WORKERS)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(call, batch, topic_name) for batch in batches]
+        for batch, future in zip(batches, futures):
+            try:
+                failed.extend(handle(batch, topic_name, future.result()))
+            except Exception as e:
+                frappe.log_error(title="FCM topic membership change failed", message=f"{topic_name}: {e}")
+                if isinstance(e, RETRYABLE_IID_CALL_ERRORS):
+                    failed.extend(batch)
+    return failed
+
+def enqueue_member_subscription(
+    members_by_topic: Dict[str, Set[str]],
+    project_name: str | None = None,
+    site_name: str | None = None
+) -> str:
+    """
+    Store the new members of each topic in Redis and enqueue a job subscribing their device tokens,
+    optionally only those of one project/site. Returns the id to look its progress up with.
+    """
+    subscription_id = frappe.generate_hash(length=10)
+    user_ids = set().union(*members_by_topic.values())
+    payload = {
+        "members_by_topic": {topic_name: sorted(members) for topic_name, members in members_by_topic.items()},
+        "project_name": project_name,
+        "site_name": site_name,
+    }
+    pipeline = frappe.cache.pipeline()
+    pipeline.set(frappe.cache.make_key(f"{SUBSCRIPTION_PREFIX}:members:{subscription_id}"), json.dumps(payload), ex=PROGRESS_TTL)
+    progress_key = frappe.cache.make_key(f"{SUBSCRIPTION_PREFIX}:progress:{subscription_id}")
+    pipeline.hset(progress_key, mapping={"users": len(user_ids), "users_done": 0, "retrying_tokens": 0})
+    pipeline.expire(progress_key, PROGRESS_TTL)
+    pipeline.execute()
+
+    frappe.enqueue(
+        "frappe_notifier.utils.topic_sync.subscribe_new_members",
+        queue="long",
+        job_id=f"{SUBSCRIPTION_PREFIX}:{subscription_id}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        subscription_id=subscription_id
+    )
+    return subscription_id
+
+def subscribe_new_members(subscription_id: str) -> None:
+    """
+    Background job: subscribe the device tokens of the members stored by enqueue_member_subscription.
+    Users are handled a page at a time in user order. The last user of every finished page is kept
+    in Redis, so an interrupted job resumes where it stopped, and after LONG_JOB_BUDGET seconds
+    the job hands over to a new one instead of running into the RQ timeout.
+    """
+    lock_key = frappe.cache.make_key(f"{SUBSCRIPTION_PREFIX}:lock:{subscription_id}")
+    if not frappe.cache.set(lock_key, 1, nx=True, ex=LONG_JOB_BUDGET * 2):
+        return
+
+    members_key = frappe.cache.make_key(f"{SUBSCRIPTION_PREFIX}:members:{subscription_id}")
+    progress_key = frappe.cache.make_key(f"{SUBSCRIPTION_PREFIX}:progress:{subscription_id}")
+    unfinished = False
+    try:
+        payload = frappe.cache.get(members_key)
+        if not payload:
+            return
+        payload = json.loads(payload)
+        members_by_topic = {topic_name: set(members) for topic_name, members in payload["members_by_topic"].items()}
+
+        initialize_firebase_app()
+        # Raw pipeline: frappe.cache.hget would prefix the key again and unpickle the value
+        pipeline = frappe.cache.pipeline()
+        pipeline.hget(progress_key, "after")
+        after = pipeline.execute()[0]
+        started = time.monotonic()
+        for last_user_id, users, queued in iter_member_subscriptions(
+            members_by_topic, payload["project_name"], payload["site_name"], after.decode() if after else ""
+        ):
+            pipeline = frappe.cache.pipeline()
+            pipeline.hset(progress_key, "after", last_user_id)
+            pipeline.hincrby(progress_key, "users_done", users)
+            pipeline.hincrby(progress_key, "retrying_tokens", queued)
+            pipeline.expire(progress_key, PROGRESS_TTL)
+            pipeline.execute()
+            if time.monotonic() - started > LONG_JOB_BUDGET:
+                unfinished = True
+                return
+
+        pipeline = frappe.cache.pipeline()
+        pipeline.hset(progress_key, "finished", 1)
+        pipeline.delete(members_key)
+        pipeline.execute()
+    finally:
+        frappe.cache.delete(lock_key)
+        if unfinished:
+            frappe.enqueue(
+                "frappe_notifier.utils.topic_sync.subscribe_new_members", queue="long", subscription_id=subscription_id
+            )
+
+def get_subscription_progress(subscription_id: str) -> Dict[str, int] | None:
+    """Users handled so far by a member subscription job and the tokens it handed to the sync job"""
+    pipeline = frappe.cache.pipeline()
+    pipeline.hgetall(frappe.cache.make_key(f"{SUBSCRIPTION_PREFIX}:progress:{subscription_id}"))
+    progress = pipeline.execute()[0]
+    if not progress:
+        return None
+    progress = {key.decode() if isinstance(key, bytes) else key: value for key, value in progress.items()}
+    return {
+        "users": cint(progress.get("users")),
+        "users_done": cint(progress.get("users_done")),
+        "retrying_tokens": cint(progress.get("retrying_tokens")),
+        "finished": bool(cint(progress.get("finished"))),
+    }
+
+def iter_member_subscriptions(
+    members_by_topic: Dict[str, Set[str]],
+    project_name: str | None = None,
+    site_name: str | None = None,
+    after: str = ""
+) -> Iterator[tuple]:
+    """
+    Subscribe the device tokens of new topic members, optionally only those of one project/site,
+    starting after the given user. Tokens are loaded a page of users at a time and shared by every
+    topic of the page. Tokens that failed with a transient error are queued for the topic sync job,
+    which caps their attempts; tokens rejected for good are not.
+    Yields the last user, the number of users and the number of queued tokens of every page.
+    """
+    user_ids = sorted(user_id for user_id in set().union(*members_by_topic.values()) if user_id > after)
+    for i in range(0, len(user_ids), USER_PAGE_SIZE):
+        page = user_ids[i:i + USER_PAGE_SIZE]
+        rows = [
+            (user_id, fcm_token)
+            for user_id, token_project, token_site, fcm_token in load_active_user_tokens(page)
+            if (not project_name or token_project == project_name)
+            and (not site_name or token_site == site_name)
+        ]
+        queued = 0
+        for topic_name, members in members_by_topic.items():
+            tokens = list(dict.fromkeys(fcm_token for user_id, fcm_token in rows if user_id in members))
+            retry = run_iid_batches(topic_name, tokens)
+            queue_pairs([json.dumps([topic_name, token]) for token in retry])
+            queued += len(retry)
+        yield page[-1], len(page), queued
+
+def enqueue_topic_removal(topic_name: str) -> None:
+    frappe.enqueue(
+        "frappe_notifier.utils.topic_sync.remove_topic",
+        queue="long",
+        job_id=f"{REMOVAL_PREFIX}:{topic_name}",
+        deduplicate=True,
+        topic_name=topic_name
+    )
+
+def remove_topic(topic_name: str) -> None:
+    """
+    Background job: unsubscribe every member token from a topic, then delete the topic.
+    Tokens are streamed in pages in row order. The last row of every finished page is kept
+    in Redis, so a removal that is interrupted resumes where it stopped when enqueued again.
+    After LONG_JOB_BUDGET seconds the job hands over to a new one instead of running into the RQ timeout.
+    """
+    lock_key = frappe.cache.make_key(f"{REMOVAL_PREFIX}:lock:{topic_name}")
+    if not frappe.cache.set(lock_key, 1, nx=True, ex=LONG_JOB_BUDGET * 2):
+        return
+
+    progress_key = frappe.cache.make_key(f"{REMOVAL_PREFIX}:progress:{topic_name}")
+    unfinished = False
+    try:
+        topic_doc_name = frappe.db.get_value("FN Notification Topic", {"topic_name": topic_name})
+        if not topic_doc_name:
+            frappe.cache.delete(progress_key)
+            return
+
+        initialize_firebase_app()
+        after = frappe.cache.get(progress_key)
+        started = time.monotonic()
+        for page in iter_topic_token_pages(topic_name, after.decode() if after else ""):
+            # Tokens the unsubscribe failed for are logged; the topic is gone for them either way
+            run_iid_batches(topic_name, [fcm_token for _, fcm_token in page], subscribe=False)
+            frappe.cache.set(progress_key, page[-1][0], ex=PROGRESS_TTL)
+            if time.monotonic() - started > LONG_JOB_BUDGET:
+                unfinished = True
+                return
+
+        frappe.delete_doc("FN Notification Topic", topic_doc_name, ignore_permissions=True)
+        invalidate_topic_tokens(topic_name)
+        frappe.db.commit()
+        frappe.cache.delete(progress_key)
+    finally:
+        frappe.cache.delete(lock_key)
+        if unfinished:
+            frappe.enqueue("frappe_notifier.utils.topic_sync.remove_topic", queue="long", topic_name=topic_name)
+
+def get_removal_progress(topic_name: str) -> str | None:
+    """The last token row unsubscribed by an unfinished removal of a topic"""
+    after = frappe.cache.get(frappe.cache.make_key(f"{REMOVAL_PREFIX}:progress:{topic_name}"))
+    return after.decode() if after else None
+
+def iter_topic_token_pages(topic_name: str, after: str = "") -> Iterator[List[tuple]]:
+    """Yield the (name, fcm_token) rows of the active tokens of a topic's members in pages, starting after the given row"""
+    topic_member = DocType("FN Topic Member")
+    device_token = DocType("FN User Device Token")
+    while True:
+        rows = (
+            frappe.qb.from_(device_token)
+            .join(topic_member)
+            .on(topic_member.user_id == device_token.user_id)
+            .select(device_token.name, device_token.fcm_token)
+            .distinct()
+            .where(topic_member.topic_name == topic_name)
+            .where(device_token.is_active == 1)
+            .where(device_token.name > after)
+            .orderby(device_token.name)
+            .limit(TOKEN_PAGE_SIZE)
+            .run()
+        )
+        if rows:
+            yield rows
+        if len(rows) < TOKEN_PAGE_SIZE:
+            return
+        after = rows[-1][0]